@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2010 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Announce a release on every channel at once.
+
+The release notes are read once and every channel turns them into its
+payload.  The payloads go to the outbox (see outbox.py) and are all
+delivered at the same time, each channel with its own timeout, then one
+summary is printed.  Whatever failed stays in the outbox and is retried in
+the background.  A channel that times out keeps going in a daemon thread
+until its handler gives up (the handlers get the timeout too) or pybdist
+exits, the outbox locks the record so the background worker doesn't
+deliver it at the same time.
+
+Channels are registered with register(), pybdist.py registers mail,
+freshmeat and twitter.  A project can add its own in setup.py:
+  ANNOUNCE_CHANNELS = {'irc': 'mytools.irc:announce'}
+the function gets a dict with name, version, date, notes, url and timeout
+and raises if it failed.  Other settings:
+  ANNOUNCE = ['mail', 'irc']        # channels to use, default all
+  ANNOUNCE_TIMEOUTS = {'mail': 30}  # seconds
+"""
+
+__author__ = 'Scott Kirkwood (scott+pybdist@forusers.com)'
+
+import collections
+import threading
+import time
+
+from . import outbox
+
+DEFAULT_TIMEOUT = 60
+
+ReleaseNotes = collections.namedtuple('ReleaseNotes', 'version date lines')
+
+Outcome = collections.namedtuple('Outcome', 'channel state seconds message')
+
+# name -> (make_payload(setup, notes), 'module:function', timeout, wanted(setup))
+_CHANNELS = collections.OrderedDict()
+
+class AnnounceException(Exception):
+  pass
+
+
+def register(name, make_payload, handler, timeout=DEFAULT_TIMEOUT, wanted=None):
+  """Add an announcement channel.
+  Args:
+    name: ex. 'twitter'
+    make_payload: function(setup, notes) returning the payload dict.
+    handler: 'module:function' delivering the payload, see outbox.py.
+    timeout: default seconds to wait for it.
+    wanted: function(config), False if the project can't use it.
+  """
+  _CHANNELS[name] = (make_payload, handler, timeout, wanted)
+
+
+def _plugin_payload(setup, notes):
+  return {
+      'name': setup.NAME,
+      'version': notes.version,
+      'date': notes.date,
+      'notes': '\n'.join(notes.lines),
+      'url': setup.SETUP['url'],
+  }
+
+
+def _channels(setup):
+  """Returns {name: (make_payload, handler, timeout)} this project can use."""
+  ret = collections.OrderedDict()
+  for name, (make_payload, handler, timeout, wanted) in _CHANNELS.items():
+    if wanted is None or wanted(setup):
+      ret[name] = (make_payload, handler, timeout)
+  plugins = setup.ANNOUNCE_CHANNELS
+  for name in sorted(plugins):
+    ret[name] = (_plugin_payload, plugins[name], DEFAULT_TIMEOUT)
+  return ret
+
+
+def configured(setup):
+  """Returns the names of the channels to announce on."""
+  available = _channels(setup)
+  names = setup.ANNOUNCE or list(available)
+  unknown = [name for name in names if name not in available]
+  if unknown:
+    raise AnnounceException('Unknown announcement channels %s, known are %s' % (
+        ', '.join(unknown), ', '.join(available)))
+  return names
+
+
+def _deliver(name, fname, start, delivered):
+  """Deliver the record, delivered[name] is (record or exception, seconds)."""
+  try:
+    record = outbox.deliver(fname)
+  except Exception as err:  # Reported in the channel's Outcome.
+    delivered[name] = (err, time.time() - start)
+    return
+  delivered[name] = (record, time.time() - start)
+
+
+def announce(setup, notes, names=None):
+  """Deliver the announcement on every channel concurrently.
+  Args:
+    setup: the ProjectConfig.
+    notes: ReleaseNotes of the release.
+    names: channels to use, None for configured(setup).
+  Returns:
+    list of Outcome
+  """
+  names = names or configured(setup)
+  available = _channels(setup)
+  timeouts = setup.ANNOUNCE_TIMEOUTS
+  jobs = []
+  outcomes = {}
+  for name in names:
+    make_payload, handler, timeout = available[name]
+    timeout = timeouts.get(name, timeout)
+    payload = make_payload(setup, notes)
+    payload['timeout'] = timeout
+    record = outbox.spool(setup.NAME, setup.VER, name, handler, payload)
+    if record['state'] == outbox.SENT:
+      outcomes[name] = Outcome(name, 'skipped', 0, 'Already announced')
+      continue
+    jobs.append((name, outbox.record_fname(setup.NAME, setup.VER, name), timeout))
+
+  delivered = {}
+  threads = {}
+  start = time.time()
+  for name, fname, _ in jobs:
+    # A handler that ignores its timeout mustn't keep pybdist from exiting,
+    # the record is then left pending (the lock goes with the process) and
+    # the worker retries it.
+    thread = threading.Thread(target=_deliver, args=(name, fname, start, delivered))
+    thread.daemon = True
+    thread.start()
+    threads[name] = thread
+  for name, _, timeout in jobs:
+    threads[name].join(max(0, start + timeout - time.time()))
+    if name not in delivered:
+      # The thread still owns the record, it saves what happens.
+      outcomes[name] = Outcome(name, 'timeout', timeout,
+                               'Still trying, will retry in the background')
+      continue
+    record, seconds = delivered[name]
+    if isinstance(record, Exception):
+      outcomes[name] = Outcome(name, 'error', seconds, '%s: %s' % (
+          record.__class__.__name__, record))
+    elif record['state'] == outbox.SENT:
+      outcomes[name] = Outcome(name, 'sent', seconds, '')
+    elif record['state'] == outbox.PENDING:
+      outcomes[name] = Outcome(name, 'retrying', seconds, record['last_error'])
+    else:
+      outcomes[name] = Outcome(name, 'failed', seconds, record['last_error'])
+  if any(outcome.state in ('timeout', 'retrying', 'error')
+         for outcome in outcomes.values()):
+    outbox.start_worker()
+  return [outcomes[name] for name in names]
+
+
+def print_summary(outcomes):
+  print('Announcements:')
+  for outcome in outcomes:
+    print('  %-12s %-9s %5.1fs %s' % (outcome.channel, outcome.state, outcome.seconds,
+                                      outcome.message or ''))
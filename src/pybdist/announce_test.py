@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2010 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests of announce.py against local stand-in HTTP and SMTP servers."""
+
+__author__ = 'Scott Kirkwood (scott+pybdist@forusers.com)'
+
+import http.server
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import urllib.request
+from unittest import mock
+
+from pybdist import announce
+from pybdist import outbox
+from pybdist import project_config
+from pybdist.mailinglist_test import SmtpStandIn
+
+
+def post_json(payload):
+  """A plugin channel, posts the payload to its url.
+
+  Doesn't use payload['timeout'] so a slow server outlasts the channel's.
+  """
+  data = json.dumps(payload).encode('utf-8')
+  with urllib.request.urlopen(payload['url'], data, timeout=30) as fin:
+    fin.read()
+
+
+class _HttpHandler(http.server.BaseHTTPRequestHandler):
+
+  def do_POST(self):
+    body = self.rfile.read(int(self.headers['Content-Length']))
+    time.sleep(self.server.delay)
+    self.server.posts.append(json.loads(body.decode('utf-8')))
+    self.send_response(200)
+    self.end_headers()
+
+  def log_message(self, *unused_args):
+    pass
+
+
+class HttpStandIn(http.server.ThreadingHTTPServer):
+  """A local HTTP server for tests, answers a POST after `delay` seconds."""
+  daemon_threads = True
+
+  def __init__(self):
+    http.server.ThreadingHTTPServer.__init__(self, ('127.0.0.1', 0), _HttpHandler)
+    self.delay = 0
+    self.posts = []
+
+  def start(self):
+    """Serve in a thread, returns the url to post to."""
+    thread = threading.Thread(target=self.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return 'http://127.0.0.1:%d/' % self.server_address[1]
+
+  def stop(self):
+    self.shutdown()
+    self.server_close()
+
+
+class AnnounceTest(unittest.TestCase):
+
+  def setUp(self):
+    self.http = HttpStandIn()
+    self.url = self.http.start()
+    self.smtp = SmtpStandIn()
+    self.smtp_address = self.smtp.start()
+    self.home = tempfile.mkdtemp()
+    self.env = mock.patch.dict(os.environ, {
+        'HOME': self.home, 'XDG_CACHE_HOME': os.path.join(self.home, 'cache')})
+    self.env.start()
+    self.channels = mock.patch.dict(announce._CHANNELS, clear=True)
+    self.channels.start()
+    announce.register('mail', self._mail_payload, 'pybdist.mailinglist:deliver')
+    # Nothing is left to a background process.
+    self.worker = mock.patch.object(outbox, 'start_worker')
+    self.start_worker = self.worker.start()
+    self.notes = announce.ReleaseNotes('1.0', '2026-10-18', ['Fixed things'])
+
+  def tearDown(self):
+    self.worker.stop()
+    self.channels.stop()
+    self.env.stop()
+    self.smtp.stop()
+    self.http.stop()
+    shutil.rmtree(self.home)
+
+  def _mail_payload(self, setup, notes):
+    return {
+        'subject': '%s %s released' % (setup.NAME, notes.version),
+        'message': '\n'.join(notes.lines) + '\n',
+        'routes': [('list@example.com', self.smtp_address)],
+        'sender': ('me@example.com', 'Me'),
+        'delivered': [],
+    }
+
+  def _setup(self, **values):
+    settings = dict(
+        NAME='demo', VER='1.0', DIR='.', RELEASE_FILE='RELEASE.rst',
+        SETUP={'url': self.url},
+        ANNOUNCE_CHANNELS={'web': '%s:post_json' % __name__,
+                           'web2': '%s:post_json' % __name__})
+    settings.update(values)
+    return project_config.from_namespace(settings)
+
+  def test_channels_in_parallel(self):
+    self.http.delay = 1
+    start = time.time()
+    outcomes = announce.announce(self._setup(), self.notes)
+    elapsed = time.time() - start
+    self.assertEqual([(outcome.channel, outcome.state) for outcome in outcomes],
+                     [('mail', 'sent'), ('web', 'sent'), ('web2', 'sent')])
+    # One after the other would take at least 2 seconds.
+    self.assertLess(elapsed, 1.8)
+    self.assertEqual(sorted(post['version'] for post in self.http.posts), ['1.0', '1.0'])
+    self.assertEqual(len(self.smtp.messages), 1)
+    self.assertIn(b'Subject: demo 1.0 released\r\n', self.smtp.messages[0])
+    self.assertFalse(self.start_worker.called)
+
+  def test_already_sent_is_skipped(self):
+    setup = self._setup(ANNOUNCE=['web'])
+    announce.announce(setup, self.notes)
+    outcomes = announce.announce(setup, self.notes)
+    self.assertEqual([outcome.state for outcome in outcomes], ['skipped'])
+    self.assertEqual(len(self.http.posts), 1)
+
+  def test_timeout_hands_over_to_the_outbox(self):
+    self.http.delay = 2
+    setup = self._setup(ANNOUNCE=['mail', 'web'], ANNOUNCE_TIMEOUTS={'web': 0.5})
+    start = time.time()
+    outcomes = dict((outcome.channel, outcome) for outcome in
+                    announce.announce(setup, self.notes))
+    self.assertLess(time.time() - start, 1.5)
+    self.assertEqual(outcomes['mail'].state, 'sent')
+    self.assertEqual(outcomes['web'].state, 'timeout')
+    self.assertTrue(self.start_worker.called)
+    # What the worker does, it waits for the thread that still has the
+    # record and doesn't post it again.
+    fname = outbox.record_fname('demo', '1.0', 'web')
+    record = outbox.deliver(fname)
+    self.assertEqual(record['state'], outbox.SENT)
+    self.assertEqual(record['attempts'], 1)
+    self.assertEqual(len(self.http.posts), 1)
+
+  def test_failed_channel_is_retried(self):
+    self.smtp.refuse = ['list@example.com']
+    outcomes = announce.announce(self._setup(ANNOUNCE=['mail', 'web']), self.notes)
+    self.assertEqual([outcome.state for outcome in outcomes], ['retrying', 'sent'])
+    self.assertIn('550', outcomes[0].message)
+    self.assertTrue(self.start_worker.called)
+    record = outbox.deliver(outbox.record_fname('demo', '1.0', 'mail'))
+    self.assertEqual(record['state'], outbox.PENDING)
+    self.assertGreater(record['next_try'], time.time())
+
+  def test_outbox_error_is_reported(self):
+    with mock.patch.object(outbox, 'deliver', side_effect=OSError('Disk full')):
+      outcomes = announce.announce(self._setup(ANNOUNCE=['web']), self.notes)
+    self.assertEqual([(outcome.state, outcome.message) for outcome in outcomes],
+                     [('error', 'OSError: Disk full')])
+    self.assertEqual(self.http.posts, [])
+    self.assertTrue(self.start_worker.called)
+
+
+if __name__ == '__main__':
+  unittest.main()
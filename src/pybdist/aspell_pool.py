@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2010 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Spell check with long running `aspell -a` processes.
+
+Starting aspell loads its dictionaries, which takes longer than checking a
+release notes file.  An AspellPool starts the aspell processes of a
+language the first time they are needed and keeps them for the whole run,
+the lines to check (see spell_batch.chunks_for()) are streamed through
+them.  Files of different languages are checked at the same time.
+
+  with aspell_pool.AspellPool('.') as pool:
+    results = pool.check_files([('RELEASE.rst', 'en'), ('README.pt_BR.rst', 'pt_BR')])
+"""
+
+__author__ = 'Scott Kirkwood (scott+pybdist@forusers.com)'
+
+import concurrent.futures
+import os
+import queue
+import subprocess
+import threading
+
+from . import cache
+from . import spell_batch
+
+class AspellPoolException(Exception):
+  pass
+
+
+class AspellWorker(object):
+  """One `aspell -a` process for one language."""
+
+  def __init__(self, lang, home_dir=None):
+    self.lang = lang
+    args = ['aspell', '-a', '--lang', lang, '--encoding', 'utf-8']
+    if home_dir:
+      args += ['--home-dir', home_dir]
+    try:
+      self.proc = subprocess.Popen(
+          args, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+          encoding='utf-8', errors='replace', bufsize=1)
+    except OSError as oserr:
+      raise AspellPoolException('Error running: %r: %r\nYou may need to install aspell' % (
+          ' '.join(args), oserr))
+    banner = self.proc.stdout.readline()
+    if not banner.startswith('@(#)'):
+      self.close()
+      raise AspellPoolException('Unable to start %r, no %r dictionary?' % (
+          ' '.join(args), lang))
+    # Terse mode, nothing is output for correct words.
+    self.proc.stdin.write('!\n')
+
+  def check_line(self, line):
+    """Returns a list of (col, word) misspelled in line."""
+    # The ^ stops aspell from reading the line as a command.
+    self.proc.stdin.write('^%s\n' % line.replace('\n', ' '))
+    self.proc.stdin.flush()
+    ret = []
+    while True:
+      resp = self.proc.stdout.readline()
+      if not resp:
+        raise AspellPoolException('aspell (%s) stopped unexpectedly' % self.lang)
+      resp = resp.rstrip('\n')
+      if not resp:
+        return ret
+      if resp[0] not in '&#':
+        continue
+      parts = resp.split(' ')
+      word = parts[1]
+      if resp[0] == '&':
+        offset = int(parts[3].rstrip(':'))
+      else:
+        offset = int(parts[2])
+      # Offsets count the ^, find the word to be sure.
+      col = line.find(word, max(0, offset - 1))
+      if col < 0:
+        col = max(0, offset - 1)
+      ret.append((col, word))
+
+  def close(self):
+    if self.proc.stdin:
+      self.proc.stdin.close()
+    self.proc.wait()
+
+
+class AspellPool(object):
+  """Long running aspell processes, up to `per_lang` for each language."""
+
+  def __init__(self, home_dir=None, per_lang=None):
+    self.home_dir = home_dir
+    self.per_lang = per_lang or os.cpu_count() or 2
+    self.lock = threading.Lock()
+    self.idle = {}
+    self.started = {}
+    self.workers = []
+    # lang -> AspellPoolException, the languages check_files() couldn't check.
+    self.errors = {}
+
+  def _acquire(self, lang):
+    with self.lock:
+      if lang not in self.idle:
+        self.idle[lang] = queue.Queue()
+        self.started[lang] = 0
+      start = self.idle[lang].empty() and self.started[lang] < self.per_lang
+      if start:
+        self.started[lang] += 1
+    if not start:
+      worker = self.idle[lang].get()
+      if isinstance(worker, AspellPoolException):
+        # Wake up the next one waiting too.
+        self.idle[lang].put(worker)
+        raise worker
+      return worker
+    try:
+      worker = AspellWorker(lang, self.home_dir)
+    except AspellPoolException as err:
+      with self.lock:
+        self.started[lang] -= 1
+      self.idle[lang].put(err)
+      raise
+    with self.lock:
+      self.workers.append(worker)
+    return worker
+
+  def check_text(self, text, lang, mode='rst'):
+    """Returns the misspellings as a list of [lineno, col, word]."""
+    worker = self._acquire(lang)
+    try:
+      ret = []
+      for lineno, col, chunk in spell_batch.chunks_for(text, mode):
+        for offset, word in worker.check_line(chunk):
+          ret.append([lineno, col + offset, word])
+      return ret
+    finally:
+      self.idle[lang].put(worker)
+
+  def check_file(self, fname, lang):
+    with open(fname, encoding='utf-8', errors='replace') as fin:
+      return self.check_text(fin.read(), lang, spell_batch.file_mode(fname))
+
+  def _salt(self, lang):
+    salt = spell_batch.SPELL_VERSION + 'aspell' + lang
+    personal = os.path.join(self.home_dir or os.path.expanduser('~'),
+                            '.aspell.%s.pws' % lang)
+    if os.path.exists(personal):
+      salt += cache.file_hash(personal)
+    return salt
+
+  def check_files(self, jobs):
+    """Spell check every (fname, lang), using the cache when possible.
+
+    The files of a language aspell can't check (ex. no dictionary) are left
+    out, the reason is in self.errors[lang].
+    Returns:
+      {fname: list of [lineno, col, word]}
+    """
+    spell_cache = cache.HashCache('spell')
+    ret = {}
+    todo = {}
+    for fname, lang in jobs:
+      key = cache.file_hash(fname, self._salt(lang) + spell_batch.file_mode(fname))
+      found = spell_cache.get(key)
+      if found is None:
+        todo[fname] = (lang, key)
+      else:
+        ret[fname] = found
+    if todo:
+      num_langs = len(set(lang for lang, _ in todo.values()))
+      with concurrent.futures.ThreadPoolExecutor(self.per_lang * num_langs) as executor:
+        futures = dict((fname, executor.submit(self.check_file, fname, lang))
+                       for fname, (lang, _) in todo.items())
+        for fname, future in futures.items():
+          lang, key = todo[fname]
+          try:
+            ret[fname] = future.result()
+          except AspellPoolException as err:
+            self.errors.setdefault(lang, err)
+            continue
+          spell_cache.put(key, ret[fname])
+    return dict((fname, ret[fname]) for fname, _ in jobs if fname in ret)
+
+  def close(self):
+    for worker in self.workers:
+      worker.close()
+    self.workers = []
+    self.idle = {}
+    self.started = {}
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, unused_type, unused_value, unused_tb):
+    self.close()
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2010 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Content addressed store for files that pybdist overwrites.
+
+Every backup is stored once, gzipped, under its sha1 hash:
+  ~/.cache/pybdist/backups/objects/ab/cdef0123...gz
+
+A small index (index.json) maps (project, path, time) to the hash, so the
+same README.rst from different projects or successive runs doesn't clobber
+the previous copy, and identical contents only take space once.
+
+Several releases can run at once, so the index and the objects are only
+changed while holding the index lock.  store() only removes the objects of
+the entries it drops; prune() also collects anything left unreferenced.
+"""
+
+__author__ = 'Scott Kirkwood (scott+pybdist@forusers.com)'
+
+import contextlib
+import fcntl
+import gzip
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+
+from . import util
+
+logging.basicConfig()
+LOG = logging.getLogger('pybdist')
+
+# Retention policy, the newest KEEP_PER_PATH versions of any one file are
+# always kept, older ones are dropped once they are more than MAX_AGE_DAYS old.
+KEEP_PER_PATH = 10
+MAX_AGE_DAYS = 90
+
+class BackupException(Exception):
+  pass
+
+
+def _backup_dir():
+  return util.get_cache_dir('backups')
+
+
+def _object_name(digest):
+  return os.path.join(_backup_dir(), 'objects', digest[:2], digest[2:] + '.gz')
+
+
+def _index_name():
+  return os.path.join(_backup_dir(), 'index.json')
+
+
+@contextlib.contextmanager
+def _index_lock():
+  """Hold an exclusive lock on the index, waiting for any other holder.
+
+  The lock is on a separate file since index.json is replaced by rename.
+  """
+  with open(_index_name() + '.lock', 'w') as lock_file:
+    fcntl.flock(lock_file, fcntl.LOCK_EX)
+    yield
+
+
+def _read_index():
+  fname = _index_name()
+  if not os.path.exists(fname):
+    return []
+  with open(fname) as fin:
+    return json.load(fin)
+
+
+def _write_index(entries):
+  """Atomically replace the index with `entries`."""
+  dirname = _backup_dir()
+  t_out, fname_tmp = tempfile.mkstemp('.tmp', 'index', dir=dirname)
+  with os.fdopen(t_out, 'w') as fout:
+    json.dump(entries, fout, indent=1)
+  os.rename(fname_tmp, _index_name())
+
+
+def _store_object(data):
+  """Store `data` (bytes) compressed and return its hash."""
+  digest = hashlib.sha1(data).hexdigest()
+  obj_name = _object_name(digest)
+  if os.path.exists(obj_name):
+    LOG.info('Backup object %s already stored', digest)
+    return digest
+  obj_dir = os.path.dirname(obj_name)
+  if not os.path.isdir(obj_dir):
+    os.makedirs(obj_dir)
+  t_out, fname_tmp = tempfile.mkstemp('.tmp', digest[2:], dir=obj_dir)
+  with os.fdopen(t_out, 'wb') as fout:
+    with gzip.GzipFile(fileobj=fout, mode='wb', mtime=0) as gz:
+      gz.write(data)
+  os.rename(fname_tmp, obj_name)
+  return digest
+
+
+def store(fname, project=None):
+  """Backup the current contents of `fname`.
+
+  Args:
+    fname: file to backup, must exist.
+    project: name of the project, defaults to the current directory's name.
+  Returns:
+    The hash of the contents.
+  """
+  if not project:
+    project = os.path.basename(os.getcwd())
+  with open(fname, 'rb') as fin:
+    data = fin.read()
+  with _index_lock():
+    digest = _store_object(data)
+    entries = _read_index()
+    entries.append(dict(project=project, path=os.path.abspath(fname),
+                        time=time.time(), hash=digest, size=len(data)))
+    kept = _apply_retention(entries)
+    _write_index(kept)
+    if len(kept) < len(entries):
+      _remove_dropped(entries, kept)
+  LOG.info('backup of %r stored as %s', fname, digest)
+  return digest
+
+
+def _apply_retention(entries, keep=KEEP_PER_PATH, max_age_days=MAX_AGE_DAYS):
+  """Returns the entries that survive the retention policy."""
+  cutoff = time.time() - max_age_days * 24 * 60 * 60
+  by_path = {}
+  for entry in entries:
+    by_path.setdefault((entry['project'], entry['path']), []).append(entry)
+  ret = []
+  for versions in list(by_path.values()):
+    versions.sort(key=lambda entry: entry['time'], reverse=True)
+    for num, entry in enumerate(versions):
+      if num < keep or entry['time'] >= cutoff:
+        ret.append(entry)
+  ret.sort(key=lambda entry: entry['time'])
+  return ret
+
+
+def _remove_dropped(entries, kept):
+  """Delete the objects of entries not in `kept` that no kept entry uses."""
+  referenced = set(entry['hash'] for entry in kept)
+  for digest in set(entry['hash'] for entry in entries) - referenced:
+    LOG.info('Removing old backup %s', digest)
+    try:
+      os.unlink(_object_name(digest))
+    except OSError:
+      pass
+
+
+def _remove_unreferenced(entries):
+  """Delete any stored object no longer referenced by the index."""
+  referenced = set(entry['hash'] for entry in entries)
+  obj_root = os.path.join(_backup_dir(), 'objects')
+  if not os.path.isdir(obj_root):
+    return
+  for subdir in os.listdir(obj_root):
+    obj_dir = os.path.join(obj_root, subdir)
+    for fname in os.listdir(obj_dir):
+      if not fname.endswith('.gz'):
+        continue
+      if subdir + fname[:-3] not in referenced:
+        LOG.info('Removing old backup %s%s', subdir, fname[:-3])
+        os.unlink(os.path.join(obj_dir, fname))
+
+
+def prune(keep=KEEP_PER_PATH, max_age_days=MAX_AGE_DAYS):
+  """Apply the retention policy to the whole store.
+
+  Also removes objects nothing refers to, ex. left by an interrupted store().
+  """
+  with _index_lock():
+    entries = _apply_retention(_read_index(), keep, max_age_days)
+    _write_index(entries)
+    _remove_unreferenced(entries)
+
+
+def list_entries(project=None):
+  """Returns the index entries, newest first.
+  Args:
+    project: only return entries for this project, or all if None.
+  """
+  entries = [entry for entry in _read_index()
+             if not project or entry['project'] == project]
+  entries.sort(key=lambda entry: entry['time'], reverse=True)
+  return entries
+
+
+def _find_entry(hash_prefix):
+  found = [entry for entry in list_entries()
+           if entry['hash'].startswith(hash_prefix)]
+  if not found:
+    raise BackupException('No backup matching %r' % hash_prefix)
+  if len(set(entry['hash'] for entry in found)) > 1:
+    raise BackupException('Backup %r is ambiguous' % hash_prefix)
+  return found[0]
+
+
+def read(hash_prefix):
+  """Returns the contents (bytes) of the backup."""
+  entry = _find_entry(hash_prefix)
+  with gzip.open(_object_name(entry['hash']), 'rb') as fin:
+    return fin.read()
+
+
+def restore(hash_prefix, dest=None):
+  """Restore a backup to its original location or `dest`.
+
+  The file being replaced is itself backed up first.
+  Args:
+    hash_prefix: hash or the start of the hash of the entry.
+    dest: where to write the file, defaults to the original path.
+  Returns:
+    The filename written.
+  """
+  entry = _find_entry(hash_prefix)
+  data = read(entry['hash'])
+  if not dest:
+    dest = entry['path']
+  if os.path.exists(dest):
+    store(dest, entry['project'])
+  dirname = os.path.dirname(os.path.abspath(dest))
+  t_out, fname_tmp = tempfile.mkstemp('.tmp', 'restore', dir=dirname)
+  with os.fdopen(t_out, 'wb') as fout:
+    fout.write(data)
+  os.rename(fname_tmp, dest)
+  print('Restored %r from %s' % (dest, entry['hash']))
+  return dest
+
+
+def print_entries(project=None):
+  for entry in list_entries(project):
+    datestr = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry['time']))
+    print('%s %s %-12s %7d %s' % (entry['hash'][:12], datestr,
+        entry['project'], entry['size'], entry['path']))
+
+
+if __name__ == '__main__':
+  print_entries()
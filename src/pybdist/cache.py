@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2010 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Small on-disk cache of JSON values keyed by content hash.
+
+Used to skip work on files that haven't changed since the last run, ex.
+  msgs = cache.HashCache('pot')
+  key = cache.file_hash(fname)
+  found = msgs.get(key)
+  if found is None:
+    found = extract(fname)
+    msgs.put(key, found)
+"""
+
+__author__ = 'Scott Kirkwood (scott+pybdist@forusers.com)'
+
+import hashlib
+import json
+import os
+import tempfile
+
+from . import metrics
+from . import util
+
+def text_hash(text, salt=''):
+  """Returns the sha1 hex digest of text (str or bytes)."""
+  if isinstance(text, str):
+    text = text.encode('utf-8')
+  digest = hashlib.sha1(salt.encode('utf-8'))
+  digest.update(text)
+  return digest.hexdigest()
+
+
+def file_hash(fname, salt=''):
+  """Returns the sha1 hex digest of the contents of fname."""
+  with open(fname, 'rb') as fin:
+    return text_hash(fin.read(), salt)
+
+
+class HashCache(object):
+  """JSON values stored under ~/.cache/pybdist/<name>/ by key."""
+
+  def __init__(self, name):
+    self.name = name
+    self.dirname = util.get_cache_dir(name)
+    self.hits = 0
+    self.misses = 0
+
+  def _fname(self, key):
+    return os.path.join(self.dirname, key[:2], key + '.json')
+
+  def get(self, key, default=None):
+    fname = self._fname(key)
+    try:
+      with open(fname) as fin:
+        value = json.load(fin)
+    except (IOError, OSError, ValueError):
+      self.misses += 1
+      metrics.cache_lookup(self.name, False)
+      return default
+    self.hits += 1
+    metrics.cache_lookup(self.name, True)
+    return value
+
+  def put(self, key, value):
+    fname = self._fname(key)
+    dirname = os.path.dirname(fname)
+    if not os.path.isdir(dirname):
+      os.makedirs(dirname, exist_ok=True)
+    t_out, fname_tmp = tempfile.mkstemp('.tmp', key[:8], dir=dirname)
+    with os.fdopen(t_out, 'w') as fout:
+      json.dump(value, fout)
+    os.rename(fname_tmp, fname)
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2010 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Keeps RELEASE.rst and debian/changelog in sync, entry by entry.
+
+The two histories are compared by version:
+  * releases missing from debian/changelog are inserted at the right spot,
+  * changelog entries missing from RELEASE.rst are added back to it,
+  * entries in both whose notes differ get the RELEASE.rst notes, only
+    the body is replaced, the changelog header and signature are kept.
+
+Only the affected byte ranges are written, see
+update_file.Transaction.patch_bytes().
+"""
+
+__author__ = 'Scott Kirkwood (scott+pybdist@forusers.com)'
+
+import os
+import re
+
+from . import release
+
+class SyncPlan(object):
+  """The byte patches needed to bring both files in sync."""
+
+  def __init__(self, release_fname, changelog_fname):
+    self.release_fname = release_fname
+    self.changelog_fname = changelog_fname
+    self.release_patches = []
+    self.changelog_patches = []
+    self.messages = []
+
+  def empty(self):
+    return not self.release_patches and not self.changelog_patches
+
+  def stage(self, trans):
+    """Stage the patches in an update_file.Transaction."""
+    for start, end, data in self.release_patches:
+      trans.patch_bytes(self.release_fname, start, end, data)
+    for start, end, data in self.changelog_patches:
+      trans.patch_bytes(self.changelog_fname, start, end, data)
+
+
+def _lines_different(lines1, lines2):
+  return [l.strip() for l in lines1] != [l.strip() for l in lines2]
+
+
+def _insert_offset(hist, other_hist, index, fname):
+  """Where to insert entry `index` of `hist` into `other_hist`.
+
+  That's just before the next older entry that other_hist already has,
+  or the end of the file.
+  """
+  for entry in hist.entries[index + 1:]:
+    if entry.version in other_hist.by_version:
+      return other_hist.get(entry.version).start
+  return os.path.getsize(fname)
+
+
+def _needs_separator(fname, offset):
+  """True if the file doesn't end with a blank line before offset."""
+  with open(fname, 'rb') as fin:
+    fin.seek(max(0, offset - 2))
+    return fin.read() != b'\n\n'
+
+
+def _group_inserts(fname, inserts):
+  """Returns one patch per offset, keeping the inserts in order."""
+  by_offset = {}
+  order = []
+  for offset, text in inserts:
+    if offset not in by_offset:
+      by_offset[offset] = []
+      order.append(offset)
+    by_offset[offset].append(text)
+  ret = []
+  for offset in order:
+    text = ''.join(by_offset[offset])
+    if offset and offset == os.path.getsize(fname):
+      text = text.rstrip('\n') + '\n'
+      if _needs_separator(fname, offset):
+        text = '\n' + text
+    ret.append((offset, offset, text.encode('utf-8')))
+  return ret
+
+
+def _changelog_body_span(cl_hist, cl_entry):
+  """Returns the byte span between the header and the signature line."""
+  raw = cl_hist.read_text(cl_entry)
+  grps = re.search('(?m)%s' % release.RE_DEB_DATE, raw)
+  if not grps or '\n' not in raw:
+    return None
+  header_end = raw.index('\n') + 1
+  start = cl_entry.start + len(raw[:header_end].encode('utf-8'))
+  end = cl_entry.start + len(raw[:grps.start()].encode('utf-8'))
+  return start, end
+
+
+def plan(settings, rel_hist, cl_hist):
+  """Work out what changes are needed to sync the files.
+  Args:
+    settings: setup information.
+    rel_hist: release.ReleaseHistory of RELEASE.rst.
+    cl_hist: release.ReleaseHistory of debian/changelog.
+  Returns:
+    SyncPlan
+  """
+  sync = SyncPlan(rel_hist.fname, cl_hist.fname)
+
+  inserts = []
+  for index, entry in enumerate(rel_hist.entries):
+    ver, date, lines = rel_hist.read(entry)
+    if ver in cl_hist.by_version:
+      cl_entry = cl_hist.get(ver)
+      _, _, cl_lines = cl_hist.read(cl_entry)
+      if not _lines_different(lines, cl_lines):
+        continue
+      span = _changelog_body_span(cl_hist, cl_entry)
+      if not span:
+        sync.messages.append('** Unable to find the end of %s in %r' % (
+            ver, cl_hist.fname))
+        continue
+      body = '\n' + ''.join('  %s\n' % line for line in lines) + '\n'
+      sync.changelog_patches.append((span[0], span[1], body.encode('utf-8')))
+      sync.messages.append('Update notes of %s in %r' % (ver, cl_hist.fname))
+      continue
+    if index == 0:
+      datestr = None  # A new release, dated now.
+    else:
+      datestr = release.release_date_to_deb(date)
+    offset = _insert_offset(rel_hist, cl_hist, index, cl_hist.fname)
+    text = '\n'.join(release.out_debian_changelog(settings, lines, ver, datestr))
+    inserts.append((offset, text))
+    sync.messages.append('Add %s to %r' % (ver, cl_hist.fname))
+  sync.changelog_patches += _group_inserts(cl_hist.fname, inserts)
+
+  if settings.RELEASE_FORMAT:
+    # We can't write entries in somebody else's format.
+    return sync
+  inserts = []
+  for index, cl_entry in enumerate(cl_hist.entries):
+    if cl_entry.version in rel_hist.by_version:
+      continue
+    ver, date, cl_lines = cl_hist.read(cl_entry)
+    rel_date = release.deb_date_to_release(date or '') or date or ''
+    lines = []
+    for line in cl_lines:
+      if line.startswith('  '):
+        line = line[2:]
+      lines.append(line)
+    entry_lines = release.out_release(ver, rel_date, lines)
+    if not re.match(release.DEFAULT_RELEASE_FORMAT, entry_lines[0]):
+      sync.messages.append('** Unable to write %s in %r' % (ver, rel_hist.fname))
+      continue
+    offset = _insert_offset(cl_hist, rel_hist, index, rel_hist.fname)
+    text = '\n'.join(entry_lines) + '\n'
+    inserts.append((offset, text))
+    sync.messages.append('Add %s to %r' % (ver, rel_hist.fname))
+  sync.release_patches += _group_inserts(rel_hist.fname, inserts)
+  return sync
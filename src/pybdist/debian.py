@@ -29,8 +29,8 @@ call push pushes tag etc to git.
 
 import os
 import shutil
-import subprocess
 import textwrap
+from . import profiling
 from . import util
 
 class DebianException(Exception):
@@ -70,12 +70,8 @@ def _move_top_files_to_dir(from_dir, to_dir):
 
 
 def _run_or_die(args, output=True):
-  """Run the `args` (a list) or dies."""
-  if output:
-    print(' '.join(args))
-  ret = subprocess.call(args)
-  if ret:
-    raise DebianException('Error running: %r' % ' '.join(args))
+  """Run the `args` (a list) or dies, see profiling.run_or_die()."""
+  return profiling.run_or_die(args, None, output, DebianException)
 
 def _get_deb_dir():
   # Move
@@ -143,7 +139,7 @@ def control_file(setup):
   lines.append('Build-Depends: cdbs, debhelper (>= 7), python (>= 2.4), python-support')
   lines.append('Standards-Version: 3.8.4')
   lines.append('Homepage: %s' % setup.SETUP['url'])
-  vcs = setup.VCS
+  vcs = setup.VCS or ''
   if vcs.endswith('/hg/'):
     lines.append('Vcs-Hg: %s' % vcs)
     lines.append('Vcs-Browser: %s' % vcs)
@@ -28,17 +28,18 @@ DEPENDS ex. DEPENDS = ['python-twitter']
 
 __author__ = 'Scott Kirkwood (scott+pybdist@forusers.com)'
 
-import apt
-import gettext
 import logging
 import os
 import re
 import textwrap
 import time
-import urllib.request, urllib.error, urllib.parse
+from . import metrics
+from . import mo_catalog
+from . import project_config
 from . import util
 
-gettext.install('pybdist')
+# Changed by _set_locale() to the language of the file being written.
+_ = util.translate
 logging.basicConfig()
 LOG = logging.getLogger('pybdist')
 
@@ -90,6 +91,10 @@ def _underline(word, char='-'):
   return [word, char * len(word)]
 
 def _fill_depends(setup):
+  try:
+    import apt
+  except ImportError:
+    raise ImportError('You need to install python-apt, try sudo "apt-get install python-apt"')
   lines = []
   apt_cache = apt.Cache()
   longest = 0
@@ -128,7 +133,7 @@ def _readme_lines(setup):
     lines.append(_('Latest downloads can be found at:'))
     lines.append('  %s/downloads/list' % url)
 
-  if hasattr(setup, 'DEPENDS'):
+  if setup.DEPENDS:
     lines.append('')
     lines += _underline(_('Requirements'))
     lines.append('')
@@ -149,9 +154,9 @@ def _readme_lines(setup):
   return lines
 
 def _langs(setup):
-  if hasattr(setup, 'LANGS'):
+  if setup.LANGS:
     LOG.info('Will output %d README language files.', len(setup.LANGS))
-    return [''] + setup.LANGS
+    return [''] + list(setup.LANGS)
   else:
     return ['']
 
@@ -172,10 +177,10 @@ def _set_locale(setup, lang):
     locale = ''
   locale_dir = os.path.join(setup.DIR, 'locale')
   locale_dir = os.path.abspath(locale_dir)
-  gtext = gettext.translation(setup.NAME, locale_dir, languages=[locale],
+  gtext = mo_catalog.translation(setup.NAME, locale_dir, languages=[locale],
     fallback=True)
-  gtext.install(str=True)
-  _ = gtext.ugettext
+  gtext.install()
+  _ = gtext.gettext
   return dot_lang
 
 def out_readme(setup):
@@ -185,13 +190,10 @@ def out_readme(setup):
   for lang in langs:
     dot_lang = _set_locale(setup, lang)
     fname = 'README%s.rst' % dot_lang
-    func = _
-    setup.SETUP['description'] = func(eng_desc)
-    setup.SETUP['long_description'] = func(eng_long_desc)
-    util._safe_overwrite(_readme_lines(setup), fname)
+    lang_setup = project_config.with_setup(
+        setup, description=_(eng_desc), long_description=_(eng_long_desc))
+    util._safe_overwrite(_readme_lines(lang_setup), fname, setup.NAME)
   _set_locale(setup, '')
-  setup.SETUP['description'] = eng_desc
-  setup.SETUP['long_description'] = eng_long_desc
 
 def out_license(setup):
   lic_text = setup.SETUP['license']
@@ -211,7 +213,9 @@ def out_license(setup):
     LOG.info('License file already exists as %r' % license_fname)
   url, y_regex, name_regex = to_fetch
   if url.startswith('http'):
-    txt = urllib.request.urlopen(url).read()
+    import urllib.request
+    with metrics.request('license'):
+      txt = urllib.request.urlopen(url).read()
   else:
     txt = open(os.path.join(os.path.dirname(__file__), url)).read()
     if url.endswith('rot13'):
@@ -220,26 +224,20 @@ def out_license(setup):
   year = time.strftime('%Y', time.localtime())
   re_yyyy = re.compile(y_regex, re.DOTALL)
   txt = re_yyyy.sub(year, txt)
-  copyright_name = setup.SETUP['author']
-  if hasattr(setup, 'COPYRIGHT_NAME'):
-    copyright_name = setup.COPYRIGHT_NAME
+  copyright_name = setup.COPYRIGHT_NAME or setup.SETUP['author']
   if name_regex:
     re_name = re.compile(name_regex, re.DOTALL)
     txt = re_name.sub(copyright_name, txt)
   else:
     txt += ' ' + copyright_name
-  util._safe_overwrite(txt.split('\n'), license_fname)
+  util._safe_overwrite(txt.split('\n'), license_fname, setup.NAME)
 
 def _install_lines(setup):
   lines = _title(_('Installing %s') % setup.NAME)
   lines.append('')
   lines += _underline('Downloading')
   lines.append('')
-  vcs = None
-  if hasattr(setup, 'VCS'):
-    vcs = setup.VCS
-  else:
-    vcs = setup.SETUP['url']
+  vcs = setup.VCS or setup.SETUP['url']
   url = setup.SETUP['url']
   if 'code.google.com/' in vcs:
     LOG.info('Adding code.google.com links')
@@ -275,7 +273,7 @@ def _install_lines(setup):
   lines.append('Should install everything you need, then run:')
   lines.append('  $ sudo dpkg -i %s*.deb # again' % setup.NAME)
 
-  if hasattr(setup, 'DEPENDS'):
+  if setup.DEPENDS:
     lines.append('')
     lines += _underline(_('Dependancies'))
     lines.append('')
@@ -292,7 +290,7 @@ def out_install(setup):
   for lang in langs:
     dot_lang = _set_locale(setup, lang)
     fname = 'INSTALL%s.rst' % dot_lang
-    util._safe_overwrite(_install_lines(setup), fname)
+    util._safe_overwrite(_install_lines(setup), fname, setup.NAME)
   _set_locale(setup, '')
 
 if __name__ == '__main__':
@@ -301,7 +299,9 @@ if __name__ == '__main__':
   setup_dir = os.path.abspath(__file__ + '/../../..')
   print(setup_dir)
   sys.path.insert(0, setup_dir)
+  from . import project_config
   import setup
+  setup = project_config.from_module(setup)
   out_readme(setup)
   out_license(setup)
   out_install(setup)
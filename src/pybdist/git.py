@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2010 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Ask git about the working copy, same interface as mercurial.py."""
+
+__author__ = 'Scott Kirkwood (scott+pybdist@forusers.com)'
+
+import collections
+import os
+import subprocess
+
+NAME = 'Git'
+# Changes when files are added, removed or committed.
+STATE_FILE = os.path.join('.git', 'index')
+
+StatusEntry = collections.namedtuple('StatusEntry', 'code path')
+
+class GitException(Exception):
+  pass
+
+
+def _run(args, output=True):
+  """Run the git command `args`.
+  Returns:
+    retcode (-999 if git couldn't be run), output text
+  """
+  if output:
+    print(' '.join(['git'] + args))
+  try:
+    proc = subprocess.Popen(['git'] + args, stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE)
+  except OSError:
+    return -999, ''
+  out, err = proc.communicate()
+  if err and output:
+    print(err.decode('utf-8', 'replace').rstrip())
+  return proc.returncode, out.decode('utf-8', 'replace')
+
+
+def status():
+  """Returns the list of StatusEntry of files that aren't clean, or None."""
+  ret, out = _run(['status', '--porcelain', '-z'], False)
+  if ret == -999:
+    return None
+  if ret:
+    raise GitException('git status failed with code %r' % ret)
+  entries = []
+  records = out.split('\0')
+  while records:
+    record = records.pop(0)
+    if not record:
+      continue
+    code = record[:2].strip()
+    entries.append(StatusEntry(code, record[3:]))
+    if code[0] in 'RC':
+      records.pop(0)  # The name it was renamed or copied from.
+  return entries
+
+
+def tracked_files():
+  """Returns the list of files under version control, or None."""
+  ret, out = _run(['ls-files', '-z'], False)
+  if ret:
+    return None
+  return [fname for fname in out.split('\0') if fname]
+
+
+def outgoing():
+  """Returns the list of commit ids not pushed yet, or None if unknown."""
+  ret, out = _run(['rev-list', '@{upstream}..HEAD'], False)
+  if ret:
+    return None
+  return [line for line in out.splitlines() if line]
+
+
+def needs_git_push(verbose=True):
+  """Checks if git thinks we need to push."""
+  commits = outgoing()
+  if commits is None:
+    # No git, not a git repository or no upstream branch.
+    if verbose:
+      print('Git remote version unknown, no upstream branch')
+    return False
+  if commits == []:
+    if verbose:
+      print('Git remote version up-to-date')
+    return False
+  if verbose:
+    print('Git remote version needs push')
+  return True
+
+
+def needs_git_commit(verbose=True):
+  entries = status()
+  if entries is None:
+    if verbose:
+      print('Git not found')
+    return False
+  if not entries:
+    if verbose:
+      print('Git does not need a commit')
+    return False
+  if verbose:
+    print('Git needs commit, %d files out of date' % len(entries))
+    print('\n'.join('%s %s' % entry for entry in entries))
+  return True
+
+# The interface shared with mercurial.py.
+needs_commit = needs_git_commit
+needs_push = needs_git_push
+
+if __name__ == '__main__':
+  needs_git_commit()
+  needs_git_push()
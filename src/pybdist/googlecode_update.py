@@ -4,10 +4,12 @@
 #
 
 from . import googlecode_upload
+from . import metrics
 import hashlib
 import os
 import sys
 import re
+import time
 import urllib.request, urllib.error, urllib.parse
 
 def get_download_list(project_name):
@@ -22,9 +24,10 @@ def get_download_list(project_name):
   """
   url = 'http://code.google.com/feeds/p/%s/downloads/basic' % project_name
   try:
-    fin = urllib.request.urlopen(url)
-    text = fin.read()
-    fin.close()
+    with metrics.request('googlecode'):
+      fin = urllib.request.urlopen(url)
+      text = fin.read()
+      fin.close()
   except urllib.error.URLError:
     text = ''
   re_entry = re.compile(r'<entry>(.+?)</entry>', re.DOTALL)
@@ -86,9 +89,10 @@ def get_file_details(project_name, fname):
       project_name, fname)
   print('Checking SHA1 at %r' % url)
   try:
-    fin = urllib.request.urlopen(url, timeout=200)
-    text = fin.read()
-    fin.close()
+    with metrics.request('googlecode'):
+      fin = urllib.request.urlopen(url, timeout=200)
+      text = fin.read()
+      fin.close()
   except urllib.error.HTTPError:
     text = ''
   sha1 = _safe_search(r'SHA1 Checksum: ([^<]+)', text, re.DOTALL)
@@ -108,9 +112,10 @@ def get_file_details(project_name, fname):
 def download_file(project_name, fname, dist_dir):
   """Downloads to file to distdir."""
   url = 'http://%s.googlecode.com/files/%s' % (project_name, fname)
-  fin = urllib.request.urlopen(url, timeout=200)
-  text = fin.read()
-  fin.close()
+  with metrics.request('googlecode'):
+    fin = urllib.request.urlopen(url, timeout=200)
+    text = fin.read()
+    fin.close()
   outfilename = os.path.join(dist_dir, fname)
   if not os.path.exists(dist_dir):
     os.makedirs(dist_dir)
@@ -154,13 +159,17 @@ def maybe_upload_file(project_name, dist_dir, fname,
       print('SHA1 checksums don\'t match, uploading %r.' % fname)
     else:
       print('File not there, uploading %r.' % fname)
-    status, reason, url= googlecode_upload.upload(
-      os.path.join(dist_dir, fname), project_name, username, password, summary, labels)
+    start = time.time()
+    with metrics.request('googlecode'):
+      status, reason, url= googlecode_upload.upload(
+        os.path.join(dist_dir, fname), project_name, username, password, summary, labels)
+    seconds = time.time() - start
     if not url:
       print('%r, %r' % (status, reason))
       print('%r, %r, %r, %r' % (os.path.join(dist_dir, fname), project_name, summary, labels))
       #print '%r, %r' % (username, password)
       sys.exit(-1)
+    metrics.record_upload('googlecode', dist_filename, seconds)
   else:
     print('Checksums match, not uploading %r.' % fname)
 
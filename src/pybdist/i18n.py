@@ -20,33 +20,29 @@ try:
   import polib
 except ImportError:
   raise ImportError('You need to install polib, try sudo "apt-get install python-polib"')
-import subprocess
 import time
 
+from . import mo_compile
+from . import po_merge
+from . import po_stats
+from . import pot_extract
+from . import trans_memory
+
 class I18nException(Exception):
   pass
 
-def _run_or_die(args, output=True):
-  """Run the `args` (a list) or dies."""
-  if output:
-    print(' '.join(args))
-  ret = subprocess.call(args)
-  if ret:
-    raise I18nException('Error running: %r' % ' '.join(args))
-
 def build_get_text(out_pot, dirs):
   """Creates .pot file from source python files.
   Args:
     out_pot: name of output .pot file to create.
-    dirs: list of globs ex, ['src/*.py']
+    dirs: list of files, globs or directories ex, ['setup.py', 'src']
   Throw:
     I18nException on error
   """
-  args = [
-      'pygettext',
-      '--output', out_pot,
-      ] + dirs
-  _run_or_die(args)
+  try:
+    pot_extract.build_pot(out_pot, dirs)
+  except pot_extract.PotExtractException as err:
+    raise I18nException(str(err))
 
 def make_empty_po_file(fname, lang, setup):
   po = polib.POFile()
@@ -66,6 +62,7 @@ def make_empty_po_file(fname, lang, setup):
 def update_po_files(potfile, locale_dir, langs):
   """Merge an old translated .po with the new messages.pot into one.
   Creates loacaldir/lang/LC_MESSAGES/
+  The languages are merged in parallel, see po_merge.py.
   Args:
     potfile: source potfile to merge from.
     locale_dir: ex. src/app/locale
@@ -77,6 +74,7 @@ def update_po_files(potfile, locale_dir, langs):
     raise I18nException('Your .pot file must end with .pot %r' % potfile)
   po_name = os.path.split(potfile)[1].replace('.pot', '.po')
   missing = []
+  to_merge = []
   for lang in langs:
     curdir = os.path.join(locale_dir, lang, 'LC_MESSAGES')
     if not os.path.exists(curdir):
@@ -85,21 +83,48 @@ def update_po_files(potfile, locale_dir, langs):
     if not os.path.exists(outfile):
       missing.append((lang, outfile))
       continue
-    args = [
-        'msgmerge',
-        outfile,
-        potfile,
-        '-o', outfile
-        ]
-    _run_or_die(args)
+    to_merge.append(outfile)
+  for outfile, changed in po_merge.merge_files(to_merge, potfile):
+    if changed:
+      print('Merged %r' % outfile)
+    else:
+      print('%r is up to date' % outfile)
   return missing
 
+def prefill_po_files(locale_dir, langs, tm_dirs):
+  """Fill untranslated messages from the translation memory.
+  Args:
+    locale_dir: ex. src/app/locale
+    langs: array of languages, ex. ['pt_BR', 'fr']
+    tm_dirs: locale directories used to build the translation memory.
+  """
+  memory = trans_memory.TranslationMemory()
+  try:
+    memory.import_locale_dirs(tm_dirs)
+    for lang in langs:
+      curdir = os.path.join(locale_dir, lang, 'LC_MESSAGES')
+      if not os.path.exists(curdir):
+        continue
+      for fname in sorted(os.listdir(curdir)):
+        if not fname.endswith('.po'):
+          continue
+        pofilename = os.path.join(curdir, fname)
+        num_exact, num_fuzzy = memory.prefill_po_file(pofilename, lang)
+        if num_exact or num_fuzzy:
+          print('%r: %d translations and %d fuzzy ones from translation memory' % (
+              pofilename, num_exact, num_fuzzy))
+  finally:
+    memory.close()
+
 def compile_po_files(locale_dir, langs):
   """Convert the .po files into binary .mo files.
+  Only .po files that changed since the last build are compiled, see
+  mo_compile.py.
   Args:
     locale_dir: location of the locale dir
     langs: list of languages, ex. ['pt_BR', 'fr']
   """
+  jobs = []
   for lang in langs:
     curdir = os.path.join(locale_dir, lang, 'LC_MESSAGES')
     if not os.path.exists(curdir):
@@ -108,23 +133,15 @@ def compile_po_files(locale_dir, langs):
     for fname in files:
       if fname.endswith('.po'):
         fname_mo = fname.replace('.po', '.mo')
-        args = [
-            'msgfmt',
-            os.path.join(curdir, fname),
-            '-o', os.path.join(curdir, fname_mo)
-            ]
-        _run_or_die(args)
+        jobs.append((os.path.join(curdir, fname), os.path.join(curdir, fname_mo)))
+  for fname_mo in mo_compile.compile_files(jobs):
+    print('Compiled %r' % fname_mo)
 
 def count_untranslated(locale_dir, langs):
-  for lang in langs:
-    curdir = os.path.join(locale_dir, lang, 'LC_MESSAGES')
-    if not os.path.exists(curdir):
-      continue
-    files = os.listdir(curdir)
-    for fname in files:
-      if fname.endswith('.po'):
-        pofilename = os.path.join(curdir, fname)
-        po = polib.pofile(pofilename)
-        un = po.untranslated_entries()
-        if un:
-          print('%r has %d untranslated entries' % (pofilename, len(un)))
+  """Print the untranslated counts and a completion table, see po_stats.py."""
+  results = po_stats.scan_locale_dir(locale_dir, langs)
+  for unused_lang, pofilename, counts in results:
+    if counts['untranslated']:
+      print('%r has %d untranslated entries' % (pofilename, counts['untranslated']))
+  if results:
+    print('\n'.join(po_stats.completion_table(results)))
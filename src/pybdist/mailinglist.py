@@ -15,20 +15,36 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import gettext
+import collections
+import concurrent.futures
+import email.message
+import email.utils
 import logging
 import os
 import netrc
 import re
 import smtplib
 
+from . import metrics
 from . import release
+from . import util
 
-gettext.install('pybdist')
+_ = util.translate
 logging.basicConfig()
 LOG = logging.getLogger('pybdist')
 
-DEFAULT_MESSAGE = _("""Hi,
+DEFAULT_SERVER = 'smtp.gmail.com:587'
+
+# Hosts we may log in to without TLS, the password doesn't leave the machine.
+LOCAL_HOSTS = ['localhost', '127.0.0.1', '::1']
+
+DeliveryResult = collections.namedtuple('DeliveryResult', 'recipient ok message')
+
+def N_(message):
+  """Marks message to be translated (see pot_extract.py) where it's used."""
+  return message
+
+DEFAULT_MESSAGE = N_("""Hi,
 
 I'm happy to announce release version %(version)s of %(name)s.
 
@@ -46,13 +62,15 @@ Thanks,
 %(author)s
 """)
 
-def create_message(setup):
-  if hasattr(setup, 'RELEASE_FORMAT'):
-    release_regex = setup.RELEASE_FORMAT
-  else:
-    release_regex = None
-  rel_ver, rel_date, rel_lines = release.parse_last_release(
-      setup.RELEASE_FILE, release_regex)
+def create_message(setup, notes=None):
+  """Returns the announcement.
+  Args:
+    setup: the setup module.
+    notes: (version, date, lines) of the last release, read if None.
+  """
+  if notes is None:
+    notes = release.parse_last_release(setup.RELEASE_FILE, setup.RELEASE_FORMAT)
+  rel_ver, rel_date, rel_lines = notes
   urls = [
     'Homepage: %s' % setup.SETUP['url'],
     ]
@@ -62,14 +80,15 @@ def create_message(setup):
   else:
     urls.append('Download: %s' % setup.SETUP['download_url'])
 
-  grps = re.match(r'([^@]+)@googlegroups.com', setup.MAILING_LIST)
-  if grps:
-    urls.append('Manage mailing list: '
-                'http://groups.google.com/group/%s/subscribe' % grps.group(1))
-  else:
-    urls.append('Mailing list: %s' % setup.MAILING_LIST)
+  for address in mailing_lists(setup):
+    grps = re.match(r'([^@]+)@googlegroups.com', address)
+    if grps:
+      urls.append('Manage mailing list: '
+                  'http://groups.google.com/group/%s/subscribe' % grps.group(1))
+    else:
+      urls.append('Mailing list: %s' % address)
 
-  return DEFAULT_MESSAGE % {
+  return _(DEFAULT_MESSAGE) % {
       'rel_date': rel_date,
       'release_lines': '\n'.join(rel_lines),
       'version': setup.SETUP['version'],
@@ -82,50 +101,238 @@ def create_message(setup):
 def create_subject(setup):
   return _('[ANN] Release %s of %s') % (setup.SETUP['version'], setup.NAME)
 
-def send_email(to_email, subject, msg):
-  rcinfo = netrc.netrc(os.path.expanduser('~/.netrc'))
-  auth = rcinfo.authenticators('gmail')
-  email = auth[0]
-  name = auth[1].replace('+', ' ')  # put a + for space in the .netrc file
-  password = auth[2]
-  server = 'smtp.gmail.com'
-  port = 587
-  LOG.info('Connecting to %s:%s', server, port)
-  server = smtplib.SMTP(server, port)
-  server.ehlo()
-  server.starttls()
-  server.ehlo()
-  LOG.info('Logging in using email %s', email)
-  server.login(email, password)
-  full_message = ['To: %s' % to_email,
-      'From: %s <%s>' % (name, email),
-      'Reply-To: %s' % to_email,
-      'Subject: %s' % subject,
-      '',
-      msg]
-  LOG.info('Full Message\n%s', '\n'.join(full_message))
-  result = server.sendmail(email, to_email, '\n'.join(full_message))
-  if result:
-    errs = []
-    for recip in result:
-      errs.append(
-          'Could not deliver mail to: %s\n'
-          'Server said: %s\n%s' % (recip, result[recip][0], result[recip][1]))
+def mailing_lists(setup):
+  """Returns the list of addresses to announce to.
+
+  MAILING_LIST can be one address or a list of them.
+  """
+  return list(setup.MAILING_LIST)
+
+
+def _server_for(setup, address):
+  """Returns 'host:port' of the server to send to address with.
+
+  Set SMTP_SERVER to change the default server (ex. 'localhost:1025') and
+  MAIL_SERVERS = {address: 'host:port'} to send some lists through another.
+  """
+  if address in setup.MAIL_SERVERS:
+    return setup.MAIL_SERVERS[address]
+  return setup.SMTP_SERVER or DEFAULT_SERVER
+
+
+def _auth_for(server):
+  """Returns (login, name, password) from ~/.netrc or None.
+
+  The machine is 'gmail' for the default server, the host name otherwise.
+  """
+  machine = server.split(':')[0]
+  if server == DEFAULT_SERVER:
+    machine = 'gmail'
+  try:
+    rcinfo = netrc.netrc(os.path.expanduser('~/.netrc'))
+  except (IOError, OSError, netrc.NetrcParseError):
+    return None
+  auth = rcinfo.authenticators(machine)
+  if not auth:
+    return None
+  # put a + for space in the .netrc file
+  return auth[0], (auth[1] or '').replace('+', ' '), auth[2]
+
+
+class SmtpSession(object):
+  """One connection to an SMTP server, logged in once, for many messages.
+
+  The connection is upgraded with STARTTLS when the server offers it, the
+  password is only sent over TLS (or to this machine).
+  """
+
+  def __init__(self, server, auth=None, timeout=60):
+    host, _, port = server.partition(':')
+    port = int(port or 25)
+    LOG.info('Connecting to %s:%s', host, port)
+    with metrics.request('smtp'):
+      self.smtp = smtplib.SMTP(host, port, timeout=timeout)
+      try:
+        self.smtp.ehlo()
+        secure = False
+        if self.smtp.has_extn('starttls'):
+          self.smtp.starttls()
+          self.smtp.ehlo()
+          secure = True
+        if auth:
+          if not secure and host not in LOCAL_HOSTS:
+            raise smtplib.SMTPNotSupportedError(
+                '%s does not offer STARTTLS, not sending the password in clear text'
+                % server)
+          LOG.info('Logging in using email %s', auth[0])
+          self.smtp.login(auth[0], auth[2])
+      except:
+        self.smtp.close()
+        raise
+
+  def send(self, from_addr, to_addr, message):
+    """Send message (an email.message.EmailMessage).
+    Returns:
+      list of DeliveryResult, one per recipient.
+    """
+    try:
+      with metrics.request('smtp'):
+        refused = self.smtp.send_message(message, from_addr, to_addr)
+    except smtplib.SMTPRecipientsRefused as err:
+      refused = err.recipients
+    except smtplib.SMTPResponseException as err:
+      refused = dict((addr, (err.smtp_code, err.smtp_error)) for addr in to_addr)
+    except smtplib.SMTPException as err:
+      refused = dict((addr, ('', str(err))) for addr in to_addr)
+    ret = []
+    for addr in to_addr:
+      if addr in refused:
+        code, said = refused[addr]
+        if isinstance(said, bytes):
+          said = said.decode('utf-8', 'replace')
+        ret.append(DeliveryResult(addr, False, 'Server said: %s %s' % (code, said)))
+      else:
+        ret.append(DeliveryResult(addr, True, 'Sent'))
+    return ret
+
+  def close(self):
+    try:
+      self.smtp.quit()
+    except smtplib.SMTPException:
+      self.smtp.close()
+
+
+def _full_message(from_name, from_addr, to_addr, subject, msg):
+  """Returns the EmailMessage, send_message() writes it with CRLF line endings."""
+  message = email.message.EmailMessage()
+  message['To'] = to_addr
+  message['From'] = email.utils.formataddr((from_name, from_addr))
+  message['Reply-To'] = to_addr
+  message['Subject'] = subject
+  message.set_content(msg)
+  return message
+
+
+def _send_with_server(server, addresses, subject, msg, sender, timeout):
+  """Send one message per address, over one session."""
+  auth = _auth_for(server)
+  if auth:
+    from_addr, from_name = auth[0], auth[1]
+  elif sender:
+    from_addr, from_name = sender
+  else:
+    return [DeliveryResult(addr, False, 'No login for %s in ~/.netrc' % server)
+            for addr in addresses]
+  try:
+    session = SmtpSession(server, auth, timeout)
+  except (smtplib.SMTPException, OSError) as err:
+    return [DeliveryResult(addr, False, 'Unable to use %s: %s' % (server, err))
+            for addr in addresses]
+  ret = []
+  try:
+    for addr in addresses:
+      full_message = _full_message(from_name, from_addr, addr, subject, msg)
+      LOG.info('Full Message\n%s', full_message)
+      ret += session.send(from_addr, [addr], full_message)
+  finally:
+    session.close()
+  return ret
+
+
+def send_all(routes, subject, msg, sender=None, timeout=60):
+  """Send the message to every address, servers are contacted concurrently.
+  Args:
+    routes: list of (address, 'host:port')
+    subject: the subject.
+    msg: the body.
+    sender: (from_addr, from_name) used when the server needs no login.
+    timeout: seconds to wait for each server.
+  Returns:
+    list of DeliveryResult, in the order of routes.
+  """
+  by_server = collections.OrderedDict()
+  for address, server in routes:
+    by_server.setdefault(server, []).append(address)
+  results = {}
+  with concurrent.futures.ThreadPoolExecutor(len(by_server) or 1) as executor:
+    futures = [executor.submit(_send_with_server, server, addresses, subject, msg,
+                               sender, timeout)
+               for server, addresses in by_server.items()]
+    for future in futures:
+      for result in future.result():
+        results[result.recipient] = result
+  return [results[address] for address, _ in routes]
+
+
+def send_email(to_email, subject, msg, server=DEFAULT_SERVER):
+  results = send_all([(to_email, server)], subject, msg)
+  errs = ['Could not deliver mail to: %s\n%s' % (result.recipient, result.message)
+          for result in results if not result.ok]
+  if errs:
     raise smtplib.SMTPException('\n'.join(errs))
-  server.close()
+
+
+def payload(setup, notes=None):
+  """Returns what deliver() needs to announce the release, for the outbox."""
+  return {
+      'subject': create_subject(setup),
+      'message': create_message(setup, notes),
+      'routes': [(address, _server_for(setup, address))
+                 for address in mailing_lists(setup)],
+      'sender': (setup.SETUP['author_email'], setup.SETUP['author']),
+      'delivered': [],
+  }
+
+
+def deliver(payload):
+  """Send the payload() to the lists it wasn't delivered to yet.
+
+  Raises SMTPException if some failed, the others are remembered in
+  payload['delivered'].
+  """
+  routes = [route for route in payload['routes']
+            if route[0] not in payload['delivered']]
+  results = send_all(routes, payload['subject'], payload['message'], payload['sender'],
+                     payload.get('timeout', 60))
+  errs = []
+  for result in results:
+    if result.ok:
+      payload['delivered'].append(result.recipient)
+    else:
+      errs.append('Could not deliver mail to: %s\n%s' % (result.recipient, result.message))
+  if errs:
+    raise smtplib.SMTPException('\n'.join(errs))
+  return results
+
 
 def mail(setup):
+  """Announce to every mailing list, right away.
+  Returns:
+    list of DeliveryResult
+  """
   subject = create_subject(setup)
   message = create_message(setup)
-  send_email(setup.MAILING_LIST, subject, message)
-  print('Sent mail to %s' % setup.MAILING_LIST)
+  routes = [(address, _server_for(setup, address)) for address in mailing_lists(setup)]
+  sender = (setup.SETUP['author_email'], setup.SETUP['author'])
+  results = send_all(routes, subject, message, sender)
+  errs = []
+  for result in results:
+    if result.ok:
+      print('Sent mail to %s' % result.recipient)
+    else:
+      errs.append('Could not deliver mail to: %s\n%s' % (result.recipient, result.message))
+  if errs:
+    raise smtplib.SMTPException('\n'.join(errs))
+  return results
 
 if __name__ == '__main__':
   import sys
   LOG.setLevel(logging.DEBUG)
   setup_dir = os.path.abspath(__file__ + '/../../..')
   sys.path.insert(0, setup_dir)
+  from . import project_config
   import setup
+  setup = project_config.from_module(setup)
   os.chdir('../..')
   subject = create_subject(setup)
   message = create_message(setup)
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2010 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests of mailinglist.py against a local stand-in SMTP server."""
+
+__author__ = 'Scott Kirkwood (scott+pybdist@forusers.com)'
+
+import base64
+import os
+import smtplib
+import socketserver
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from pybdist import mailinglist
+
+
+class _SmtpHandler(socketserver.StreamRequestHandler):
+  """Just enough ESMTP, no STARTTLS, AUTH PLAIN only."""
+
+  def _reply(self, line):
+    self.wfile.write(line.encode('ascii') + b'\r\n')
+
+  def handle(self):
+    server = self.server
+    self._reply('220 stand-in ESMTP')
+    while True:
+      line = self.rfile.readline()
+      if not line:
+        return
+      command = line.decode('ascii').strip()
+      verb = command.split(' ', 1)[0].upper()
+      server.commands.append(verb)
+      if verb == 'EHLO':
+        self._reply('250-stand-in')
+        self._reply('250 AUTH PLAIN')
+      elif verb == 'AUTH':
+        _, user, password = base64.b64decode(command.split()[2]).split(b'\0')
+        server.logins.append((user.decode('utf-8'), password.decode('utf-8')))
+        self._reply('235 Authenticated')
+      elif verb == 'RCPT':
+        if any(refused in command for refused in server.refuse):
+          self._reply('550 No such list')
+        else:
+          self._reply('250 OK')
+      elif verb == 'DATA':
+        self._reply('354 Go ahead')
+        data = b''
+        while not data.endswith(b'\r\n.\r\n'):
+          chunk = self.rfile.readline()
+          if not chunk:
+            return
+          data += chunk
+        server.messages.append(data)
+        self._reply('250 Queued')
+      elif verb == 'QUIT':
+        self._reply('221 Bye')
+        return
+      else:
+        self._reply('250 OK')
+
+
+class SmtpStandIn(socketserver.ThreadingTCPServer):
+  """A local SMTP server for tests, remembers what it was sent."""
+  daemon_threads = True
+  allow_reuse_address = True
+
+  def __init__(self):
+    socketserver.ThreadingTCPServer.__init__(self, ('127.0.0.1', 0), _SmtpHandler)
+    self.commands = []
+    self.logins = []
+    self.messages = []
+    self.refuse = []
+
+  def start(self):
+    """Serve in a thread, returns the 'localhost:port' to use."""
+    thread = threading.Thread(target=self.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return 'localhost:%d' % self.server_address[1]
+
+  def stop(self):
+    self.shutdown()
+    self.server_close()
+
+
+class MailingListTest(unittest.TestCase):
+
+  def setUp(self):
+    self.server = SmtpStandIn()
+    self.address = self.server.start()
+    # No ~/.netrc, the sender is used.
+    self.home = tempfile.mkdtemp()
+    self.env = mock.patch.dict(os.environ, {'HOME': self.home})
+    self.env.start()
+
+  def tearDown(self):
+    self.env.stop()
+    self.server.stop()
+    os.rmdir(self.home)
+
+  def test_send_all_crlf_utf8(self):
+    results = mailinglist.send_all(
+        [('list@example.com', self.address)], 'Release 1.0',
+        'Bonjour,\nVoilà la version 1.0.\n', sender=('me@example.com', 'Me'))
+    self.assertEqual([(result.recipient, result.ok) for result in results],
+                     [('list@example.com', True)])
+    self.assertEqual(len(self.server.messages), 1)
+    data = self.server.messages[0]
+    self.assertNotIn(b'\n', data.replace(b'\r\n', b''))
+    self.assertIn(b'To: list@example.com\r\n', data)
+    self.assertIn(b'From: Me <me@example.com>\r\n', data)
+    self.assertIn(b'Subject: Release 1.0\r\n', data)
+    self.assertIn('Voilà'.encode('utf-8'), data)
+    self.assertEqual(self.server.logins, [])
+
+  def test_refused_recipient(self):
+    self.server.refuse = ['bad@example.com']
+    results = mailinglist.send_all(
+        [('good@example.com', self.address), ('bad@example.com', self.address)],
+        'Release', 'Hi\n', sender=('me@example.com', 'Me'))
+    self.assertEqual([result.ok for result in results], [True, False])
+    self.assertIn('550', results[1].message)
+
+  def test_login_on_localhost_without_tls(self):
+    session = mailinglist.SmtpSession(self.address, ('me@example.com', 'Me', 'secret'))
+    session.close()
+    self.assertEqual(self.server.logins, [('me@example.com', 'secret')])
+
+  def test_no_login_without_tls(self):
+    with mock.patch.object(mailinglist, 'LOCAL_HOSTS', []):
+      self.assertRaises(smtplib.SMTPNotSupportedError, mailinglist.SmtpSession,
+                        self.address, ('me@example.com', 'Me', 'secret'))
+    self.assertEqual(self.server.logins, [])
+    self.assertNotIn('AUTH', self.server.commands)
+
+  def test_deliver_remembers_delivered(self):
+    self.server.refuse = ['bad@example.com']
+    payload = {
+        'subject': 'Release',
+        'message': 'Hi\n',
+        'routes': [('good@example.com', self.address), ('bad@example.com', self.address)],
+        'sender': ('me@example.com', 'Me'),
+        'delivered': [],
+    }
+    self.assertRaises(smtplib.SMTPException, mailinglist.deliver, payload)
+    self.assertEqual(payload['delivered'], ['good@example.com'])
+    self.server.refuse = []
+    mailinglist.deliver(payload)
+    self.assertEqual(payload['delivered'], ['good@example.com', 'bad@example.com'])
+    self.assertEqual(len(self.server.messages), 2)
+
+
+if __name__ == '__main__':
+  unittest.main()
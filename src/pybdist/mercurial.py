@@ -14,40 +14,204 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+"""Ask mercurial about the working copy.
+
+One `hg serve --cmdserver pipe` process is started the first time it's
+needed and every command of the run goes through it, so mercurial's start
+up (python, extensions, reading the repository) is paid once.
+"""
 
 __author__ = 'Scott Kirkwood (scott+pybdist@forusers.com)'
 
+import atexit
+import collections
+import os
+import struct
 import subprocess
 
-def _run_ret(args, output=True):
-  """Run the `args` (a list)
+NAME = 'Mercurial'
+# Changes when files are added, removed or committed.
+STATE_FILE = os.path.join('.hg', 'dirstate')
+
+StatusEntry = collections.namedtuple('StatusEntry', 'code path')
+
+# The shared CommandServer, False if it couldn't be started.
+_SESSION = None
+
+class MercurialException(Exception):
+  pass
+
+
+def find_root(dirname='.'):
+  """Returns the root of the mercurial repository holding dirname, or None."""
+  dirname = os.path.abspath(dirname)
+  while True:
+    if os.path.isdir(os.path.join(dirname, '.hg')):
+      return dirname
+    parent = os.path.dirname(dirname)
+    if parent == dirname:
+      return None
+    dirname = parent
+
+
+class CommandServer(object):
+  """A running `hg serve --cmdserver pipe`."""
+
+  def __init__(self, repo=None):
+    """Args:
+      repo: root of the repository, defaults to the one holding the current dir.
+    """
+    if repo is None:
+      repo = find_root()
+      if repo is None:
+        raise MercurialException('Not in a mercurial repository')
+    args = ['hg', 'serve', '--cmdserver', 'pipe', '--config', 'ui.interactive=False',
+            '-R', repo]
+    env = dict(os.environ, HGPLAIN='1', HGENCODING='UTF-8')
+    # Once running the errors come through the 'e' channel, stderr only has
+    # the reason it didn't start.
+    self.proc = subprocess.Popen(args, stdin=subprocess.PIPE,
+                                 stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                 env=env)
+    try:
+      channel, data = self._read()
+    except MercurialException:
+      err = self.close()
+      raise MercurialException('Unable to start the hg command server: %s' % (
+          err.strip() or 'no output'))
+    if channel != b'o':
+      self.close()
+      raise MercurialException('Unexpected hello from the hg command server')
+    self.capabilities = []
+    for line in data.decode('utf-8').splitlines():
+      if line.startswith('capabilities:'):
+        self.capabilities = line.split(':', 1)[1].split()
+    if 'runcommand' not in self.capabilities:
+      self.close()
+      raise MercurialException('hg command server can\'t runcommand')
+
+  def _read(self):
+    """Returns (channel, data), data is the length for input channels."""
+    header = self.proc.stdout.read(5)
+    if len(header) < 5:
+      raise MercurialException('hg command server stopped unexpectedly')
+    channel, length = struct.unpack('>cI', header)
+    if channel in b'IL':
+      return channel, length
+    return channel, self.proc.stdout.read(length)
+
+  def runcommand(self, args):
+    """Run an hg command, ex. ['status', '--quiet'].
+    Returns:
+      (retcode, output text, error text)
+    """
+    data = b'\0'.join(arg.encode('utf-8') for arg in args)
+    self.proc.stdin.write(b'runcommand\n' + struct.pack('>I', len(data)) + data)
+    self.proc.stdin.flush()
+    out = []
+    err = []
+    while True:
+      channel, data = self._read()
+      if channel == b'o':
+        out.append(data)
+      elif channel == b'e':
+        err.append(data)
+      elif channel == b'r':
+        ret = struct.unpack('>i', data)[0]
+        return (ret, b''.join(out).decode('utf-8', 'replace'),
+                b''.join(err).decode('utf-8', 'replace'))
+      elif channel in b'IL':
+        # Nobody to answer, send an end of file.
+        self.proc.stdin.write(struct.pack('>I', 0))
+        self.proc.stdin.flush()
+      elif channel.isupper():
+        raise MercurialException('Unsupported hg channel %r' % channel)
+
+  def close(self):
+    """Stop the server, returns what it wrote to stderr."""
+    if self.proc.stdin:
+      self.proc.stdin.close()
+    err = self.proc.stderr.read().decode('utf-8', 'replace')
+    self.proc.stderr.close()
+    self.proc.wait()
+    return err
+
+
+def get_session():
+  """Returns the shared CommandServer, None if hg can't be run here."""
+  global _SESSION
+  if _SESSION is None:
+    try:
+      _SESSION = CommandServer()
+      atexit.register(close_session)
+    except (OSError, MercurialException):
+      _SESSION = False
+  return _SESSION or None
+
 
-  Retcode -999 if unable to run.
-  Args:
-    args: list of arguments to pass to call
-    output: output the command before running
+def close_session():
+  global _SESSION
+  if _SESSION:
+    _SESSION.close()
+  _SESSION = None
+
+
+def _run(args, output=True):
+  """Run the hg command `args` in the shared session.
   Returns:
-    retcode, lines
+    retcode (-999 if hg couldn't be run), output text
   """
-  lines = []
   if output:
-    print(' '.join(args))
-  try:
-    p = subprocess.Popen(args, stdout=subprocess.PIPE)
-    text = p.communicate()[0]
-    lines = text.split('\n')
-    ret = p.returncode
-  except OSError as oserr:
-    ret = -999
-  return (ret, lines)
+    print(' '.join(['hg'] + args))
+  session = get_session()
+  if not session:
+    return -999, ''
+  ret, out, err = session.runcommand(args)
+  if err and output:
+    print(err.rstrip())
+  return ret, out
+
+
+def status():
+  """Returns the StatusEntry of the tracked files that aren't clean, or None."""
+  ret, out = _run(['status', '--noninteractive', '--quiet'], False)
+  if ret == -999:
+    return None
+  if ret:
+    raise MercurialException('hg status failed with code %r' % ret)
+  entries = []
+  for line in out.splitlines():
+    if line:
+      entries.append(StatusEntry(line[0], line[2:]))
+  return entries
+
+
+def tracked_files():
+  """Returns the list of files under version control, or None."""
+  ret, out = _run(['files', '--noninteractive'], False)
+  if ret == -999 or ret > 1:
+    return None
+  return [line for line in out.splitlines() if line]
+
+
+def outgoing():
+  """Returns the list of changeset ids not pushed yet, or None if unknown."""
+  ret, out = _run(['outgoing', '--noninteractive', '--quiet', '--template', '{node}\n'],
+                  False)
+  if ret == 1:
+    return []
+  if ret:
+    return None
+  return [line for line in out.splitlines() if line]
+
 
 def needs_hg_push(verbose=True):
   """Checks if mercurial thinks we need to push."""
-  args = ['hg', 'outgoing', '--noninteractive', '--quiet']
-  ret, _ = _run_ret(args, verbose)
-  if ret == -999:
+  changesets = outgoing()
+  if changesets is None:
+    # No mercurial or not a mercurial repository.
     return False
-  if ret == 1:
+  if changesets == []:
     if verbose:
       print('Mercurial remote version up-to-date')
     return False
@@ -56,24 +220,24 @@ def needs_hg_push(verbose=True):
   return True
 
 def needs_hg_commit(verbose=True):
-  args = ['hg', 'status', '--noninteractive', '--quiet']
-  ret, lines = _run_ret(args, verbose)
-  if ret == -999:
+  entries = status()
+  if entries is None:
     if verbose:
       print('Mercurial not found')
-      print('\n'.join(lines))
     return False
-  # Strip blank lines
-  lines = [l for l in lines if l]
-  if not lines:
+  if not entries:
     if verbose:
-      print('Mercurial does not need a push', ret)
+      print('Mercurial does not need a commit')
     return False
   if verbose:
-    print('Mercurial needs commit, %d files out of date' % len(lines))
-    print('\n'.join(lines))
+    print('Mercurial needs commit, %d files out of date' % len(entries))
+    print('\n'.join('%s %s' % entry for entry in entries))
   return True
 
+# The interface shared with git.py.
+needs_commit = needs_hg_commit
+needs_push = needs_hg_push
+
 if __name__ == '__main__':
   needs_hg_commit()
   needs_hg_push()
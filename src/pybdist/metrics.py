@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2010 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Counters and histograms of a pybdist run, for dashboards.
+
+At the end of every run the metrics are written to the metrics directory
+(--metrics-dir, default ~/.cache/pybdist/metrics/):
+  pybdist_<project>_<command>.prom  for node_exporter's textfile collector,
+                                    replaced by each run of the command.
+  metrics.jsonl                     one JSON line per sample, appended,
+                                    rotated to metrics.jsonl.1, .2, ...
+                                    once it reaches JSONL_MAX_BYTES.
+Every sample has the project and command labels.
+
+The stage metrics come from the profiling.py spans, the stage label is
+the span name (ex. build_man, build_zip_tar, build_deb, check_rst) and
+the group label its kind (builds, uploads, checks, ...), both stay the
+same from release to release.
+"""
+
+__author__ = 'Scott Kirkwood (scott+pybdist@forusers.com)'
+
+import collections
+import contextlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+from . import util
+
+logging.basicConfig()
+LOG = logging.getLogger('pybdist')
+
+DURATION_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+SIZE_BUCKETS = (1e4, 1e5, 1e6, 1e7, 1e8, 1e9)
+THROUGHPUT_BUCKETS = (1e4, 1e5, 1e6, 1e7, 1e8)
+
+# metrics.jsonl is rotated at this size, JSONL_KEEP old files are kept.
+JSONL_MAX_BYTES = 10 * 1024 * 1024
+JSONL_KEEP = 3
+
+# profiling.py span category -> group label.
+GROUPS = {
+    'build': 'builds',
+    'upload': 'uploads',
+    'check': 'checks',
+    'announce': 'announcements',
+    'gettext': 'translations',
+}
+
+_LOCK = threading.Lock()
+_REGISTRY = collections.OrderedDict()
+
+def _label_key(labels):
+  return tuple(sorted(labels.items()))
+
+
+class Counter(object):
+  """A value that only goes up, one per set of labels."""
+  kind = 'counter'
+
+  def __init__(self, name, help_text):
+    self.name = name
+    self.help_text = help_text
+    self.values = collections.OrderedDict()
+
+  def inc(self, value=1, **labels):
+    key = _label_key(labels)
+    with _LOCK:
+      self.values[key] = self.values.get(key, 0) + value
+
+  def samples(self):
+    """Returns a list of (name, labels, value)."""
+    with _LOCK:
+      return [(self.name, dict(key), value) for key, value in self.values.items()]
+
+
+class Histogram(object):
+  """Observations counted in buckets, one histogram per set of labels."""
+  kind = 'histogram'
+
+  def __init__(self, name, help_text, buckets):
+    self.name = name
+    self.help_text = help_text
+    self.buckets = tuple(buckets)
+    self.values = collections.OrderedDict()
+
+  def observe(self, value, **labels):
+    key = _label_key(labels)
+    with _LOCK:
+      counts, total, count = self.values.get(key, ([0] * len(self.buckets), 0, 0))
+      counts = [num + (value <= bound) for num, bound in zip(counts, self.buckets)]
+      self.values[key] = (counts, total + value, count + 1)
+
+  def samples(self):
+    """Returns a list of (name, labels, value), buckets are cumulative."""
+    ret = []
+    with _LOCK:
+      for key, (counts, total, count) in self.values.items():
+        for bound, num in zip(self.buckets, counts):
+          ret.append((self.name + '_bucket', dict(key, le='%g' % bound), num))
+        ret.append((self.name + '_bucket', dict(key, le='+Inf'), count))
+        ret.append((self.name + '_sum', dict(key), total))
+        ret.append((self.name + '_count', dict(key), count))
+    return ret
+
+
+def counter(name, help_text):
+  """Returns the Counter name, created the first time."""
+  with _LOCK:
+    if name not in _REGISTRY:
+      _REGISTRY[name] = Counter(name, help_text)
+    return _REGISTRY[name]
+
+
+def histogram(name, help_text, buckets=DURATION_BUCKETS):
+  """Returns the Histogram name, created the first time."""
+  with _LOCK:
+    if name not in _REGISTRY:
+      _REGISTRY[name] = Histogram(name, help_text, buckets)
+    return _REGISTRY[name]
+
+
+STAGE_SECONDS = histogram(
+    'pybdist_stage_duration_seconds', 'Wall time of each pybdist stage.')
+STAGE_RUNS = counter(
+    'pybdist_stage_runs_total', 'Runs of each pybdist stage by result.')
+TOOL_SECONDS = histogram(
+    'pybdist_tool_duration_seconds', 'Wall time of each external tool run.')
+TOOL_CPU = counter(
+    'pybdist_tool_cpu_seconds_total', 'CPU time used by external tools.')
+ARTIFACT_BYTES = histogram(
+    'pybdist_artifact_size_bytes', 'Size of the built files.', SIZE_BUCKETS)
+UPLOAD_BYTES = counter(
+    'pybdist_upload_bytes_total', 'Bytes uploaded.')
+UPLOAD_SECONDS = counter(
+    'pybdist_upload_seconds_total',
+    'Time spent uploading, the phase label says if building is included.')
+UPLOAD_THROUGHPUT = histogram(
+    'pybdist_upload_throughput_bytes_per_second', 'Speed of each upload.',
+    THROUGHPUT_BUCKETS)
+CACHE_LOOKUPS = counter(
+    'pybdist_cache_lookups_total', 'Cache lookups by cache and result (hit or miss).')
+NETWORK_REQUESTS = counter(
+    'pybdist_network_requests_total', 'Requests (round-trips) to remote services.')
+NETWORK_SECONDS = histogram(
+    'pybdist_network_request_duration_seconds', 'Wall time of the remote requests.')
+
+
+def cache_lookup(cache_name, hit):
+  CACHE_LOOKUPS.inc(cache=cache_name, result='hit' if hit else 'miss')
+
+
+@contextlib.contextmanager
+def request(service):
+  """Count and time the enclosed round-trip to service (ex. 'pypi')."""
+  start = time.time()
+  try:
+    yield
+  finally:
+    NETWORK_REQUESTS.inc(service=service)
+    NETWORK_SECONDS.observe(time.time() - start, service=service)
+
+
+def _artifact_kind(fname):
+  for ext in ('.tar.gz', '.zip', '.deb', '.1', '.mo'):
+    if fname.endswith(ext):
+      return ext[1:]
+  return os.path.splitext(fname)[1][1:] or 'other'
+
+
+def record_artifact(fname):
+  """Observe the size of the built file fname, if it's there."""
+  try:
+    size = os.path.getsize(fname)
+  except OSError:
+    return
+  ARTIFACT_BYTES.observe(size, kind=_artifact_kind(fname))
+
+
+def record_upload(target, fname, seconds, phase='upload'):
+  """Count the upload of fname to target (ex. 'pypi') that took seconds.
+  Args:
+    phase: 'upload', or 'build+upload' when seconds includes building fname
+      (ex. setup.py sdist upload), the throughput isn't observed then.
+  """
+  try:
+    size = os.path.getsize(fname)
+  except OSError:
+    return
+  UPLOAD_BYTES.inc(size, target=target)
+  UPLOAD_SECONDS.inc(seconds, target=target, phase=phase)
+  if seconds > 0 and phase == 'upload':
+    UPLOAD_THROUGHPUT.observe(size / seconds, target=target)
+
+
+def record_spans(spans):
+  """Add the profiling.py spans to the stage and tool metrics."""
+  for span in spans:
+    if span.category == 'tool':
+      TOOL_SECONDS.observe(span.seconds, tool=span.name)
+      TOOL_CPU.inc(span.args.get('cpu_user', 0) + span.args.get('cpu_sys', 0),
+                   tool=span.name)
+      continue
+    group = GROUPS.get(span.category, span.category)
+    STAGE_SECONDS.observe(span.seconds, stage=span.name, group=group)
+    result = 'error' if span.args.get('error') else 'ok'
+    STAGE_RUNS.inc(stage=span.name, group=group, result=result)
+
+
+def samples(common_labels=None):
+  """Returns a list of (metric, name, labels, value) of every metric."""
+  ret = []
+  with _LOCK:
+    metrics = list(_REGISTRY.values())
+  for metric in metrics:
+    for name, labels, value in metric.samples():
+      ret.append((metric, name, dict(common_labels or {}, **labels), value))
+  return ret
+
+
+def _escape(value):
+  return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def prometheus_text(common_labels=None):
+  """Returns the metrics in the Prometheus text exposition format."""
+  lines = []
+  seen = set()
+  for metric, name, labels, value in samples(common_labels):
+    if metric.name not in seen:
+      seen.add(metric.name)
+      lines.append('# HELP %s %s' % (metric.name, metric.help_text))
+      lines.append('# TYPE %s %s' % (metric.name, metric.kind))
+    label_text = ','.join('%s="%s"' % (key, _escape(labels[key])) for key in sorted(labels))
+    lines.append('%s{%s} %s' % (name, label_text, repr(float(value))))
+  return '\n'.join(lines) + '\n'
+
+
+def json_lines(common_labels=None, now=None):
+  """Returns the metrics as JSON lines."""
+  now = now or time.time()
+  return [json.dumps(dict(time=now, name=name, type=metric.kind, labels=labels,
+                          value=value), sort_keys=True)
+          for metric, name, labels, value in samples(common_labels)]
+
+
+def write(project, command, dirname=None):
+  """Write the metrics of this run for the textfile collector and as JSON lines.
+  Returns:
+    the name of the .prom file.
+  """
+  dirname = dirname or util.get_cache_dir('metrics')
+  if not os.path.isdir(dirname):
+    os.makedirs(dirname, exist_ok=True)
+  labels = dict(project=project or '', command=command or '')
+  parts = ['pybdist'] + [part for part in (project, command) if part]
+  fname = os.path.join(dirname, re.sub(r'[^\w.-]', '_', '_'.join(parts)) + '.prom')
+  # The collector may read at any time, only show it complete files.
+  tmp_name = fname + '.tmp'
+  with open(tmp_name, 'w') as fout:
+    fout.write(prometheus_text(labels))
+  os.rename(tmp_name, fname)
+  jsonl_name = os.path.join(dirname, 'metrics.jsonl')
+  _rotate(jsonl_name)
+  with open(jsonl_name, 'a') as fout:
+    for line in json_lines(labels):
+      fout.write(line + '\n')
+  return fname
+
+
+def _rotate(fname):
+  """Move fname to fname.1 (.1 to .2, ...) once it's JSONL_MAX_BYTES."""
+  try:
+    if os.path.getsize(fname) < JSONL_MAX_BYTES:
+      return
+  except OSError:
+    return
+  for num in range(JSONL_KEEP - 1, 0, -1):
+    if os.path.exists('%s.%d' % (fname, num)):
+      os.replace('%s.%d' % (fname, num), '%s.%d' % (fname, num + 1))
+  os.replace(fname, fname + '.1')
+
+
+def write_quietly(project, command, dirname=None):
+  """Like write() but only logs the errors, metrics shouldn't stop a release."""
+  try:
+    return write(project, command, dirname)
+  except (IOError, OSError) as err:
+    LOG.warning('Unable to write the metrics: %s', err)
+    return None
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2010 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Translations read straight from a memory mapped .mo file.
+
+gettext.GNUTranslations unpacks the whole catalog into a dict, here each
+lookup goes through the hash table stored in the .mo file (see
+mo_compile.py) so only the strings asked for are ever read.  Catalogs are
+shared, opening the same file twice returns the same MoCatalog.
+"""
+
+__author__ = 'Scott Kirkwood (scott+pybdist@forusers.com)'
+
+import gettext
+import mmap
+import os
+import re
+import struct
+
+LE_MAGIC = 0x950412de
+BE_MAGIC = 0xde120495
+
+_CATALOGS = {}
+
+class MoCatalogException(Exception):
+  pass
+
+
+def hash_string(data):
+  """The hashpjw function used by GNU gettext for the .mo hash table."""
+  hval = 0
+  for char in data:
+    hval = ((hval << 4) + char) & 0xffffffff
+    high = hval & 0xf0000000
+    if high:
+      hval ^= high >> 24
+      hval ^= high
+  return hval
+
+
+class MoCatalog(object):
+  """Looks up msgids in a memory mapped .mo file."""
+
+  def __init__(self, fname):
+    self.fname = fname
+    with open(fname, 'rb') as fin:
+      # mmap can't map an empty file, and the header is 7 integers.
+      if os.fstat(fin.fileno()).st_size < 28:
+        raise MoCatalogException('%r is too short to be a .mo file' % fname)
+      self.data = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+    magic = struct.unpack('<I', self.data[:4])[0]
+    if magic == LE_MAGIC:
+      self.endian = '<'
+    elif magic == BE_MAGIC:
+      self.endian = '>'
+    else:
+      raise MoCatalogException('%r is not a .mo file' % fname)
+    (_, self.num, self.orig_offset, self.trans_offset, self.hash_size,
+     self.hash_offset) = struct.unpack(self.endian + '6I', self.data[4:28])
+    self.charset = 'utf-8'
+    self.plural = lambda num: int(num != 1)
+    self._parse_header()
+
+  def _pair(self, offset, num):
+    return struct.unpack_from(self.endian + '2I', self.data, offset + num * 8)
+
+  def _orig(self, num):
+    length, offset = self._pair(self.orig_offset, num)
+    return self.data[offset:offset + length]
+
+  def _trans(self, num):
+    length, offset = self._pair(self.trans_offset, num)
+    return self.data[offset:offset + length]
+
+  def _parse_header(self):
+    header = self.lookup(b'')
+    if header is None:
+      return
+    header = header.decode('ascii', 'replace')
+    grps = re.search(r'charset=([\w-]+)', header)
+    if grps:
+      self.charset = grps.group(1)
+    grps = re.search(r'Plural-Forms:.*plural=([^;\n]+)', header)
+    if grps:
+      self.plural = gettext.c2py(grps.group(1))
+
+  def _find(self, key):
+    """Returns the index of key or -1."""
+    if self.hash_size < 3:
+      return self._bsearch(key)
+    hval = hash_string(key)
+    idx = hval % self.hash_size
+    incr = 1 + (hval % (self.hash_size - 2))
+    # A broken table may have no empty slot, don't go round forever.
+    for _ in range(self.hash_size):
+      slot = struct.unpack_from(self.endian + 'I', self.data,
+                                self.hash_offset + idx * 4)[0]
+      if not slot:
+        return -1
+      if self._orig(slot - 1).split(b'\0', 1)[0] == key:
+        return slot - 1
+      idx += incr
+      if idx >= self.hash_size:
+        idx -= self.hash_size
+    return self._bsearch(key)
+
+  def _bsearch(self, key):
+    """Catalogs without a hash table are still sorted."""
+    low, high = 0, self.num
+    while low < high:
+      mid = (low + high) // 2
+      orig = self._orig(mid).split(b'\0', 1)[0]
+      if orig == key:
+        return mid
+      if orig < key:
+        low = mid + 1
+      else:
+        high = mid
+    return -1
+
+  def lookup(self, key):
+    """Returns the translation (bytes) of key (bytes) or None."""
+    num = self._find(key)
+    if num < 0:
+      return None
+    return self._trans(num)
+
+  def close(self):
+    self.data.close()
+
+
+def open_catalog(fname):
+  """Returns the shared MoCatalog for fname, reopened if the file changed."""
+  fname = os.path.abspath(fname)
+  stat = os.stat(fname)
+  key = (fname, stat.st_mtime_ns, stat.st_size, stat.st_ino)
+  if key not in _CATALOGS:
+    for old_key in [old_key for old_key in _CATALOGS if old_key[0] == fname]:
+      del _CATALOGS[old_key]
+    _CATALOGS[key] = MoCatalog(fname)
+  return _CATALOGS[key]
+
+
+class MoTranslations(gettext.NullTranslations):
+  """gettext style translations backed by a MoCatalog."""
+
+  def __init__(self, catalog):
+    gettext.NullTranslations.__init__(self)
+    self.catalog = catalog
+
+  def _lookup(self, key):
+    found = self.catalog.lookup(key.encode(self.catalog.charset))
+    if found is None:
+      return None
+    return found.decode(self.catalog.charset)
+
+  def gettext(self, message):
+    found = self._lookup(message)
+    if found is None:
+      if self._fallback:
+        return self._fallback.gettext(message)
+      return message
+    return found
+
+  def ngettext(self, msgid1, msgid2, num):
+    found = self._lookup(msgid1)
+    if found is None:
+      if self._fallback:
+        return self._fallback.ngettext(msgid1, msgid2, num)
+      if num == 1:
+        return msgid1
+      return msgid2
+    forms = found.split('\0')
+    index = self.catalog.plural(num)
+    if index >= len(forms):
+      index = len(forms) - 1
+    return forms[index]
+
+  def pgettext(self, context, message):
+    found = self._lookup('%s\x04%s' % (context, message))
+    if found is None:
+      if self._fallback:
+        return self._fallback.pgettext(context, message)
+      return message
+    return found
+
+
+def translation(domain, localedir=None, languages=None, fallback=True):
+  """Like gettext.translation() but returns MoTranslations."""
+  mofile = gettext.find(domain, localedir, languages)
+  if not mofile:
+    if fallback:
+      return gettext.NullTranslations()
+    raise MoCatalogException('No translation file found for domain %r' % domain)
+  return MoTranslations(open_catalog(mofile))
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2010 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Compile .po files into GNU .mo files, like msgfmt does.
+
+The .mo includes the hash table (see mo_catalog.py which uses it) laid out
+the way msgfmt does it.  A .mo is only rebuilt when the content hash of its
+.po changed since the last build, files are compiled in parallel and
+written atomically.
+"""
+
+__author__ = 'Scott Kirkwood (scott+pybdist@forusers.com)'
+
+import concurrent.futures
+import os
+import struct
+
+try:
+  import polib
+except ImportError:
+  raise ImportError('You need to install polib, try sudo "apt-get install python-polib"')
+
+from . import cache
+from . import mo_catalog
+
+MAGIC = 0x950412de
+HEADER_SIZE = 28
+
+
+def _is_prime(num):
+  if num < 2:
+    return False
+  div = 2
+  while div * div <= num:
+    if num % div == 0:
+      return False
+    div += 1
+  return True
+
+
+def hash_table_size(num_strings):
+  """Same size msgfmt picks, the next prime after 4/3 of the strings."""
+  size = (num_strings * 4) // 3
+  if size <= 2:
+    return 3
+  while not _is_prime(size):
+    size += 1
+  return size
+
+
+def hash_table(keys, size):
+  """Returns the open addressing table, slots hold index + 1, 0 is empty."""
+  table = [0] * size
+  for num, key in enumerate(keys):
+    hval = mo_catalog.hash_string(key.split(b'\0', 1)[0])
+    idx = hval % size
+    incr = 1 + (hval % (size - 2))
+    while table[idx]:
+      idx += incr
+      if idx >= size:
+        idx -= size
+    table[idx] = num + 1
+  return table
+
+
+def _po_messages(po):
+  """Returns {msgid bytes: msgstr bytes} for the entries msgfmt would keep."""
+  header = ''.join('%s: %s\n' % (key, value) for key, value in po.ordered_metadata())
+  messages = {b'': header.encode('utf-8')}
+  for entry in po:
+    if entry.obsolete or 'fuzzy' in entry.flags:
+      continue
+    msgid = entry.msgid
+    if entry.msgctxt:
+      msgid = entry.msgctxt + '\x04' + msgid
+    if entry.msgid_plural:
+      plurals = [entry.msgstr_plural[num] for num in sorted(entry.msgstr_plural)]
+      if not all(plurals):
+        continue
+      msgid += '\0' + entry.msgid_plural
+      msgstr = '\0'.join(plurals)
+    else:
+      if not entry.msgstr:
+        continue
+      msgstr = entry.msgstr
+    messages[msgid.encode('utf-8')] = msgstr.encode('utf-8')
+  return messages
+
+
+def mo_data(messages):
+  """Returns the bytes of a .mo file for {msgid: msgstr} (bytes)."""
+  keys = sorted(messages)
+  num = len(keys)
+  size = hash_table_size(num)
+  orig_offset = HEADER_SIZE
+  trans_offset = orig_offset + num * 8
+  hash_offset = trans_offset + num * 8
+  strings_offset = hash_offset + size * 4
+
+  ids = b''
+  strs = b''
+  orig_table = []
+  trans_table = []
+  for key in keys:
+    orig_table += [len(key), strings_offset + len(ids)]
+    ids += key + b'\0'
+  for key in keys:
+    value = messages[key]
+    trans_table += [len(value), strings_offset + len(ids) + len(strs)]
+    strs += value + b'\0'
+
+  header = struct.pack('<7I', MAGIC, 0, num, orig_offset, trans_offset,
+                       size, hash_offset)
+  tables = orig_table + trans_table + hash_table(keys, size)
+  return header + struct.pack('<%dI' % len(tables), *tables) + ids + strs
+
+
+def compile_file(po_fname, mo_fname):
+  """Compile one .po into .mo, atomically."""
+  data = mo_data(_po_messages(polib.pofile(po_fname)))
+  tmp_name = mo_fname + '.tmp'
+  with open(tmp_name, 'wb') as fout:
+    fout.write(data)
+  os.rename(tmp_name, mo_fname)
+  return mo_fname
+
+
+def _compile_job(job):
+  po_fname, mo_fname = job
+  return compile_file(po_fname, mo_fname)
+
+
+def compile_files(jobs, workers=None, force=False):
+  """Compile the (po_fname, mo_fname) pairs whose .po changed.
+  Args:
+    jobs: list of (po_fname, mo_fname)
+    workers: number of processes, None for one per cpu.
+    force: rebuild even if the .po is unchanged.
+  Returns:
+    list of mo filenames written.
+  """
+  built = cache.HashCache('mo')
+  todo = []
+  for po_fname, mo_fname in jobs:
+    po_hash = cache.file_hash(po_fname)
+    key = cache.text_hash(os.path.abspath(mo_fname))
+    if (not force and os.path.exists(mo_fname)
+        and built.get(key) == po_hash):
+      continue
+    todo.append((po_fname, mo_fname, key, po_hash))
+  pairs = [(po_fname, mo_fname) for po_fname, mo_fname, _, _ in todo]
+  if len(pairs) > 1:
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+      written = list(executor.map(_compile_job, pairs))
+  else:
+    written = [_compile_job(pair) for pair in pairs]
+  for _, _, key, po_hash in todo:
+    built.put(key, po_hash)
+  return written
@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2010 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Announcements waiting to be delivered.
+
+Announcing a release (mail, freshmeat, twitter) only writes a record to
+~/.cache/pybdist/outbox/, one per project, version and channel, then starts
+a worker process in the background and returns.  The worker delivers the
+records, retrying failures with an exponential backoff, and writes the
+outcome back into each record (see --outbox).
+
+A record names its handler as 'module:function', the function is called
+with the record's payload (a dict) and raises if the delivery failed.
+Changes it makes to the payload are saved, so a handler can remember what
+was already done (ex. the mailing lists already sent to).  Spooling the
+same announcement again keeps that progress (see PROGRESS_KEYS).
+
+Each record has its own lock file, a record is delivered (or changed) by
+one thread of one process at a time, the worker or an announce.py run.
+"""
+
+__author__ = 'Scott Kirkwood (scott+pybdist@forusers.com)'
+
+import contextlib
+import fcntl
+import importlib
+import json
+import logging
+import os
+import re
+import subprocess
+import sys
+import time
+import traceback
+
+from . import metrics
+from . import util
+
+logging.basicConfig()
+LOG = logging.getLogger('pybdist')
+
+# Seconds before the first retry, doubled each time up to MAX_DELAY.
+FIRST_DELAY = 30
+MAX_DELAY = 3600
+MAX_ATTEMPTS = 10
+
+PENDING = 'pending'
+SENT = 'sent'
+FAILED = 'failed'
+
+# Payload keys where handlers remember what they already did.
+PROGRESS_KEYS = ['delivered']
+
+def _outbox_dir():
+  return util.get_cache_dir('outbox')
+
+
+def record_fname(project, version, channel):
+  name = '%s-%s-%s' % (project, version, channel)
+  return os.path.join(_outbox_dir(), re.sub(r'[^\w.@-]', '_', name) + '.json')
+
+
+def save(fname, record):
+  tmp_name = fname + '.tmp'
+  with open(tmp_name, 'w') as fout:
+    json.dump(record, fout, indent=2, sort_keys=True)
+  os.rename(tmp_name, fname)
+
+
+def _read(fname):
+  with open(fname) as fin:
+    return json.load(fin)
+
+
+@contextlib.contextmanager
+def _record_lock(fname):
+  """Hold the lock of the record fname, waits for the current holder."""
+  with open(fname + '.lock', 'w') as lock_file:
+    fcntl.flock(lock_file, fcntl.LOCK_EX)
+    yield
+
+
+def spool(project, version, channel, handler, payload):
+  """Write the announcement to the outbox.
+  Args:
+    project: ex. 'pybdist'
+    version: ex. '0.3.1'
+    channel: ex. 'mail'
+    handler: 'module:function' that delivers the payload.
+    payload: dict, must be JSON serializable.
+  Returns:
+    the record, its state is SENT if it was already delivered.
+  """
+  fname = record_fname(project, version, channel)
+  with _record_lock(fname):
+    if os.path.exists(fname):
+      record = _read(fname)
+      if record['state'] != SENT:
+        _respool(record, handler, payload)
+        save(fname, record)
+      return record
+    record = _new_record(project, version, channel, handler, payload)
+    save(fname, record)
+  return record
+
+
+def _new_record(project, version, channel, handler, payload):
+  return {
+      'project': project,
+      'version': version,
+      'channel': channel,
+      'handler': handler,
+      'payload': payload,
+      'state': PENDING,
+      'attempts': 0,
+      'next_try': time.time(),
+      'created': time.time(),
+      'delivered': None,
+      'last_error': None,
+  }
+
+
+def _respool(record, handler, payload):
+  """Retry a pending or failed record now, with payload but its progress."""
+  old_payload = record['payload']
+  record['payload'] = dict(payload)
+  for key in PROGRESS_KEYS:
+    if key in old_payload:
+      record['payload'][key] = old_payload[key]
+  record['handler'] = handler
+  if record['state'] == FAILED:
+    record['attempts'] = 0
+  record['state'] = PENDING
+  record['next_try'] = time.time()
+
+
+def list_records(project=None):
+  """Returns the list of (fname, record), oldest first."""
+  ret = []
+  for name in sorted(os.listdir(_outbox_dir())):
+    if not name.endswith('.json'):
+      continue
+    fname = os.path.join(_outbox_dir(), name)
+    try:
+      record = _read(fname)
+    except (IOError, OSError, ValueError):
+      continue
+    if project is None or record['project'] == project:
+      ret.append((fname, record))
+  ret.sort(key=lambda item: item[1]['created'])
+  return ret
+
+
+def _call_handler(handler, payload):
+  module_name, func_name = handler.split(':')
+  func = getattr(importlib.import_module(module_name), func_name)
+  return func(payload)
+
+
+def backoff(attempts):
+  """Seconds to wait after `attempts` failed attempts."""
+  return min(FIRST_DELAY * 2 ** (attempts - 1), MAX_DELAY)
+
+
+def deliver(fname):
+  """Try to deliver the record fname if it's pending and due.
+  Returns:
+    the record, as saved.
+  """
+  with _record_lock(fname):
+    # Read under the lock, someone else may just have delivered it.
+    record = _read(fname)
+    if record['state'] != PENDING or record['next_try'] > time.time():
+      return record
+    return _deliver_locked(fname, record)
+
+
+def _deliver_locked(fname, record):
+  record['attempts'] += 1
+  try:
+    _call_handler(record['handler'], record['payload'])
+  except Exception as err:
+    LOG.info('Delivering %s failed:\n%s', fname, traceback.format_exc())
+    record['last_error'] = '%s: %s' % (err.__class__.__name__, err)
+    if record['attempts'] >= MAX_ATTEMPTS:
+      record['state'] = FAILED
+    else:
+      record['next_try'] = time.time() + backoff(record['attempts'])
+  else:
+    record['state'] = SENT
+    record['delivered'] = time.time()
+    record['last_error'] = None
+  save(fname, record)
+  return record
+
+
+def deliver_due(now=None):
+  """Deliver the pending records that are due.
+  Returns:
+    the time of the next pending record or None if there are none.
+  """
+  next_try = None
+  for fname, record in list_records():
+    if record['state'] != PENDING:
+      continue
+    if record['next_try'] <= (now or time.time()):
+      record = deliver(fname)
+      if record['state'] != PENDING:
+        continue
+    if next_try is None or record['next_try'] < next_try:
+      next_try = record['next_try']
+  return next_try
+
+
+def _lock():
+  """Returns the open lock file, or None if a worker is already running."""
+  lock_file = open(os.path.join(_outbox_dir(), '.lock'), 'w')
+  try:
+    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+  except (IOError, OSError):
+    lock_file.close()
+    return None
+  return lock_file
+
+
+def _has_pending():
+  return any(record['state'] == PENDING for _, record in list_records())
+
+
+def run_worker():
+  """Deliver until nothing is pending, only one worker runs at a time."""
+  while True:
+    lock_file = _lock()
+    if not lock_file:
+      return
+    try:
+      while True:
+        next_try = deliver_due()
+        if next_try is None:
+          break
+        time.sleep(max(0, next_try - time.time()))
+    finally:
+      lock_file.close()
+    # Something may have been spooled while we were letting go of the lock.
+    if not _has_pending():
+      return
+
+
+def start_worker():
+  """Start run_worker() in the background, it outlives this process."""
+  log_name = os.path.join(_outbox_dir(), 'worker.log')
+  src_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+  env = dict(os.environ)
+  env['PYTHONPATH'] = os.pathsep.join(
+      [src_dir] + [path for path in [env.get('PYTHONPATH')] if path])
+  with open(log_name, 'a') as log:
+    subprocess.Popen([sys.executable, '-m', __name__], cwd=os.getcwd(),
+                     env=env, stdin=subprocess.DEVNULL, stdout=log, stderr=log,
+                     start_new_session=True)
+
+
+def _format_time(secs):
+  if not secs:
+    return '-'
+  return time.strftime('%Y-%m-%d %H:%M', time.localtime(secs))
+
+
+def print_records(project=None):
+  for _, record in list_records(project):
+    if record['state'] == SENT:
+      when = 'on %s' % _format_time(record['delivered'])
+    elif record['state'] == PENDING:
+      when = 'next try %s' % _format_time(record['next_try'])
+    else:
+      when = 'gave up'
+    print('%-10s %-8s %-12s %-8s %d attempts, %s' % (
+        record['project'], record['version'], record['channel'],
+        record['state'], record['attempts'], when))
+    if record['last_error']:
+      print('  %s' % record['last_error'])
+
+
+if __name__ == '__main__':
+  try:
+    run_worker()
+  finally:
+    metrics.write_quietly(None, 'outbox_worker')
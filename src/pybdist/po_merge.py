@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2010 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Merge a .pot file into existing .po files, like msgmerge does.
+
+For every message in the .pot:
+  * an exact match in the old .po keeps its translation,
+  * otherwise the most similar old translated message is used and the
+    entry is marked fuzzy (found with a trigram index, not a full scan),
+  * otherwise it's left untranslated.
+Old messages that are no longer used become obsolete (#~) entries.
+
+Languages are merged in parallel, one process per .po file.
+"""
+
+__author__ = 'Scott Kirkwood (scott+pybdist@forusers.com)'
+
+import collections
+import concurrent.futures
+import difflib
+import os
+
+try:
+  import polib
+except ImportError:
+  raise ImportError('You need to install polib, try sudo "apt-get install python-polib"')
+
+# Minimum similarity (0..1) for a fuzzy match.
+FUZZY_THRESHOLD = 0.6
+# Number of trigram candidates checked with difflib.
+MAX_CANDIDATES = 5
+# Trigrams in more than this fraction of the messages are too common to help.
+STOP_FRACTION = 0.25
+
+def _trigrams(text):
+  text = ' %s ' % ' '.join(text.lower().split())
+  return set(text[i:i + 3] for i in range(len(text) - 2))
+
+
+class TrigramIndex(object):
+  """Finds the most similar message without comparing against all of them."""
+
+  def __init__(self, entries):
+    self.entries = entries
+    self.postings = collections.defaultdict(list)
+    for num, entry in enumerate(entries):
+      for trigram in _trigrams(entry.msgid):
+        self.postings[trigram].append(num)
+    self.max_posting = max(1, int(len(entries) * STOP_FRACTION))
+
+  def best_match(self, msgid, threshold=FUZZY_THRESHOLD):
+    """Returns (score, entry) of the best match or (0, None)."""
+    trigrams = _trigrams(msgid)
+    counts = collections.Counter()
+    for trigram in trigrams:
+      posting = self.postings.get(trigram)
+      if posting and (len(posting) <= self.max_posting or len(self.entries) < 8):
+        counts.update(posting)
+    best = (0, None)
+    for num, common in counts.most_common(MAX_CANDIDATES):
+      entry = self.entries[num]
+      # The Dice coefficient is a cheap filter before difflib.
+      dice = 2.0 * common / (len(trigrams) + len(_trigrams(entry.msgid)))
+      if dice < threshold / 2:
+        continue
+      score = difflib.SequenceMatcher(None, msgid, entry.msgid).ratio()
+      if score >= threshold and score > best[0]:
+        best = (score, entry)
+    return best
+
+
+def _key(entry):
+  return (entry.msgctxt, entry.msgid)
+
+
+def _is_translated(entry):
+  return bool(entry.msgstr or any(entry.msgstr_plural.values()))
+
+
+def _copy_translation(old, entry):
+  entry.msgstr = old.msgstr
+  if entry.msgid_plural and old.msgstr_plural:
+    entry.msgstr_plural = dict(old.msgstr_plural)
+
+
+def merge(old_po, pot):
+  """Returns a new polib.POFile with pot's messages and old_po's translations."""
+  new_po = polib.POFile(wrapwidth=old_po.wrapwidth)
+  new_po.header = old_po.header
+  new_po.metadata = dict(old_po.metadata)
+  if 'POT-Creation-Date' in pot.metadata:
+    new_po.metadata['POT-Creation-Date'] = pot.metadata['POT-Creation-Date']
+
+  old_entries = {}
+  for entry in old_po:
+    old_entries[_key(entry)] = entry
+  translated = [entry for entry in old_po if _is_translated(entry)]
+  index = TrigramIndex(translated)
+
+  used = set()
+  unmatched = []
+  for pot_entry in pot:
+    entry = polib.POEntry(
+        msgid=pot_entry.msgid,
+        msgctxt=pot_entry.msgctxt,
+        msgid_plural=pot_entry.msgid_plural,
+        occurrences=pot_entry.occurrences,
+        comment=pot_entry.comment,
+        flags=[flag for flag in pot_entry.flags if flag != 'fuzzy'])
+    if pot_entry.msgid_plural:
+      entry.msgstr_plural = {0: '', 1: ''}
+    old = old_entries.get(_key(pot_entry))
+    if old:
+      used.add(_key(old))
+      entry.tcomment = old.tcomment
+      if 'fuzzy' in old.flags:
+        entry.flags.append('fuzzy')
+      entry.previous_msgid = old.previous_msgid
+      _copy_translation(old, entry)
+    else:
+      unmatched.append(entry)
+    new_po.append(entry)
+
+  # Fuzzy matches only once all the exact matches are known.
+  for entry in unmatched:
+    _, old = index.best_match(entry.msgid)
+    if old:
+      used.add(_key(old))
+      entry.flags.append('fuzzy')
+      entry.previous_msgid = old.msgid
+      _copy_translation(old, entry)
+
+  for old in old_po:
+    if _key(old) in used or not (_is_translated(old) or old.obsolete):
+      continue
+    old.obsolete = True
+    old.occurrences = []
+    new_po.append(old)
+  return new_po
+
+
+def merge_file(po_fname, potfile):
+  """Merge potfile into po_fname in place.
+  Returns:
+    (po_fname, changed)
+  """
+  old_po = polib.pofile(po_fname)
+  pot = polib.pofile(potfile)
+  new_po = merge(old_po, pot)
+  new_text = str(new_po)
+  if new_text == str(old_po):
+    return po_fname, False
+  tmp_name = po_fname + '.tmp'
+  new_po.save(tmp_name)
+  os.rename(tmp_name, po_fname)
+  return po_fname, True
+
+
+def merge_files(po_fnames, potfile, workers=None):
+  """Merge potfile into each .po file in parallel.
+  Returns:
+    list of (po_fname, changed)
+  """
+  if len(po_fnames) <= 1:
+    return [merge_file(po_fname, potfile) for po_fname in po_fnames]
+  with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+    return list(executor.map(merge_file, po_fnames, [potfile] * len(po_fnames)))
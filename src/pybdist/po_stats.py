@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2010 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Count translated, fuzzy, untranslated and obsolete entries in .po files.
+
+Reads the file a line at a time without building entry objects, it only
+needs to know if each string is empty.  Counts follow polib's rules (a
+fuzzy entry is neither translated nor untranslated, a plural entry is
+translated only if every form is).  Results are cached by file hash.
+"""
+
+__author__ = 'Scott Kirkwood (scott+pybdist@forusers.com)'
+
+import os
+
+from . import cache
+
+# Change when the counting rules change.
+STATS_VERSION = '1'
+
+FIELDS = ['translated', 'fuzzy', 'untranslated', 'obsolete']
+
+class _Entry(object):
+  """What we need to know about the entry being read."""
+
+  def __init__(self):
+    self.fuzzy = False
+    self.obsolete = False
+    self.has_msgid = False
+    self.msgid_empty = True
+    self.msgstrs = []  # one bool (non-empty) per msgstr / msgstr[n]
+    self.field = None
+
+  def add_string(self, quoted):
+    nonempty = quoted.strip() != '""'
+    if self.field == 'msgid' and nonempty:
+      self.msgid_empty = False
+    elif self.field == 'msgstr' and nonempty:
+      self.msgstrs[-1] = True
+
+
+def _finish(entry, counts):
+  if not entry.has_msgid:
+    return
+  if entry.obsolete:
+    counts['obsolete'] += 1
+  elif entry.msgid_empty:
+    pass  # The header.
+  elif entry.fuzzy:
+    counts['fuzzy'] += 1
+  elif entry.msgstrs and all(entry.msgstrs):
+    counts['translated'] += 1
+  else:
+    counts['untranslated'] += 1
+
+
+def scan_lines(lines):
+  """Returns {'translated': n, 'fuzzy': n, 'untranslated': n, 'obsolete': n}."""
+  counts = dict((field, 0) for field in FIELDS)
+  entry = _Entry()
+  for line in lines:
+    line = line.strip()
+    obsolete = line.startswith('#~')
+    if obsolete:
+      line = line[2:].strip()
+    if not line:
+      _finish(entry, counts)
+      entry = _Entry()
+      continue
+    starts_entry = (line.startswith('#') or line.startswith('msgctxt')
+                    or line.startswith('msgid ') or line.startswith('msgid\t'))
+    if starts_entry and entry.msgstrs:
+      # Entries don't have to be separated by a blank line.
+      _finish(entry, counts)
+      entry = _Entry()
+    if obsolete:
+      entry.obsolete = True
+    if line.startswith('#,'):
+      if 'fuzzy' in line[2:].replace(',', ' ').split():
+        entry.fuzzy = True
+    elif line.startswith('#'):
+      continue
+    elif line.startswith('msgctxt'):
+      entry.field = 'msgctxt'
+    elif line.startswith('msgid_plural'):
+      entry.field = 'msgid_plural'
+    elif line.startswith('msgid'):
+      entry.has_msgid = True
+      entry.field = 'msgid'
+      entry.add_string(line[len('msgid'):])
+    elif line.startswith('msgstr'):
+      entry.field = 'msgstr'
+      entry.msgstrs.append(False)
+      entry.add_string(line[line.find(' '):])
+    elif line.startswith('"'):
+      entry.add_string(line)
+  _finish(entry, counts)
+  return counts
+
+
+def scan_file(fname):
+  """Returns the counts for fname, from the cache if unchanged."""
+  stats_cache = cache.HashCache('po_stats')
+  key = cache.file_hash(fname, STATS_VERSION)
+  counts = stats_cache.get(key)
+  if counts is None:
+    with open(fname, encoding='utf-8') as fin:
+      counts = scan_lines(fin)
+    stats_cache.put(key, counts)
+  return counts
+
+
+def scan_locale_dir(locale_dir, langs):
+  """Returns a list of (lang, pofilename, counts)."""
+  ret = []
+  for lang in langs:
+    curdir = os.path.join(locale_dir, lang, 'LC_MESSAGES')
+    if not os.path.exists(curdir):
+      continue
+    for fname in sorted(os.listdir(curdir)):
+      if fname.endswith('.po'):
+        pofilename = os.path.join(curdir, fname)
+        ret.append((lang, pofilename, scan_file(pofilename)))
+  return ret
+
+
+def completion_table(results):
+  """Returns the lines of a per language completion table."""
+  lines = ['%-8s %10s %6s %12s %8s %6s' % (
+      'Language', 'Translated', 'Fuzzy', 'Untranslated', 'Obsolete', 'Done')]
+  for lang, unused_fname, counts in results:
+    total = counts['translated'] + counts['fuzzy'] + counts['untranslated']
+    if total:
+      done = 100.0 * counts['translated'] / total
+    else:
+      done = 100.0
+    lines.append('%-8s %10d %6d %12d %8d %5.1f%%' % (
+        lang, counts['translated'], counts['fuzzy'], counts['untranslated'],
+        counts['obsolete'], done))
+  return lines
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2010 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Extract translatable messages from python files into a .pot file.
+
+Replaces running pygettext.  Files are parsed with the ast module (and
+tokenize for translator comments), uncached files are handled in a process
+pool and the messages of each file are cached by the hash of its contents
+so only changed files are parsed again.
+
+Recognized calls are _('...'), gettext('...'), N_('...') and
+ngettext('...', '...', n). A comment starting with TRANSLATORS: on the line
+before is copied to the .pot file.
+"""
+
+__author__ = 'Scott Kirkwood (scott+pybdist@forusers.com)'
+
+import ast
+import concurrent.futures
+import glob
+import io
+import os
+import time
+import tokenize
+
+from . import cache
+from . import util
+
+# Function name -> number of leading string arguments.
+KEYWORDS = {
+    '_': 1,
+    'gettext': 1,
+    'N_': 1,
+    'ngettext': 2,
+}
+
+# Change when the cached format changes.
+EXTRACT_VERSION = '2'
+
+class PotExtractException(Exception):
+  pass
+
+
+def _call_name(node):
+  if isinstance(node.func, ast.Name):
+    return node.func.id
+  if isinstance(node.func, ast.Attribute):
+    return node.func.attr
+  return None
+
+
+def _translator_comments(text):
+  """Returns {lineno: comment} for TRANSLATORS: comments."""
+  ret = {}
+  tokens = tokenize.generate_tokens(io.StringIO(text).readline)
+  for tok in tokens:
+    if tok.type != tokenize.COMMENT:
+      continue
+    comment = tok.string.lstrip('#').strip()
+    if comment.upper().startswith('TRANSLATORS:'):
+      ret[tok.start[0]] = comment
+  return ret
+
+
+def extract_text(text, fname='<string>'):
+  """Returns the messages found in python source `text`.
+
+  Returns:
+    list of [msgid, msgid_plural or None, lineno, comment or None]
+  """
+  try:
+    tree = ast.parse(text, fname)
+  except SyntaxError as err:
+    raise PotExtractException('Unable to parse %r: %s' % (fname, err))
+  comments = _translator_comments(text)
+  found = []
+  for node in ast.walk(tree):
+    if not isinstance(node, ast.Call):
+      continue
+    num_args = KEYWORDS.get(_call_name(node))
+    if not num_args or len(node.args) < num_args:
+      continue
+    args = node.args[:num_args]
+    if not all(isinstance(arg, ast.Constant) and isinstance(arg.value, str)
+               for arg in args):
+      continue
+    msgid = args[0].value
+    if not msgid:
+      continue
+    plural = None
+    if num_args == 2:
+      plural = args[1].value
+    found.append((node.lineno, node.col_offset,
+                  [msgid, plural, node.lineno, comments.get(node.lineno - 1)]))
+  # ast.walk() is breadth first, put calls on the same line in source order.
+  found.sort(key=lambda item: item[:2])
+  return [msg for _, _, msg in found]
+
+
+def _extract_file(fname):
+  with open(fname, encoding='utf-8') as fin:
+    return extract_text(fin.read(), fname)
+
+
+def find_files(sources):
+  """Expand files, globs and directories (recursively) into .py files."""
+  ret = []
+  for source in sources:
+    if os.path.isdir(source):
+      for dirpath, dirnames, fnames in os.walk(source):
+        dirnames[:] = sorted(d for d in dirnames if not util.skip_dir(d))
+        ret += [os.path.join(dirpath, fname) for fname in sorted(fnames)
+                if fname.endswith('.py')]
+    else:
+      ret += sorted(glob.glob(source))
+  seen = set()
+  unique = []
+  for fname in ret:
+    fname = os.path.normpath(fname)
+    if fname not in seen:
+      seen.add(fname)
+      unique.append(fname)
+  return unique
+
+
+def extract_files(fnames, workers=None):
+  """Extract messages from every file, using the cache when possible.
+  Returns:
+    {fname: list of messages}
+  """
+  msg_cache = cache.HashCache('pot')
+  ret = {}
+  todo = {}
+  for fname in fnames:
+    key = cache.file_hash(fname, EXTRACT_VERSION)
+    found = msg_cache.get(key)
+    if found is None:
+      todo[fname] = key
+    else:
+      ret[fname] = found
+  if len(todo) > 1:
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+      results = list(executor.map(_extract_file, todo))
+  else:
+    results = [_extract_file(fname) for fname in todo]
+  for fname, msgs in zip(todo, results):
+    msg_cache.put(todo[fname], msgs)
+    ret[fname] = msgs
+  return ret
+
+
+def _quote(text):
+  text = text.replace('\\', '\\\\').replace('"', '\\"')
+  text = text.replace('\t', '\\t').replace('\r', '\\r')
+  return text.replace('\n', '\\n')
+
+
+def _po_string(keyword, text):
+  """Returns the lines for `keyword "text"`, split at newlines."""
+  if '\n' not in text[:-1]:
+    return ['%s "%s"' % (keyword, _quote(text))]
+  ret = ['%s ""' % keyword]
+  parts = text.split('\n')
+  for num, part in enumerate(parts):
+    if num < len(parts) - 1:
+      part += '\n'
+    if part:
+      ret.append('"%s"' % _quote(part))
+  return ret
+
+
+def _header(creation_date):
+  return [
+      '# SOME DESCRIPTIVE TITLE.',
+      '# Copyright (C) YEAR ORGANIZATION',
+      '# FIRST AUTHOR <EMAIL@ADDRESS>, YEAR.',
+      '#',
+      'msgid ""',
+      'msgstr ""',
+      '"Project-Id-Version: PACKAGE VERSION\\n"',
+      '"POT-Creation-Date: %s\\n"' % creation_date,
+      '"PO-Revision-Date: YEAR-MO-DA HO:MI+ZONE\\n"',
+      '"Last-Translator: FULL NAME <EMAIL@ADDRESS>\\n"',
+      '"Language-Team: LANGUAGE <LL@li.org>\\n"',
+      '"MIME-Version: 1.0\\n"',
+      '"Content-Type: text/plain; charset=UTF-8\\n"',
+      '"Content-Transfer-Encoding: 8bit\\n"',
+      '"Generated-By: pybdist\\n"',
+      '',
+      '',
+  ]
+
+
+def pot_body(messages_by_file, fnames):
+  """Returns the lines of the .pot entries, in a stable order.
+
+  Messages are in the order they are first seen going through `fnames`,
+  all the references of a message are listed together.
+  """
+  order = []
+  entries = {}
+  for fname in fnames:
+    for msgid, plural, lineno, comment in messages_by_file[fname]:
+      key = (msgid, plural)
+      if key not in entries:
+        entries[key] = ([], [])
+        order.append(key)
+      refs, comments = entries[key]
+      refs.append('%s:%d' % (fname, lineno))
+      if comment and comment not in comments:
+        comments.append(comment)
+  lines = []
+  for key in order:
+    msgid, plural = key
+    refs, comments = entries[key]
+    lines += ['#. %s' % comment for comment in comments]
+    lines.append('#: %s' % ' '.join(refs))
+    lines += _po_string('msgid', msgid)
+    if plural is None:
+      lines.append('msgstr ""')
+    else:
+      lines += _po_string('msgid_plural', plural)
+      lines.append('msgstr[0] ""')
+      lines.append('msgstr[1] ""')
+    lines.append('')
+  return lines
+
+
+def _old_body(out_pot):
+  """Returns the body of an existing .pot file, or None."""
+  if not os.path.exists(out_pot):
+    return None
+  with open(out_pot, encoding='utf-8') as fin:
+    text = fin.read()
+  index = text.find('\n\n#')
+  if index == -1:
+    return ''
+  return text[index + 2:]
+
+
+def build_pot(out_pot, sources, workers=None):
+  """Creates the .pot file from python sources.
+  Args:
+    out_pot: name of output .pot file to create.
+    sources: list of files, globs or directories (searched recursively).
+    workers: number of processes to use, None for one per cpu.
+  Returns:
+    True if the file was written, False if nothing changed.
+  """
+  fnames = find_files(sources)
+  messages = extract_files(fnames, workers)
+  lines = pot_body(messages, fnames)
+  # Without messages the file is only the header, _old_body() returns ''.
+  body = '\n'.join(lines) + '\n' if lines else ''
+  if _old_body(out_pot) == body:
+    print('%r is up to date' % out_pot)
+    return False
+  creation_date = time.strftime('%Y-%m-%d %H:%M%z', time.localtime())
+  text = '\n'.join(_header(creation_date)) + body
+  dirname = os.path.dirname(out_pot)
+  if dirname and not os.path.isdir(dirname):
+    os.makedirs(dirname)
+  tmp_name = out_pot + '.tmp'
+  with open(tmp_name, 'w', encoding='utf-8') as fout:
+    fout.write(text)
+  os.rename(tmp_name, out_pot)
+  print('Wrote %r, %d files' % (out_pot, len(fnames)))
+  return True
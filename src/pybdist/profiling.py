@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2010 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Where a pybdist run spends its time.
+
+Every stage (ex. build_man, check_spelling) is a span, a function or a
+with block:
+  @profiling.stage('build_man', 'build')
+  def build_man(setup):
+External tools are run with run_or_die(), each run is a span too.  A span
+has the wall time, the CPU time and block I/O (as bytes) of pybdist and of
+the processes it waited for.  For a tool these come from wait4() so they
+are the tool's own (and its children's), including its largest resident
+set (max_rss_kb).  The kernel only keeps the peak resident set of the whole
+process, so a stage has process_peak_rss_kb and children_peak_rss_kb, the
+peaks since pybdist started, not of the stage.
+
+--profile FILE writes the spans in Chrome's trace event format, open it in
+chrome://tracing or https://ui.perfetto.dev.  With --profile-python the
+python code is profiled with cProfile too (FILE.prof, see pstats) and with
+--profile-memory the largest allocations are listed in FILE.memory.txt.
+"""
+
+__author__ = 'Scott Kirkwood (scott+pybdist@forusers.com)'
+
+import collections
+import contextlib
+import json
+import os
+import resource
+import subprocess
+import threading
+import time
+
+# ru_inblock and ru_oublock count 512 byte blocks.
+BLOCK_SIZE = 512
+
+Span = collections.namedtuple('Span', 'name category start seconds thread args')
+
+_T0 = time.perf_counter()
+_LOCK = threading.Lock()
+_SPANS = []
+_PYTHON_PROFILE = None
+_MEMORY_PROFILE = False
+
+class ProfilingException(Exception):
+  pass
+
+
+def _record(name, category, start, args):
+  span = Span(name, category, start - _T0, time.perf_counter() - start,
+              threading.get_native_id(), args)
+  with _LOCK:
+    _SPANS.append(span)
+  return span
+
+
+def spans():
+  """Returns the spans recorded so far, in the order they ended."""
+  with _LOCK:
+    return list(_SPANS)
+
+
+def _usage_args(before, after):
+  """The rusage differences between before and after as span arguments."""
+  return {
+      'cpu_user': round(after.ru_utime - before.ru_utime, 6),
+      'cpu_sys': round(after.ru_stime - before.ru_stime, 6),
+      'read_bytes': (after.ru_inblock - before.ru_inblock) * BLOCK_SIZE,
+      'write_bytes': (after.ru_oublock - before.ru_oublock) * BLOCK_SIZE,
+  }
+
+
+@contextlib.contextmanager
+def stage(name, category='stage', **args):
+  """Record the enclosed code (or decorated function) as the span `name`.
+  Args:
+    name: ex. 'build_deb'.
+    category: ex. 'build', 'upload', 'check'.
+    args: more to show in the trace.
+  """
+  self_before = resource.getrusage(resource.RUSAGE_SELF)
+  children_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+  start = time.perf_counter()
+  error = None
+  try:
+    yield
+  except BaseException as err:
+    error = err.__class__.__name__
+    raise
+  finally:
+    self_after = resource.getrusage(resource.RUSAGE_SELF)
+    children_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    span_args = dict(args)
+    span_args.update(_usage_args(self_before, self_after))
+    # Peaks since the process started, the kernel doesn't reset them.
+    span_args['process_peak_rss_kb'] = self_after.ru_maxrss
+    for key, value in _usage_args(children_before, children_after).items():
+      span_args['children_' + key] = value
+    span_args['children_peak_rss_kb'] = children_after.ru_maxrss
+    if error:
+      span_args['error'] = error
+    _record(name, category, start, span_args)
+
+
+def run_or_die(args, err_mess=None, output=True, exception=ProfilingException):
+  """Run the `args` (a list) or die, recorded as a span.
+  Args:
+    args: list of arguments to pass to call
+    err_mess: Extra hint what went wrong.
+    output: output the command before running
+    exception: class of the exception to raise.
+  Returns:
+    the Span of the run.
+  """
+  if output:
+    print(' '.join(args))
+  start = time.perf_counter()
+  try:
+    proc = subprocess.Popen(args)
+  except OSError as oserr:
+    mess = 'Error running: %r: %r' % (' '.join(args), oserr)
+    if err_mess:
+      mess += '\n' + err_mess
+    raise exception(mess)
+  try:
+    _, status, usage = os.wait4(proc.pid, 0)
+  except KeyboardInterrupt:
+    proc.kill()
+    proc.wait()
+    raise
+  # Let Popen know, it would wait for the pid again otherwise.
+  proc.returncode = os.waitstatus_to_exitcode(status)
+  span_args = dict(command=' '.join(args), exit_code=proc.returncode,
+                   max_rss_kb=usage.ru_maxrss)
+  span_args.update(_usage_args(resource.struct_rusage((0,) * 16), usage))
+  span = _record(os.path.basename(args[0]), 'tool', start, span_args)
+  if proc.returncode:
+    mess = 'Error running: code %r\n%r' % (proc.returncode, ' '.join(args))
+    if err_mess:
+      mess += '\n' + err_mess
+    raise exception(mess)
+  return span
+
+
+def start(python=False, memory=False):
+  """Start profiling the python code and/or the memory it allocates."""
+  global _PYTHON_PROFILE, _MEMORY_PROFILE
+  if python:
+    import cProfile
+    _PYTHON_PROFILE = cProfile.Profile()
+    _PYTHON_PROFILE.enable()
+  if memory:
+    import tracemalloc
+    tracemalloc.start(25)
+    _MEMORY_PROFILE = True
+
+
+def chrome_trace(recorded=None):
+  """Returns the spans as a Chrome trace (a dict ready for json)."""
+  pid = os.getpid()
+  events = [dict(name='process_name', ph='M', pid=pid, tid=0,
+                 args=dict(name='pybdist'))]
+  for span in recorded if recorded is not None else spans():
+    events.append(dict(name=span.name, cat=span.category, ph='X', pid=pid,
+                       tid=span.thread, ts=round(span.start * 1e6, 1),
+                       dur=round(span.seconds * 1e6, 1), args=span.args))
+  events.sort(key=lambda event: event.get('ts', -1))
+  return dict(traceEvents=events, displayTimeUnit='ms')
+
+
+def _write_json(data, fname):
+  tmp_name = fname + '.tmp'
+  with open(tmp_name, 'w') as fout:
+    json.dump(data, fout, indent=1)
+  os.rename(tmp_name, fname)
+
+
+def finish(fname):
+  """Stop profiling and write the trace (and profiles) to fname.
+  Returns:
+    list of the files written.
+  """
+  global _PYTHON_PROFILE, _MEMORY_PROFILE
+  written = []
+  _write_json(chrome_trace(), fname)
+  written.append(fname)
+  if _PYTHON_PROFILE:
+    _PYTHON_PROFILE.disable()
+    _PYTHON_PROFILE.dump_stats(fname + '.prof')
+    written.append(fname + '.prof')
+    _PYTHON_PROFILE = None
+  if _MEMORY_PROFILE:
+    import tracemalloc
+    snapshot = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    _MEMORY_PROFILE = False
+    with open(fname + '.memory.txt', 'w') as fout:
+      for stat in snapshot.statistics('traceback')[:30]:
+        fout.write('%s\n' % stat)
+        fout.write('\n'.join('    %s' % line for line in stat.traceback.format()))
+        fout.write('\n')
+    written.append(fname + '.memory.txt')
+  return written
+
+
+def print_summary(recorded=None):
+  """Print the stages and tools, slowest first."""
+  recorded = spans() if recorded is None else recorded
+  print('%-22s %-8s %8s %8s %11s' % ('span', 'category', 'wall s', 'cpu s', 'max rss kb'))
+  for span in sorted(recorded, key=lambda span: -span.seconds):
+    cpu = (span.args.get('cpu_user', 0) + span.args.get('cpu_sys', 0)
+           + span.args.get('children_cpu_user', 0) + span.args.get('children_cpu_sys', 0))
+    if 'max_rss_kb' in span.args:
+      rss = '%10d ' % span.args['max_rss_kb']
+    else:
+      rss = '%10d*' % max(span.args.get('process_peak_rss_kb', 0),
+                          span.args.get('children_peak_rss_kb', 0))
+    print('%-22s %-8s %8.2f %8.2f %s' % (span.name, span.category, span.seconds, cpu, rss))
+  print('* peak of the process (or of its children) so far, not of the stage')
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2010 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""The settings of a project's setup.py as one immutable ProjectConfig.
+
+Every setting pybdist knows about is a field of ProjectConfig, the
+optional ones get their default (ex. PY_NAME is NAME, LANGS is empty) so
+the code reads config.LANGS instead of checking hasattr(setup, 'LANGS').
+Lists become tuples and dicts (ex. SETUP) read-only mappings, all the
+way down, use with_setup() for a copy with a changed SETUP.  The field names are the
+setup.py names, so a ProjectConfig is used where the setup module was.
+
+  config = project_config.from_module(setup)   # setup.py already imported
+  config = project_config.load('../other/setup.py')
+  config = project_config.get(setup)           # any of the above
+
+load() evaluates setup.py and caches the config in ~/.cache/pybdist/config/
+by the hash of setup.py (and of the locale, setup.py translates the
+descriptions), so loading the configs of many projects only evaluates the
+setup.py files that changed.  The files setup.py reads (ex. README.rst) and
+the modules it imports from the project's directory (ex. the version in
+demo/__init__.py) are hashed too, a change to any of them evaluates it
+again.  Files of the python installation are assumed not to change, and
+settings that don't survive the JSON round trip (ex. a cmdclass, or dicts
+with non string keys) mean setup.py is evaluated every time.
+"""
+
+__author__ = 'Scott Kirkwood (scott+pybdist@forusers.com)'
+
+import collections
+import json
+import os
+import runpy
+import sys
+import threading
+import types
+
+from . import cache
+
+# Change when the fields, their normalization or the cache entries change.
+CONFIG_VERSION = '2'
+
+# Files opened while _evaluate() runs, see _audit().
+_OPENED = None
+_OPENED_THREAD = None
+_AUDITING = False
+
+# Environment setup.py's gettext calls depend on.
+LOCALE_VARS = ['LANGUAGE', 'LC_ALL', 'LC_MESSAGES', 'LANG']
+
+# setup.py must set these.
+REQUIRED = ['NAME', 'VER', 'DIR', 'RELEASE_FILE', 'SETUP']
+
+# Optional settings and how to get their value.
+_STR = 'str'
+_TUPLE = 'tuple'
+_DICT = 'dict'
+OPTIONAL = collections.OrderedDict([
+    ('PY_NAME', _STR),
+    ('PY_SRC', _STR),
+    ('DEB_NAME', _STR),
+    ('AUTHOR_NAME', _STR),
+    ('GOOGLE_CODE_EMAIL', _STR),
+    ('COPYRIGHT_NAME', _STR),
+    ('RELEASE_FORMAT', _STR),
+    ('MAN_FILE', _STR),
+    ('VCS', _STR),
+    ('LANGS', _TUPLE),
+    ('DEPENDS', _TUPLE),
+    ('MAILING_LIST', _TUPLE),
+    ('SMTP_SERVER', _STR),
+    ('MAIL_SERVERS', _DICT),
+    ('FRESHMEAT', _STR),
+    ('FRESHMEAT_HOST', _STR),
+    ('ANNOUNCE', _TUPLE),
+    ('ANNOUNCE_CHANNELS', _DICT),
+    ('ANNOUNCE_TIMEOUTS', _DICT),
+    ('SPELL_WORD_LISTS', _TUPLE),
+    ('TM_LOCALE_DIRS', _TUPLE),
+])
+
+ProjectConfig = collections.namedtuple('ProjectConfig', REQUIRED + list(OPTIONAL))
+
+class ProjectConfigException(Exception):
+  pass
+
+
+def _normalize(name, kind, value):
+  if value is None:
+    return {_STR: None, _TUPLE: (), _DICT: _freeze({})}[kind]
+  if kind == _TUPLE:
+    if isinstance(value, str):
+      return (value,)
+    return tuple(value)
+  if kind == _DICT:
+    return _freeze(value)
+  if not isinstance(value, str):
+    raise ProjectConfigException('%s should be a string, not %r' % (name, value))
+  return value
+
+
+def _freeze(value):
+  """value with dicts as read-only mappings and lists as tuples."""
+  if isinstance(value, (dict, types.MappingProxyType)):
+    return types.MappingProxyType(dict((key, _freeze(val)) for key, val in value.items()))
+  if isinstance(value, (list, tuple)):
+    return tuple(_freeze(val) for val in value)
+  return value
+
+
+def _thaw(value):
+  """The opposite of _freeze(), for json."""
+  if isinstance(value, types.MappingProxyType):
+    return dict((key, _thaw(val)) for key, val in value.items())
+  if isinstance(value, tuple):
+    return [_thaw(val) for val in value]
+  return value
+
+
+def from_namespace(values):
+  """Returns the ProjectConfig of the settings in values (a dict)."""
+  missing = [name for name in REQUIRED if values.get(name) is None]
+  if missing:
+    raise ProjectConfigException('setup.py needs to set %s' % ', '.join(missing))
+  fields = dict((name, values[name]) for name in REQUIRED)
+  for name, kind in OPTIONAL.items():
+    fields[name] = _normalize(name, kind, values.get(name))
+  setup_dict = fields['SETUP']
+  fields['PY_NAME'] = fields['PY_NAME'] or fields['NAME']
+  fields['PY_SRC'] = fields['PY_SRC'] or '%s.py' % fields['PY_NAME']
+  fields['DEB_NAME'] = fields['DEB_NAME'] or fields['NAME']
+  fields['AUTHOR_NAME'] = fields['AUTHOR_NAME'] or setup_dict.get('author')
+  fields['GOOGLE_CODE_EMAIL'] = fields['GOOGLE_CODE_EMAIL'] or setup_dict.get('author_email')
+  fields['SETUP'] = _freeze(setup_dict)
+  return ProjectConfig(**fields)
+
+
+def from_module(setup):
+  """Returns the ProjectConfig of the imported setup module (or config)."""
+  if isinstance(setup, ProjectConfig):
+    return setup
+  return from_namespace(vars(setup))
+
+
+def get(setup):
+  """Returns the ProjectConfig of setup: a module, a ProjectConfig or the
+  name of a setup.py file (see load())."""
+  if isinstance(setup, str):
+    return load(setup)
+  return from_module(setup)
+
+
+def with_setup(config, **values):
+  """Returns a copy of config with values changed in its SETUP."""
+  setup_dict = dict(config.SETUP)
+  setup_dict.update(values)
+  return config._replace(SETUP=_freeze(setup_dict))
+
+
+def _to_dict(config):
+  """The config as a dict of JSON values."""
+  return dict((name, _thaw(value)) for name, value in config._asdict().items())
+
+
+def _audit(event, args):
+  """Audit hook, remembers the files the evaluating thread opens."""
+  if event != 'open' or _OPENED is None or _OPENED_THREAD != threading.get_ident():
+    return
+  path, mode = args[0], args[1]
+  if isinstance(path, str) and (mode is None or 'r' in mode):
+    _OPENED.add(os.path.abspath(path))
+
+
+def _is_installed(path):
+  """True if path is part of the python installation (stdlib, site-packages)."""
+  return any(path.startswith(os.path.join(prefix, ''))
+             for prefix in set([sys.prefix, sys.base_prefix, sys.exec_prefix]))
+
+
+def _evaluate(fname):
+  """Returns (globals of setup.py, files it depends on).
+
+  setup.py is run from its directory. The dependencies are the files it
+  opened and the modules under its directory, without fname itself.
+  """
+  global _OPENED, _OPENED_THREAD, _AUDITING
+  if not _AUDITING:
+    sys.addaudithook(_audit)
+    _AUDITING = True
+  fname = os.path.abspath(fname)
+  dirname = os.path.dirname(fname)
+  old_dir = os.getcwd()
+  sys.path.insert(0, dirname)
+  os.chdir(dirname)
+  _OPENED, _OPENED_THREAD = set(), threading.get_ident()
+  try:
+    # Not '__main__', that would run setup(**SETUP).
+    values = runpy.run_path(os.path.basename(fname), run_name='pybdist_setup')
+    opened = _OPENED
+  finally:
+    _OPENED, _OPENED_THREAD = None, None
+    os.chdir(old_dir)
+    sys.path.remove(dirname)
+  # A module's source isn't opened when its .pyc is used (or it was
+  # already imported).
+  for module in list(sys.modules.values()):
+    source = getattr(module, '__file__', None)
+    if source and source.startswith(os.path.join(dirname, '')):
+      opened.add(source)
+  deps = sorted(path for path in opened
+                if path != fname and not path.endswith('.pyc')
+                and not _is_installed(path) and os.path.isfile(path))
+  return values, deps
+
+
+def _key(fname):
+  salt = CONFIG_VERSION + ''.join(
+      '%s=%s' % (var, os.environ.get(var, '')) for var in LOCALE_VARS)
+  return cache.file_hash(fname, salt)
+
+
+def _deps_unchanged(deps):
+  """True if the files of deps ({path: hash}) still have the same contents."""
+  for path, digest in deps.items():
+    try:
+      if cache.file_hash(path) != digest:
+        return False
+    except (IOError, OSError):
+      return False
+  return True
+
+
+def load(fname='setup.py'):
+  """Returns the ProjectConfig of the setup.py fname, evaluated if not cached."""
+  config_cache = cache.HashCache('config')
+  key = _key(fname)
+  found = config_cache.get(key)
+  if found is not None and _deps_unchanged(found['deps']):
+    return from_namespace(found['values'])
+  values, deps = _evaluate(fname)
+  config = from_namespace(values)
+  values = _to_dict(config)
+  try:
+    round_trip = from_namespace(json.loads(json.dumps(values)))
+  except (TypeError, ValueError):
+    # ex. SETUP has a cmdclass, evaluate it every time.
+    return config
+  if round_trip != config:
+    # ex. a dict with int keys, they would come back as strings.
+    return config
+  config_cache.put(key, dict(
+      values=values, deps=dict((path, cache.file_hash(path)) for path in deps)))
+  return config
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2010 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Snapshot of the parsed project files shared by all the checks.
+
+Each file is parsed the first time it's asked for and the result is kept
+until the file's stat (mtime, size, inode) changes, so one --check run
+reads RELEASE.rst, debian/changelog and the source file once and every
+stage sees the same view.
+"""
+
+__author__ = 'Scott Kirkwood (scott+pybdist@forusers.com)'
+
+import os
+import re
+
+from . import release
+
+CHANGELOG_FILE = 'debian/changelog'
+
+RE_PY_VER = re.compile(r'__version__\s*=\s*[\'"](.*)[\'"]')
+
+class ProjectState(object):
+  """Lazily parsed, memoized view of a project."""
+
+  def __init__(self, setup):
+    self.setup = setup
+    self._cache = {}
+
+  def _stat_key(self, fname):
+    stat = os.stat(fname)
+    return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+  def _cached(self, key, fname, parse):
+    """Returns parse(), recomputed only if fname changed since last time."""
+    stat_key = self._stat_key(fname)
+    if key in self._cache:
+      old_stat_key, value = self._cache[key]
+      if old_stat_key == stat_key:
+        return value
+    value = parse()
+    self._cache[key] = (stat_key, value)
+    return value
+
+  def invalidate(self):
+    """Forget everything, the next call re-reads the files."""
+    self._cache = {}
+
+  def source_file(self):
+    return os.path.join(self.setup.DIR, self.setup.PY_SRC)
+
+  def last_release(self):
+    """Returns (version, date, lines) of the newest release notes."""
+    fname = self.setup.RELEASE_FILE
+    pattern = self.setup.RELEASE_FORMAT
+    return self._cached(('release', pattern), fname,
+        lambda: release.parse_last_release(fname, pattern))
+
+  def deb_changelog(self):
+    """Returns (version, date, lines) of the newest debian/changelog entry."""
+    return self._cached('changelog', CHANGELOG_FILE,
+        lambda: release.parse_deb_changelog(CHANGELOG_FILE))
+
+  def release_history(self):
+    """Returns the release.ReleaseHistory of every release note."""
+    fname = self.setup.RELEASE_FILE
+    pattern = self.setup.RELEASE_FORMAT
+    return self._cached(('release_history', pattern), fname,
+        lambda: release.release_history(fname, pattern))
+
+  def deb_changelog_history(self):
+    """Returns the release.ReleaseHistory of every debian/changelog entry."""
+    return self._cached('changelog_history', CHANGELOG_FILE,
+        lambda: release.deb_changelog_history(CHANGELOG_FILE))
+
+  def source_version(self):
+    """Returns the __version__ in the source file or None."""
+    fname = self.source_file()
+    return self._cached('source', fname, lambda: _parse_source_version(fname))
+
+
+def _parse_source_version(fname):
+  with open(fname) as fin:
+    grps = RE_PY_VER.search(fin.read())
+  if not grps:
+    return None
+  return grps.group(1)
@@ -20,92 +20,58 @@ You'll need:
 sudo apt-get install help2man fakeroot python-twitter python-simplejson
 
 You'll also need ~/.netrc ~/.ssh/<fname>
+
+Only what the selected command needs is imported, the other modules (and
+the packages they need, like twitter, apt or polib) are imported in the
+functions that use them.  See startup_bench.py to measure it.
 """
 
 __author__ = 'Scott Kirkwood (scott+pybdist@forusers.com)'
 __version__ = '0.3.1'
 
 import codecs
-import getpass
 import glob
-import http.client
-import netrc
 import os
-import re
-from . import release
 import shutil
-import simplejson
-import subprocess
-import twitter
-
-from . import debian
-from . import documents
-from . import googlecode_update
-from . import i18n
-from . import mailinglist
-from . import mercurial
-from . import pypi_list
-from . import rst_check
-from . import spell_check
-from . import update_file
+
+from . import metrics
+from . import profiling
+from . import project_config
+from . import project_state
 
 class PyBdistException(Exception):
   pass
 
 
-def fixup_setup(setup):
-  """Fill in any missing pieces from setup."""
-  if not hasattr(setup, 'PY_NAME'):
-    setup.PY_NAME = setup.NAME
-  if not hasattr(setup, 'PY_SRC'):
-    setup.PY_SRC = '%s.py' % setup.PY_NAME
-  if not hasattr(setup, 'DEB_NAME'):
-    setup.DEB_NAME = setup.NAME
-  if not hasattr(setup, 'AUTHOR_NAME'):
-    setup.AUTHOR_NAME = setup.SETUP['author']
-  if not hasattr(setup, 'GOOGLE_CODE_EMAIL'):
-    setup.GOOGLE_CODE_EMAIL = setup.SETUP['author_email']
-  return setup
-
 def _run_or_die(args, err_mess=None, output=True):
-  """Run the `args` (a list) or die.
-  Args:
-    args: list of arguments to pass to call
-    err_mess: Extra hint what went wrong.
-    output: output the command before running
-  """
-  if output:
-    print(' '.join(args))
-  try:
-    ret = subprocess.call(args)
-  except OSError as oserr:
-    mess = 'Error running: %r: %r' % (' '.join(args), oserr)
-    if err_mess:
-      mess += '\n' + err_mess
-    raise PyBdistException(err_mess)
-  if ret:
-    raise PyBdistException('Error running: code %r\n%r' % (ret, ' '.join(args)))
-
-
-def _get_py_source_version(setup):
-  fname = os.path.join(setup.DIR, setup.PY_SRC)
-  re_py_ver = re.compile(r'__version__\s*=\s*[\'"](.*)[\'"]')
-  grps = re_py_ver.search(open(fname).read())
-  if not grps:
-    raise PyBdistException('Unable to find __version__ in %r' % fname)
-  source_ver = grps.group(1)
+  """Run the `args` (a list) or die, see profiling.run_or_die()."""
+  return profiling.run_or_die(args, err_mess, output, PyBdistException)
+
+
+def _get_state(setup, state):
+  if state:
+    return state
+  return project_state.ProjectState(setup)
+
+
+def _get_py_source_version(setup, state=None):
+  state = _get_state(setup, state)
+  source_ver = state.source_version()
+  if not source_ver:
+    raise PyBdistException('Unable to find __version__ in %r' % state.source_file())
   return source_ver
 
 
-def get_and_verify_versions(setup):
+@profiling.stage('check_versions', 'check')
+def get_and_verify_versions(setup, state=None):
   """Get the version and make sure all versions are synched."""
+  state = _get_state(setup, state)
   setup_ver = setup.VER
-  source_ver = _get_py_source_version(setup)
+  source_ver = _get_py_source_version(setup, state)
 
-  rel_ver, _, _ = _parse_last_release(setup)
+  rel_ver, _, _ = _parse_last_release(setup, state)
 
-  changelog_ver, _, _ = release.parse_deb_changelog(
-      'debian/changelog')
+  changelog_ver, _, _ = state.deb_changelog()
 
   if (setup_ver != source_ver or setup_ver != rel_ver
       or setup_ver != changelog_ver):
@@ -118,8 +84,11 @@ def get_and_verify_versions(setup):
   print('   Local setup versions agree')
   return setup_ver
 
+@profiling.stage('check_remote', 'check')
 def verify_remote_versions(setup):
   """Examine the remote versions."""
+  from . import pypi_list
+  from . import release
   setup_ver = setup.VER
   gc_ver, _, _ = release.get_last_google_code_version(setup.NAME)
   pypi_ver, _, _ = pypi_list.get_latest_version(setup.NAME)
@@ -134,48 +103,55 @@ def verify_remote_versions(setup):
     print('** Note: pypi.python.org version is at %r and needs to be uploaded' % pypi_ver)
 
 
-def _parse_last_release(setup):
+def _parse_last_release(setup, state=None):
   """Parse the release file from setup information.
+  Args:
+    setup: setup module.
+    state: ProjectState to reuse, or None.
   Returns:
     rel_ver, relase_date, rel_lines
   """
-  release_regex = _get_var(setup, 'RELEASE_FORMAT')
-  return release.parse_last_release(
-      setup.RELEASE_FILE, release_regex)
+  return _get_state(setup, state).last_release()
 
 
-def parse_last_release(setup):
-  _, rel_date, rel_lines = _parse_last_release(setup)
+def parse_last_release(setup, state=None):
+  _, rel_date, rel_lines = _parse_last_release(setup, state)
   return rel_date, rel_lines
 
 
-def build_zip_tar(unused_setup):
+@profiling.stage('build_zip_tar', 'build')
+def build_zip_tar(setup):
   args = [
     'python', 'setup.py', 'sdist', '--formats=gztar,zip']
   _run_or_die(args, 'Error building sdist')
+  for ext in ('zip', 'tar.gz'):
+    metrics.record_artifact('dist/%s-%s.%s' % (setup.NAME, setup.VER, ext))
   print('Built zip and tar')
 
 
-def upload_to_pypi(unused_setup):
+@profiling.stage('upload_pypi', 'upload')
+def upload_to_pypi(setup):
   args = [
     'python', 'setup.py', 'sdist', '--formats=zip', 'upload',]
-  _run_or_die(args, '\n'.join([
+  span = _run_or_die(args, '\n'.join([
       'Error uploading to pypi',
       'If it\'s the first time, run "python setup.py register"']))
+  # setup.py builds the sdist in the same run, it can't be timed apart.
+  metrics.record_upload('pypi', 'dist/%s-%s.zip' % (setup.NAME, setup.VER),
+                        span.seconds, phase='build+upload')
   print('Upload to pypi')
 
 
+@profiling.stage('build_man', 'build')
 def build_man(setup):
-  if not hasattr(setup, 'MAN_FILE') or not setup.MAN_FILE:
+  if not setup.MAN_FILE:
     return
 
   dest_dir = os.path.dirname(setup.MAN_FILE)
   if not os.path.isdir(dest_dir):
     print('Making directory %r' % dest_dir)
     os.makedirs(dest_dir)
-  langs = ['']
-  if hasattr(setup, 'LANGS'):
-    langs += setup.LANGS
+  langs = [''] + list(setup.LANGS)
   for lang in langs:
     if not lang:
       lang_dot = ''
@@ -198,18 +174,17 @@ def build_man(setup):
     _run_or_die(args, '\n'.join([
         'Failed to build manfile',
         'You may need to install help2man']))
+    metrics.record_artifact(cur_manfile)
 
   print('Built %s.1' % setup.NAME)
 
 
-def _get_var(setup, var):
-  if hasattr(setup, var):
-    return getattr(setup, var)
-  return None
-
-
+@profiling.stage('build_deb', 'build')
 def build_deb(setup):
+  from . import debian
   debian.build_deb(setup)
+  for deb in get_deb_filenames(setup):
+    metrics.record_artifact(os.path.join('dist', deb))
 
 def get_deb_filenames(setup):
   """Returns the list of debian files found in dist/ folder.
@@ -292,6 +267,7 @@ def _clean_eggs(dist_dir, setup):
         os.unlink(fname)
 
 
+@profiling.stage('clean', 'clean')
 def clean_all(setup):
   clean_config(setup)
   _clean_packages(setup)
@@ -300,14 +276,15 @@ def clean_all(setup):
   _clean_scripts(setup)
 
 
-def print_release_info(setup):
-  rel_date, rel_lines = parse_last_release(setup)
+def print_release_info(setup, state=None):
+  rel_date, rel_lines = parse_last_release(setup, state)
   print('Local version is %r, date %r' % (setup.VER, rel_date))
   print('Release notes')
   print('-------------')
   print('\n'.join(rel_lines))
   print()
 
+@profiling.stage('test', 'test')
 def test_code(setup):
   """Run tests with nosetests."""
   dirs = [setup.DIR]
@@ -327,6 +304,7 @@ def test_code(setup):
   args += dirs
   _run_or_die(args, 'You may need to install python-nose')
 
+@profiling.stage('check_code', 'check')
 def check_code(setup):
   """Check the source code for errors."""
   if os.path.exists('.pycheckrc'):
@@ -345,78 +323,161 @@ def check_code(setup):
   print('Passed pychecker')
   os.chdir(olddir)
 
+@profiling.stage('check_rst', 'check')
 def check_rst(setup):
-  """Check the release reStructuredText for errors."""
-  rst_check.check_file(setup.RELEASE_FILE)
-  rst_check.check_text(setup.SETUP['long_description'])
-
-def check_spelling(setup):
-  """Check the release reStructuredText for errors."""
+  """Check every .rst document of the project and long_description for errors.
+  Returns:
+    number of problems found.
+  """
+  from . import rst_check
+  docs = []
+  for fname in rst_check.find_documents('.'):
+    with open(fname, encoding='utf-8') as fin:
+      docs.append((fname, fin.read()))
+  docs.append(('long_description', setup.SETUP['long_description']))
+  errors = rst_check.check_project(docs, setup.LANGS, setup.NAME)
+  for error in errors:
+    print(rst_check.format_error(error))
+  return len(errors)
+
+def _spelling_jobs(setup):
+  """Returns the (fname, lang) to spell check."""
+  jobs = [(setup.RELEASE_FILE, 'en'), ('setup.py', 'en')]
+  for fname in sorted(glob.glob('README*.rst')):
+    parts = fname.split('.')
+    if len(parts) == 3:
+      jobs.append((fname, parts[1]))
+    else:
+      jobs.append((fname, 'en'))
+  for lang in setup.LANGS:
+    pattern = os.path.join(_get_locale_dir(setup), lang, 'LC_MESSAGES', '*.po')
+    jobs += [(fname, lang) for fname in sorted(glob.glob(pattern))]
+  return jobs
+
+@profiling.stage('check_spelling', 'check')
+def check_spelling(setup, report_file=None, fix=False):
+  """Spell check the release notes, setup.py, READMEs and catalogs without prompting.
+  English is checked against the word lists if there are some, everything
+  else goes through aspell.
+  Args:
+    setup: the setup module.
+    report_file: also write the misspellings, as JSON, to this file.
+    fix: open aspell on the files with misspellings.
+  Returns:
+    number of misspelled words plus the number of files that couldn't be
+    checked.
+  """
+  from . import aspell_pool
+  from . import spell_batch
+  from . import spell_check
   dictionary = '.aspell.en.pws'
-  spell_check.check_file(setup.RELEASE_FILE, dictionary)
-  spell_check.check_code_file('setup.py', dictionary)
+  jobs = _spelling_jobs(setup)
+  results = {}
+  try:
+    word_lists = spell_batch.find_word_lists(
+        dictionary, setup.SPELL_WORD_LISTS)
+  except spell_batch.SpellBatchException:
+    word_lists = None
+  if word_lists:
+    results = spell_batch.check_files(
+        [fname for fname, lang in jobs if lang == 'en'], word_lists)
+  aspell_jobs = [(fname, lang) for fname, lang in jobs if fname not in results]
+  unchecked = 0
+  if aspell_jobs:
+    with aspell_pool.AspellPool(os.getcwd()) as pool:
+      results.update(pool.check_files(aspell_jobs))
+    for lang, err in sorted(pool.errors.items()):
+      fnames = [fname for fname, job_lang in aspell_jobs if job_lang == lang]
+      print('** Unable to spell check %s: %s' % (', '.join(fnames), err))
+      unchecked += len(fnames)
+  results = dict((fname, results[fname]) for fname, _ in jobs if fname in results)
+  lines = spell_batch.report(results)
+  for line in lines:
+    print(line)
+  if report_file:
+    spell_batch.write_report(results, report_file)
+  if fix:
+    for fname, lang in jobs:
+      if not results.get(fname) or fname.endswith('.po'):
+        continue
+      if fname.endswith('.py'):
+        spell_check.check_code_file(fname, dictionary)
+      else:
+        spell_check.check_file(fname, dictionary, lang)
+  return len(lines) + unchecked
 
-def _maybe_update_file(old_fname, old_ver, new_fname, new_ver, replace_text, regex, del_lines=0):
+def _maybe_update_file(trans, old_fname, old_ver, new_fname, new_ver, replace_text, regex):
+  """Ask and stage the update in `trans` (an update_file.Transaction)."""
   print('%r has version %r and %r has version %r' % (old_fname, old_ver, new_fname, new_ver))
   prompt = 'Update %r?: ' % old_fname
   yn = input(prompt)
   if yn.lower() == 'y':
-    if regex:
-      update_file.update_lines(old_fname, regex, replace_text)
-    else:
-      update_file.insert_before(old_fname, replace_text, del_lines)
-
-def _ver_lines_different(lines1, lines2):
-  if len(lines1) != len(lines2):
-    return True
-  for l1, l2 in zip(lines1, lines2):
-    if l1.strip() != l2.strip():
-      return True
-  return False
-
-def _fix_versions_notes(setup):
-  ver, date, lines = _parse_last_release(setup)
+    trans.update_lines(old_fname, regex, replace_text)
+
+def _fix_versions_notes(setup, state=None):
+  from . import changelog_sync
+  from . import update_file
+  state = _get_state(setup, state)
+  ver = _parse_last_release(setup, state)[0]
   setup_ver = setup.VER
-  source_file = os.path.join(setup.DIR, setup.PY_SRC)
-  source_ver = _get_py_source_version(setup)
+  source_file = state.source_file()
+  source_ver = _get_py_source_version(setup, state)
   setup_file = 'setup.py'
   release_file = setup.RELEASE_FILE
-  changelog_file = 'debian/changelog'
-  changelog_ver, _, cl_lines = release.parse_deb_changelog(changelog_file)
+  changelog_file = project_state.CHANGELOG_FILE
 
   STRING_GROUP = '["\']([^"\']+)["\']'
   EQ = '\s*=\s*'
-  if ver != setup.VER:
-    _maybe_update_file(setup_file, setup_ver, release_file, ver,
-        ver, r'^VER' + EQ + STRING_GROUP)
-
-  if ver != changelog_ver or _ver_lines_different(lines, cl_lines):
-    setup.VER = ver
-    if ver == changelog_ver:
-      del_lines = len(cl_lines) + 5
-    else:
-      del_lines = 0
-    new_text = '\n'.join(release.out_debian_changelog(setup, lines))
-    _maybe_update_file(changelog_file, changelog_ver, release_file, ver,
-        new_text, None, del_lines)
-
-  if ver != source_ver:
-    _maybe_update_file(source_file, source_ver, release_file, ver,
-        ver, r'^\s*__version__' + EQ + STRING_GROUP)
-
-
-def check_for_errors(setup):
-  _fix_versions_notes(setup)
+  # All the files are bumped together or not at all.
+  with update_file.Transaction() as trans:
+    if ver != setup.VER:
+      _maybe_update_file(trans, setup_file, setup_ver, release_file, ver,
+          ver, r'^VER' + EQ + STRING_GROUP)
+
+    sync = changelog_sync.plan(setup, state.release_history(),
+                               state.deb_changelog_history())
+    if not sync.empty():
+      print('\n'.join(sync.messages))
+      yn = input('Sync %r and %r?: ' % (release_file, changelog_file))
+      if yn.lower() == 'y':
+        sync.stage(trans)
+
+    if ver != source_ver:
+      _maybe_update_file(trans, source_file, source_ver, release_file, ver,
+          ver, r'^\s*__version__' + EQ + STRING_GROUP)
+
+
+def _get_vcs():
+  """Returns the git or mercurial module, whichever this project uses."""
+  from . import git
+  from . import mercurial
+  # .git is a file in worktrees and submodules.
+  if os.path.exists('.git'):
+    return git
+  return mercurial
+
+@profiling.stage('checks', 'check')
+def check_for_errors(setup, state=None, spell_report=None):
+  from . import stat_snapshot
+  state = _get_state(setup, state)
+  _fix_versions_notes(setup, state)
   check_code(setup)
-  check_rst(setup)
-  check_spelling(setup)
-  if mercurial.needs_hg_commit(verbose=False):
-    print('** Mercurial needs commit')
-  elif mercurial.needs_hg_push(verbose=False):
-    print('** Mercurial needs push')
-  get_and_verify_versions(setup)
-  if hasattr(setup, 'LANGS'):
-    i18n.count_untranslated(_get_locale_dir(setup), setup.LANGS)
+  if check_rst(setup):
+    print('** reStructuredText errors')
+  if check_spelling(setup, spell_report):
+    print('** Spelling errors, fix them with --fix-spelling')
+  vcs = _get_vcs()
+  with profiling.stage('check_vcs', 'check'):
+    if stat_snapshot.needs_commit(vcs):
+      print('** %s needs commit' % vcs.NAME)
+    elif vcs.needs_push(verbose=False):
+      print('** %s needs push' % vcs.NAME)
+  get_and_verify_versions(setup, state)
+  if setup.LANGS:
+    # Needs polib, only projects with translations do.
+    from . import i18n
+    with profiling.stage('check_translations', 'check'):
+      i18n.count_untranslated(_get_locale_dir(setup), setup.LANGS)
 
 def get_pass_from(fname):
   """Retrieves the password from this file.
@@ -443,7 +504,10 @@ def get_pass_from(fname):
   return None
 
 
+@profiling.stage('upload_google_code', 'upload')
 def upload_to_google_code(setup):
+  import getpass
+  from . import googlecode_update
   print('Using user %r' % setup.GOOGLE_CODE_EMAIL)
   password = get_pass_from('~/.ssh/%s' % setup.GOOGLE_CODE_EMAIL)
   if not password:
@@ -474,11 +538,37 @@ def upload_to_google_code(setup):
         setup.NAME, 'dist', fname, summary, labels, username, password)
 
 
-def announce_on_freshmeat(setup):
-  """Announce launch on freshmeat."""
-  print('Announcing on Freshmeat...')
+def _queue_announcement(setup, channel, handler, payload):
+  """Put the announcement in the outbox, delivered in the background."""
+  from . import outbox
+  record = outbox.spool(setup.NAME, setup.VER, channel, handler, payload)
+  if record['state'] == outbox.SENT:
+    print('Already announced %s %s on %s' % (setup.NAME, setup.VER, channel))
+    return
+  print('Queued the %s announcement, see --outbox' % channel)
+  outbox.start_worker()
 
-  _, _, rel_lines = _parse_last_release(setup)
+def _release_notes(setup, state=None):
+  from . import announce
+  return announce.ReleaseNotes(*_parse_last_release(setup, state))
+
+def _freshmeat_payload(setup, notes):
+  name = setup.FRESHMEAT or setup.NAME
+  tag = 'Bug fixes'
+  if setup.VER.endswith('.0'):
+    tag = 'Feature enhancements'
+  changelog = ['Changes: '] + notes.lines
+  # FRESHMEAT_HOST can point to a local stand-in, ex. 'localhost:8080'.
+  host = setup.FRESHMEAT_HOST or 'freshmeat.net'
+  return dict(name=name, version=setup.VER, changelog='\n'.join(changelog), tag=tag,
+              host=host)
+
+def post_to_freshmeat(payload):
+  """Post the release to freshmeat, payload from _freshmeat_payload()."""
+  import http.client
+  import netrc
+  import simplejson
+  print('Announcing on Freshmeat...')
   rcinfo = netrc.netrc(os.path.expanduser('~/.netrc'))
   # Storing the auth_code as the account in the .netrc file
   # ex. chmod 600 ~/.netrc
@@ -487,19 +577,16 @@ def announce_on_freshmeat(setup):
   #     account auth_code_given_by_freshmeat
   #     password mypassword
   auth_code = rcinfo.authenticators('freshmeat')[1]
-  name = setup.NAME
-  if hasattr(setup, 'FRESHMEAT'):
-    name = setup.FRESHMEAT
-  tag = 'Bug fixes'
-  if setup.VER.endswith('.0'):
-    tag = 'Feature enhancements'
-  changelog = ['Changes: '] + rel_lines
-  release_dict = dict(version=setup.VER, changelog='\n'.join(changelog), tag_list=tag)
+  name = payload['name']
+  release_dict = dict(version=payload['version'], changelog=payload['changelog'],
+                      tag_list=payload['tag'])
   path = '/projects/%s/releases.json' % name
   body = codecs.encode(simplejson.dumps(dict(auth_code=auth_code, release=release_dict)))
-  connection = http.client.HTTPConnection('freshmeat.net')
-  connection.request('POST', path, body, {'Content-Type': 'application/json'})
-  response = connection.getresponse()
+  connection = http.client.HTTPConnection(payload.get('host', 'freshmeat.net'),
+                                          timeout=payload.get('timeout', 60))
+  with metrics.request('freshmeat'):
+    connection.request('POST', path, body, {'Content-Type': 'application/json'})
+    response = connection.getresponse()
   if response.status == 404:
     print('Project %r not found, may have to add FRESHMEAT to setup.py' % name)
     raise PyBdistException('Freshmeat project not found, please register.')
@@ -508,90 +595,219 @@ def announce_on_freshmeat(setup):
     raise PyBdistException('Freshmeat upload failed')
   print('Done announcing on Freshmeat.')
 
+@profiling.stage('announce_freshmeat', 'announce')
+def announce_on_freshmeat(setup, state=None):
+  """Announce launch on freshmeat."""
+  _queue_announcement(setup, 'freshmeat', '%s:post_to_freshmeat' % __name__,
+                      _freshmeat_payload(setup, _release_notes(setup, state)))
 
-def announce_on_twitter(setup):
+
+def _twitter_payload(setup, unused_notes):
+  metadata = dict(version=setup.VER, name=setup.NAME, url=setup.SETUP['url'])
+  return dict(text='Release %(version)s of %(name)s is available from %(url)s' % metadata)
+
+def post_to_twitter(payload):
+  """Post the status, payload from _twitter_payload()."""
+  import netrc
+  import twitter
   print('Announcing on twitter...')
   rcinfo = netrc.netrc(os.path.expanduser('~/.netrc'))
   auth = rcinfo.authenticators('twitter')
   username = auth[0]
   password = auth[2]
-  metadata = dict(version=setup.VER, name=setup.NAME, url=setup.SETUP['url'])
   api = twitter.Api(username=username, password=password)
-  api.PostUpdate('Release %(version)s of %(name)s is available from %(url)s' % metadata)
+  with metrics.request('twitter'):
+    api.PostUpdate(payload['text'])
   print('Done announcing on twitter.')
 
+@profiling.stage('announce_twitter', 'announce')
+def announce_on_twitter(setup):
+  _queue_announcement(setup, 'twitter', '%s:post_to_twitter' % __name__,
+                      _twitter_payload(setup, None))
+
+@profiling.stage('announce_mail', 'announce')
+def announce_on_mailing_lists(setup):
+  from . import mailinglist
+  _queue_announcement(setup, 'mail', '%s:deliver' % mailinglist.__name__,
+                      mailinglist.payload(setup))
+
+def _register_channels():
+  from . import announce
+  from . import mailinglist
+  announce.register('mail', mailinglist.payload, '%s:deliver' % mailinglist.__name__,
+                    wanted=lambda setup: bool(setup.MAILING_LIST))
+  announce.register('freshmeat', _freshmeat_payload, '%s:post_to_freshmeat' % __name__)
+  announce.register('twitter', _twitter_payload, '%s:post_to_twitter' % __name__)
+
+@profiling.stage('announce', 'announce')
+def announce_everywhere(setup, state=None):
+  """Announce on every configured channel at once and print how it went."""
+  from . import announce
+  _register_channels()
+  outcomes = announce.announce(setup, _release_notes(setup, state))
+  announce.print_summary(outcomes)
+  return outcomes
+
 def _get_pot_filename(setup):
   return os.path.join(_get_locale_dir(setup), '%s.pot' % setup.NAME)
 
 def _get_locale_dir(setup):
   return '%s/locale' % setup.DIR
 
+@profiling.stage('build_pot', 'gettext')
 def build_get_text(setup):
-  # TODO(scottkirkwood): sub-directories
-  dirs = [ 'setup.py', os.path.join(setup.DIR, '*.py')]
+  from . import i18n
+  dirs = ['setup.py', setup.DIR]
   i18n.build_get_text(_get_pot_filename(setup), dirs)
 
+def _get_tm_dirs(setup):
+  return setup.TM_LOCALE_DIRS or [_get_locale_dir(setup)]
+
+@profiling.stage('update_po', 'gettext')
 def update_po_files(setup):
+  from . import i18n
   missing = i18n.update_po_files(_get_pot_filename(setup), _get_locale_dir(setup), setup.LANGS)
   for lang, fname in missing:
     print('Creating %r' % fname)
     i18n.make_empty_po_file(fname, lang, setup)
+  if missing:
+    # Now that they exist, give the new ones the messages to translate.
+    i18n.update_po_files(_get_pot_filename(setup), _get_locale_dir(setup),
+                         [lang for lang, _ in missing])
+  i18n.prefill_po_files(_get_locale_dir(setup), setup.LANGS, _get_tm_dirs(setup))
 
+@profiling.stage('compile_mo', 'gettext')
 def compile_po_files(setup):
+  from . import i18n
   i18n.compile_po_files(_get_locale_dir(setup), setup.LANGS)
 
 def handle_standard_options(options, setup):
   """Handle options added by add_standard_options().
   Args:
     options: OptParser set of options.
-    setup: the setup file module.
+    setup: the setup file module, its ProjectConfig or the name of the
+      setup.py file (read with project_config.load(), cached).
   Returns:
     True if handled, false otherwise."""
-  fixup_setup(setup)
+  setup = project_config.get(setup)
+  command = _command_name(options)
+  if options.profile:
+    profiling.start(python=options.profile_python, memory=options.profile_memory)
+  try:
+    with profiling.stage('pybdist', 'run', command=command):
+      handled = _dispatch(options, setup)
+  finally:
+    if command:
+      metrics.record_spans(profiling.spans())
+      metrics.write_quietly(setup.NAME, command, options.metrics_dir)
+    # Also when the command failed, that's when the profile is wanted.
+    if options.profile:
+      print()
+      profiling.print_summary()
+      print('Wrote %s' % ', '.join(profiling.finish(options.profile)))
+  return handled
+
+# The options _dispatch() handles, in the same order.
+_COMMANDS = [
+    'doclean', 'check', 'check_remote', 'test', 'git', 'dist', 'upload',
+    'pypi', 'mail', 'freshmeat', 'twitter', 'announce', 'missing_docs',
+    'gettext', 'fix_spelling', 'versions', 'bump_version', 'outbox',
+    'backups', 'restore_backup', 'prune_backups',
+]
+
+def _command_name(options):
+  """Returns the command selected in options (ex. 'dist') or None."""
+  for dest in _COMMANDS:
+    if getattr(options, dest, None):
+      return dest
+  return None
+
+def _dispatch(options, setup):
+  """Run the command selected in options, returns False if there's none."""
+  # Shared by every stage so each project file is parsed once.
+  state = project_state.ProjectState(setup)
   if options.doclean:
     clean_all(setup)
   elif options.check:
-    check_for_errors(setup)
+    check_for_errors(setup, state, options.spell_report)
     print()
-    print_release_info(setup)
+    print_release_info(setup, state)
   elif options.check_remote:
     verify_remote_versions(setup)
   elif options.test:
     test_code(setup)
   elif options.git:
+    from . import debian
     debian.git_import_orig(setup)
   elif options.dist:
     build_man(setup)
     build_zip_tar(setup)
     build_deb(setup)
-    print_release_info(setup)
+    print_release_info(setup, state)
   elif options.upload:
-    print_release_info(setup)
+    print_release_info(setup, state)
     upload_to_google_code(setup)
   elif options.pypi:
-    print_release_info(setup)
+    print_release_info(setup, state)
     upload_to_pypi(setup)
   elif options.mail:
-    mailinglist.mail(setup)
+    announce_on_mailing_lists(setup)
   elif options.freshmeat:
-    print_release_info(setup)
-    announce_on_freshmeat(setup)
+    print_release_info(setup, state)
+    announce_on_freshmeat(setup, state)
   elif options.twitter:
-    print_release_info(setup)
+    print_release_info(setup, state)
     announce_on_twitter(setup)
+  elif options.announce:
+    print_release_info(setup, state)
+    announce_everywhere(setup, state)
   elif options.missing_docs:
-    documents.out_license(setup)
-    documents.out_readme(setup)
-    documents.out_install(setup)
+    from . import documents
+    with profiling.stage('missing_docs', 'docs'):
+      documents.out_license(setup)
+      documents.out_readme(setup)
+      documents.out_install(setup)
   elif options.gettext:
     build_get_text(setup)
     update_po_files(setup)
     compile_po_files(setup)
+  elif options.fix_spelling:
+    check_spelling(setup, fix=True)
+  elif options.versions:
+    from . import version_scan
+    version_scan.report(version_scan.scan('.'), setup.VER)
+  elif options.bump_version:
+    from . import version_scan
+    edits = version_scan.planned_edits(version_scan.scan('.'), options.bump_version)
+    if not edits:
+      print('Nothing to change')
+    else:
+      version_scan.print_plan(edits, options.bump_version)
+      yn = input('Change these %d version strings?: ' % len(edits))
+      if yn.lower() == 'y':
+        version_scan.rewrite(edits, options.bump_version)
+        version_scan.report(version_scan.scan('.'), options.bump_version)
+  elif options.outbox:
+    from . import outbox
+    outbox.print_records()
+    if any(record['state'] == outbox.PENDING for _, record in outbox.list_records()):
+      outbox.start_worker()
+  elif options.backups:
+    from . import backup
+    backup.print_entries(setup.NAME)
+  elif options.restore_backup:
+    from . import backup
+    backup.restore(options.restore_backup)
+  elif options.prune_backups:
+    from . import backup
+    backup.prune()
   else:
     return False
   return True
 
 def add_standard_options(parser, setup=None):
+  if setup:
+    setup = project_config.get(setup)
   parser.add_option('--clean', dest='doclean', action='store_true',
                     help='Uninstall things')
   parser.add_option('--missing-docs', dest='missing_docs', action='store_true',
@@ -610,13 +826,59 @@ def add_standard_options(parser, setup=None):
                     help='Only upload to google code.')
   parser.add_option('--pypi', dest='pypi', action='store_true',
                     help='Only upload to pypi')
-  if setup and hasattr(setup, 'MAILING_LIST'):
+  if setup and setup.MAILING_LIST:
     parser.add_option('--mail', dest='mail', action='store_true',
                       help='Announce to mailing list.')
   parser.add_option('--freshmeat', dest='freshmeat', action='store_true',
                     help='Announce on freshmeat')
   parser.add_option('--twitter', dest='twitter', action='store_true',
                     help='Announce on Twitter')
-  if not parser.has_option('--gettext') and setup and hasattr(setup, 'LANGS'):
+  parser.add_option('--announce', dest='announce', action='store_true',
+                    help='Announce on every channel at once.')
+  if not parser.has_option('--gettext') and setup and setup.LANGS:
     parser.add_option('--gettext', dest='gettext', action='store_true',
                       help='Build gettext files.')
+  parser.add_option('--spell-report', dest='spell_report', metavar='FILE',
+                    help='With --check, write the misspellings as JSON to FILE.')
+  parser.add_option('--fix-spelling', dest='fix_spelling', action='store_true',
+                    help='Open aspell on the files with misspellings.')
+  parser.add_option('--versions', dest='versions', action='store_true',
+                    help='Report every version string in the project.')
+  parser.add_option('--bump-version', dest='bump_version', metavar='VER',
+                    help='Change every version string in the project to VER.')
+  parser.add_option('--outbox', dest='outbox', action='store_true',
+                    help='List the announcements and how their delivery went.')
+  parser.add_option('--profile', dest='profile', metavar='FILE',
+                    help='Write how long each stage and tool took to FILE '
+                    '(a Chrome trace).')
+  parser.add_option('--profile-python', dest='profile_python', action='store_true',
+                    help='With --profile, also write a cProfile of the python code.')
+  parser.add_option('--profile-memory', dest='profile_memory', action='store_true',
+                    help='With --profile, also write the largest memory allocations.')
+  parser.add_option('--metrics-dir', dest='metrics_dir', metavar='DIR',
+                    help='Write the metrics of the run to DIR '
+                    '(default ~/.cache/pybdist/metrics).')
+  parser.add_option('--backups', dest='backups', action='store_true',
+                    help='List backups of overwritten files.')
+  parser.add_option('--restore-backup', dest='restore_backup', metavar='HASH',
+                    help='Restore the backup with this hash.')
+  parser.add_option('--prune-backups', dest='prune_backups', action='store_true',
+                    help='Drop old backups and any stored file no longer used.')
+
+
+def main(argv=None, setup_fname='setup.py'):
+  """Run the pybdist command line on the project in the current directory:
+    python3 -m pybdist.pybdist --check
+  setup.py is only evaluated when it changed, see project_config.load().
+  """
+  import optparse
+  setup = project_config.load(setup_fname)
+  parser = optparse.OptionParser()
+  add_standard_options(parser, setup)
+  options, _ = parser.parse_args(argv)
+  if not handle_standard_options(options, setup):
+    parser.print_help()
+
+
+if __name__ == '__main__':
+  main()
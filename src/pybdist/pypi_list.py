@@ -19,6 +19,8 @@ __author__ = 'scott@forusers.com (Scott Kirkwood)'
 import re
 import urllib.request, urllib.error, urllib.parse
 
+from . import metrics
+
 def get_latest_version(project_name):
   """Get the version, download fname, and md5 hash.
 
@@ -32,9 +34,10 @@ def get_latest_version(project_name):
 
   url = 'http://pypi.python.org/pypi/%s/' % project_name
   try:
-    fin = urllib.request.urlopen(url)
-    text = fin.read()
-    fin.close()
+    with metrics.request('pypi'):
+      fin = urllib.request.urlopen(url)
+      text = fin.read()
+      fin.close()
   except urllib.error.URLError:
     text = ''
   # The following url should always exist.
@@ -19,11 +19,24 @@ Code assumes that the release has a date and a version.
 And sections are separated by ======== or --------
 """
 
-from . import googlecode_update
+from . import util
+import collections
+import hashlib
+import json
+import mmap
+import os
 import re
 import sys
+import tempfile
 import time
 
+DEFAULT_RELEASE_FORMAT = r'(?P<date>.*) v (?P<ver>\d+.\d+(?:.\d+)?)$'
+RE_DEB_VERSION = r'^[\w-]+ \(([^)]+)\) '
+RE_DEB_DATE = r'^ -- [\w ]+ \<[^>]+\>  (.*)'
+
+# One release in a history file, start and end are byte offsets.
+Entry = collections.namedtuple('Entry', 'version date start end')
+
 class ReleaseException(Exception):
   pass
 
@@ -37,7 +50,7 @@ def parse_last_release(fname, pattern=None):
   """
   # Example "Apr. 18th, 2009 v 0.16"
   if not pattern:
-    pattern = r'(?P<date>.*) v (?P<ver>\d+.\d+(?:.\d+)?)$'
+    pattern = DEFAULT_RELEASE_FORMAT
 
   re_version = re.compile(pattern)
   re_horz = re.compile(r'^[-=]+$')
@@ -64,13 +77,13 @@ def parse_last_release(fname, pattern=None):
   return version, date, lines
 
 def parse_deb_changelog(fname):
-  re_ver = re.compile(r'^[\w-]+ \(([^)]+)\) ')
-  re_date_exp = r'^ -- [\w ]+ \<[^>]+\>  (.*)'
+  re_ver = re.compile(RE_DEB_VERSION)
+  re_date_exp = RE_DEB_DATE
   re_date = re.compile(re_date_exp)
   version = None
   date = None
   lines = []
-  for line in file(fname):
+  for line in open(fname):
     line = line.rstrip()
     grps = re_ver.search(line)
     if grps:
@@ -86,26 +99,249 @@ def parse_deb_changelog(fname):
       break
     if version and line:
       lines.append(line)
+  return _strip_deb_revision(version), date, lines
+
+def _strip_deb_revision(version):
+  """Returns the upstream part of a debian version, 0.3-1 -> 0.3."""
   if version:
     index = version.rfind('-')
     if index != -1:
       version = version[:index]
-  return version, date, lines
+  return version
+
+class ReleaseHistory(object):
+  """Index of every entry in RELEASE.rst or debian/changelog.
+
+  Entries are kept newest first, as they are in the file, and each one
+  records its byte offsets so a single entry can be read without parsing
+  the rest of the file.  Use release_history() or deb_changelog_history()
+  to get one.
+  """
+
+  def __init__(self, fname, kind, entries):
+    self.fname = fname
+    self.kind = kind
+    self.entries = entries
+    self.by_version = {}
+    for num, entry in enumerate(entries):
+      self.by_version.setdefault(entry.version, num)
+
+  def __len__(self):
+    return len(self.entries)
+
+  def __iter__(self):
+    return iter(self.entries)
+
+  def versions(self):
+    return [entry.version for entry in self.entries]
+
+  def _index(self, version):
+    if version not in self.by_version:
+      raise ReleaseException('Version %r not found in %r' % (version, self.fname))
+    return self.by_version[version]
+
+  def get(self, version):
+    """Returns the Entry for `version`."""
+    return self.entries[self._index(version)]
+
+  def since(self, version):
+    """Returns the entries newer than `version`, newest first."""
+    return self.entries[:self._index(version)]
+
+  def between(self, newest, oldest):
+    """Returns the entries from `newest` down to `oldest` inclusive."""
+    first = self._index(newest)
+    last = self._index(oldest)
+    if first > last:
+      first, last = last, first
+    return self.entries[first:last + 1]
+
+  def read_text(self, entry):
+    """Returns the raw text of the entry."""
+    with open(self.fname, 'rb') as fin:
+      fin.seek(entry.start)
+      return fin.read(entry.end - entry.start).decode('utf-8')
+
+  def read(self, entry):
+    """Returns (version, date, lines) like parse_last_release()."""
+    text_lines = self.read_text(entry).split('\n')[1:]
+    if self.kind == 'changelog':
+      re_date = re.compile(RE_DEB_DATE)
+      lines = []
+      for line in text_lines:
+        line = line.rstrip()
+        if re_date.search(line):
+          break
+        if line:
+          lines.append(line)
+      return entry.version, entry.date, lines
+    re_horz = re.compile(r'^[-=]+$')
+    lines = [line.rstrip() for line in text_lines
+             if not re_horz.match(line.rstrip())]
+    while lines and not lines[-1]:
+      del lines[-1]
+    return entry.version, entry.date, lines
+
+
+def _crlf_matches(data, pattern):
+  """Yields (offset, match) for each line matching pattern, without the \r."""
+  re_version = re.compile(pattern.encode('utf-8'))
+  pos = 0
+  while pos < len(data):
+    end = data.find(b'\n', pos)
+    if end < 0:
+      end = len(data)
+    grps = re_version.match(data[pos:end].rstrip(b'\r'))
+    if grps:
+      yield pos, grps
+    pos = end + 1
+
+
+def _index_release_file(data, pattern):
+  if data.find(b'\r') >= 0:
+    # The pattern's $ won't match before a \r, go line by line.
+    matches = _crlf_matches(data, pattern)
+  else:
+    re_version = re.compile(('(?m)^(?:%s)' % pattern).encode('utf-8'))
+    matches = ((grps.start(), grps) for grps in re_version.finditer(data))
+  entries = []
+  for start, grps in matches:
+    if entries:
+      entries[-1][3] = start
+    entries.append([grps.group('ver').decode('utf-8'),
+                    grps.group('date').decode('utf-8'), start, len(data)])
+  return entries
+
 
-def out_debian_changelog(settings, lines):
+def _index_deb_changelog(data):
+  re_ver = re.compile(('(?m)%s' % RE_DEB_VERSION).encode('utf-8'))
+  re_date = re.compile(('(?m)%s' % RE_DEB_DATE).encode('utf-8'))
+  entries = []
+  for grps in re_ver.finditer(data):
+    if entries:
+      entries[-1][3] = grps.start()
+    entries.append([_strip_deb_revision(grps.group(1).decode('utf-8')), None,
+                    grps.start(), len(data)])
+  for entry in entries:
+    grps = re_date.search(data, entry[2], entry[3])
+    if grps:
+      entry[1] = grps.group(1).decode('utf-8').rstrip()
+  return entries
+
+
+def _build_history(fname, kind, pattern):
+  """Builds the index entries with one pass over the mmapped file."""
+  with open(fname, 'rb') as fin:
+    if not os.fstat(fin.fileno()).st_size:
+      return []
+    data = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+      if kind == 'changelog':
+        return _index_deb_changelog(data)
+      return _index_release_file(data, pattern)
+    finally:
+      data.close()
+
+
+def _load_history(fname, kind, pattern=None):
+  """Returns the ReleaseHistory, using the on disk cache if still valid."""
+  stat = os.stat(fname)
+  stat_key = [stat.st_mtime_ns, stat.st_size, stat.st_ino, pattern]
+  key = hashlib.sha1(('%s:%s' % (kind, os.path.abspath(fname))).encode('utf-8'))
+  cache_name = os.path.join(util.get_cache_dir('release_index'),
+                            key.hexdigest() + '.json')
+  entries = None
+  if os.path.exists(cache_name):
+    with open(cache_name) as fin:
+      try:
+        cached = json.load(fin)
+      except ValueError:
+        cached = {}
+    if cached.get('stat') == stat_key:
+      entries = cached['entries']
+  if entries is None:
+    entries = _build_history(fname, kind, pattern)
+    t_out, fname_tmp = tempfile.mkstemp('.tmp', 'index',
+                                        dir=os.path.dirname(cache_name))
+    with os.fdopen(t_out, 'w') as fout:
+      json.dump(dict(stat=stat_key, entries=entries), fout)
+    os.rename(fname_tmp, cache_name)
+  return ReleaseHistory(fname, kind, [Entry(*entry) for entry in entries])
+
+
+def release_history(fname, pattern=None):
+  """Returns a ReleaseHistory of every release in an RST release file.
+  Args:
+    fname: filename
+    pattern: Regular expression or null, expects the <date> and <ver> groups.
+  """
+  if not pattern:
+    pattern = DEFAULT_RELEASE_FORMAT
+  return _load_history(fname, 'release', pattern)
+
+
+def deb_changelog_history(fname):
+  """Returns a ReleaseHistory of every entry in a debian/changelog."""
+  return _load_history(fname, 'changelog')
+
+def out_debian_changelog(settings, lines, version=None, datestr=None):
+  """Returns the lines of a debian/changelog entry.
+  Args:
+    settings: setup information.
+    lines: release note lines.
+    version: upstream version, defaults to settings.VER.
+    datestr: RFC 2822 date, defaults to now.
+  """
+  if not version:
+    version = settings.VER
   ret = []
-  ret.append('%s (%s-1) unstable; urgency=low' % (settings.NAME, settings.VER))
+  ret.append('%s (%s-1) unstable; urgency=low' % (settings.NAME, version))
   ret.append('')
   ret += ['  %s' % l for l in lines]
   ret.append('')
-  datestr = time.strftime('%a, %d %b %Y %H:%M:%S', time.localtime())
-  datestr += ' %+05d' % (time.timezone/36)
+  if not datestr:
+    datestr = time.strftime('%a, %d %b %Y %H:%M:%S', time.localtime())
+    datestr += ' %+05d' % (time.timezone/36)
   ret.append(' -- %s <%s>  %s' % (settings.AUTHOR_NAME, settings.GOOGLE_CODE_EMAIL, datestr))
   ret.append('')
   ret.append('')
   return ret
 
+def release_date_to_deb(date):
+  """Convert 'August 10th, 2010' to 'Tue, 10 Aug 2010 12:00:00 +0000'.
+  Returns None if the date can't be understood.
+  """
+  date = re.sub(r'(\d+)(?:st|nd|rd|th)', r'\1', date).replace('.', '').strip()
+  for fmt in ['%B %d, %Y', '%b %d, %Y', '%B %d %Y', '%b %d %Y']:
+    try:
+      parsed = time.strptime(date, fmt)
+    except ValueError:
+      continue
+    return time.strftime('%a, %d %b %Y 12:00:00 +0000', parsed)
+  return None
+
+def deb_date_to_release(date):
+  """Convert 'Fri, 16 Jul 2010 10:05:28 +0300' to 'July 16th, 2010'.
+  Returns None if the date can't be understood.
+  """
+  try:
+    parsed = time.strptime(' '.join(date.split()[:5]), '%a, %d %b %Y %H:%M:%S')
+  except ValueError:
+    return None
+  day = parsed.tm_mday
+  if 10 <= day % 100 <= 20:
+    suffix = 'th'
+  else:
+    suffix = {1: 'st', 2: 'nd', 3: 'rd'}.get(day % 10, 'th')
+  return '%s %d%s, %d' % (time.strftime('%B', parsed), day, suffix, parsed.tm_year)
+
+def out_release(version, date, lines):
+  """Returns the lines of a RELEASE.rst entry in the default format."""
+  title = '%s v %s' % (date, version)
+  return [title, '-' * len(title)] + lines + ['']
+
 def _get_last_versions(project_name):
+  from . import googlecode_update
   versions = []
   re_version = re.compile(r'%s-(.*).tar.gz' % project_name)
   for info in googlecode_update.get_download_list(project_name):
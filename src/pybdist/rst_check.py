@@ -14,45 +14,226 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+"""Check reStructuredText for errors.
+
+Documents are parsed in-process with docutils, any message rst2html
+--strict would stop on (info and up) is reported with its file, line and
+severity.  Several documents are parsed in a process pool and the messages
+are cached by the hash of the text, so unchanged documents aren't parsed
+again.
+
+check_project() also compares the documents with each other, README.rst,
+README.pt_BR.rst, INSTALL.rst, ... must all have a title that names the
+project, translations must exist for every language and have translated
+titles.
+"""
 
 __author__ = 'Scott Kirkwood (scott+pybdist@forusers.com)'
 
+import collections
+import concurrent.futures
+import io
 import os
-import subprocess
-import tempfile
+import re
+
+try:
+  import docutils
+  import docutils.core
+  from docutils import nodes
+except ImportError:
+  raise ImportError('You need to install docutils, try sudo "apt-get install python-docutils"')
+
+from . import cache
+from . import util
+
+# Change when the cached format changes.
+RST_VERSION = '2'
+
+SEVERITIES = ['DEBUG', 'INFO', 'WARNING', 'ERROR', 'SEVERE']
+
+# Like rst2html --strict, report info messages and up.
+MIN_LEVEL = 1
+
+# Documents that have one translation per language.
+TRANSLATED_KINDS = ['README', 'INSTALL']
+
+RE_DOC_NAME = re.compile(r'^(?P<kind>[^.]+)(?:\.(?P<lang>[a-z]{2}(?:_[A-Z]{2})?))?\.rst$')
+
+RstError = collections.namedtuple('RstError', 'fname line level message')
 
 class RstCheckException(Exception):
   pass
 
-def _run_or_die(args, err_mess=None, output=True):
-  """Run the `args` (a list) or die.
+
+def _parse(text, fname):
+  """Returns {'messages': list of [line, level, message], 'title': title or None}."""
+  settings = {
+      'report_level': MIN_LEVEL,
+      'halt_level': 5,  # never
+      'warning_stream': io.StringIO(),
+  }
+  doctree = docutils.core.publish_doctree(
+      text, source_path=fname, settings_overrides=settings)
+  # Messages from the transforms (ex. unknown targets) aren't in the tree.
+  found = list(doctree.findall(nodes.system_message))
+  found += [node for node in doctree.transform_messages
+            if node.parent is None and node['level'] >= MIN_LEVEL]
+  ret = []
+  for node in found:
+    if node.children:
+      message = node.children[0].astext()
+    else:
+      message = node.astext()
+    ret.append([node.get('line'), node['level'], message])
+  return {'messages': ret, 'title': doctree.get('title')}
+
+
+def _parse_job(job):
+  return _parse(*job)
+
+
+def parse_texts(docs, workers=None):
+  """Parse every (name, text), using the cache when possible.
   Args:
-    args: list of arguments to pass to call
-    err_mess: Extra hint what went wrong.
-    output: output the command before running
+    docs: list of (name, rst text), name is used in the errors.
+    workers: number of processes, None for one per cpu.
+  Returns:
+    {name: {'messages': [[line, level, message], ...], 'title': title}}
   """
-  if output:
-    print(' '.join(args))
-  try:
-    ret = subprocess.call(args)
-  except OSError as oserr:
-    mess = 'Error running: %r: %r' % (' '.join(args), oserr)
-    if err_mess:
-      mess += '\n' + err_mess
-    raise RstCheckException(err_mess)
-  if ret:
-    raise RstCheckException('Error running: code %r\n%r' % (ret, ' '.join(args)))
+  rst_cache = cache.HashCache('rst')
+  salt = RST_VERSION + docutils.__version__
+  found = {}
+  todo = []
+  for name, text in docs:
+    key = cache.text_hash(text, salt)
+    parsed = rst_cache.get(key)
+    if parsed is None:
+      todo.append((name, text, key))
+    else:
+      found[name] = parsed
+  jobs = [(text, name) for name, text, _ in todo]
+  if len(jobs) > 1:
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+      results = list(executor.map(_parse_job, jobs))
+  else:
+    results = [_parse_job(job) for job in jobs]
+  for (name, _, key), parsed in zip(todo, results):
+    rst_cache.put(key, parsed)
+    found[name] = parsed
+  return found
+
+
+def _errors(name, parsed):
+  return [RstError(name, line, level, message)
+          for line, level, message in parsed['messages']]
+
+
+def check_texts(docs, workers=None):
+  """Check every (name, text), using the cache when possible.
+  Returns:
+    {name: list of RstError}
+  """
+  parsed = parse_texts(docs, workers)
+  return dict((name, _errors(name, parsed[name])) for name, _ in docs)
+
+
+def check_files(fnames, workers=None):
+  """Check every file.
+  Returns:
+    {fname: list of RstError}
+  """
+  docs = []
+  for fname in fnames:
+    with open(fname, encoding='utf-8') as fin:
+      docs.append((fname, fin.read()))
+  return check_texts(docs, workers)
 
 
 def check_file(fname):
-  args = ['rst2html', '--strict', fname, '/dev/null']
-  _run_or_die(args, 'You may need to run "sudo apt-get install python-docutils')
+  """Returns the list of RstError found in fname."""
+  return check_files([fname])[fname]
+
+
+def check_text(rst_text, name='<string>'):
+  """Returns the list of RstError found in rst_text."""
+  return check_texts([(name, rst_text)])[name]
+
+
+def find_documents(root='.'):
+  """Returns every .rst file under root."""
+  ret = []
+  for dirpath, dirnames, fnames in os.walk(root):
+    dirnames[:] = sorted(d for d in dirnames if not util.skip_dir(d))
+    ret += [os.path.normpath(os.path.join(dirpath, fname))
+            for fname in sorted(fnames) if fname.endswith('.rst')]
+  return ret
+
+
+def cross_check(titles, langs, project_name):
+  """Compare the documents with each other.
+  Args:
+    titles: {fname: document title or None}
+    langs: the languages there should be translations for, ex. ['pt_BR']
+    project_name: ex. 'pybdist'
+  Returns:
+    list of RstError
+  """
+  ret = []
+  kinds = {}
+  for fname in sorted(titles):
+    grps = RE_DOC_NAME.match(os.path.basename(fname))
+    if not grps:
+      continue
+    key = (os.path.dirname(fname), grps.group('kind'))
+    kinds.setdefault(key, {})[grps.group('lang')] = fname
+    if not titles[fname]:
+      ret.append(RstError(fname, None, 2, 'No document title.'))
+  for (dirname, kind), by_lang in sorted(kinds.items()):
+    if kind not in TRANSLATED_KINDS:
+      continue
+    for fname in by_lang.values():
+      title = titles[fname]
+      if title and project_name.lower() not in title.lower():
+        ret.append(RstError(fname, None, 2, 'Title %r does not name the project %r.' % (
+            title, project_name)))
+    base = by_lang.get(None)
+    if not base:
+      continue
+    for lang in langs:
+      fname = by_lang.get(lang)
+      if not fname:
+        ret.append(RstError(base, None, 2, 'No %s translation (%s).' % (
+            lang, os.path.join(dirname, '%s.%s.rst' % (kind, lang)))))
+      elif (titles[fname] and titles[fname] == titles[base]
+            and titles[base].lower() != project_name.lower()):
+        ret.append(RstError(fname, None, 1, 'Title %r is not translated.' % titles[fname]))
+  return ret
+
+
+def check_project(docs, langs, project_name, workers=None):
+  """Check the project's documents, one at a time and with each other.
+  Args:
+    docs: list of (name, rst text), .rst files and other texts (ex. long_description).
+    langs: the languages there should be translations for.
+    project_name: ex. 'pybdist'
+    workers: number of processes, None for one per cpu.
+  Returns:
+    list of RstError
+  """
+  parsed = parse_texts(docs, workers)
+  ret = []
+  for name, _ in docs:
+    ret += _errors(name, parsed[name])
+  titles = dict((name, parsed[name]['title']) for name, _ in docs
+                if name.endswith('.rst'))
+  return ret + cross_check(titles, langs, project_name)
 
 
-def check_text(rst_text):
-  t_out, fname_tmp = tempfile.mkstemp('rst')
-  os.write(t_out, rst_text)
-  os.close(t_out)
-  args = ['rst2html', '--strict', fname_tmp, '/dev/null']
-  _run_or_die(args, 'Note: left a tempfile at %r' % fname_tmp)
-  os.unlink(fname_tmp)
+def format_error(error):
+  """Same format as docutils, ex. 'RELEASE.rst:4: (WARNING/2) Title underline too short.'"""
+  if error.line:
+    where = '%s:%d' % (error.fname, error.line)
+  else:
+    where = error.fname
+  return '%s: (%s/%d) %s' % (where, SEVERITIES[error.level], error.level,
+                             error.message)
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2010 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Spell check files without prompting, for use in scripts and CI.
+
+The personal dictionary (.aspell.en.pws) and a system word list
+(/usr/share/dict/words) are loaded once into a set.  reStructuredText files
+are checked outside of literal blocks, inline literals and links, python
+files only in their comments and strings.  Files are checked in a process
+pool and the misspellings of each file are cached by the hash of its
+contents (and of the word lists), so only changed files are checked again.
+"""
+
+__author__ = 'Scott Kirkwood (scott+pybdist@forusers.com)'
+
+import concurrent.futures
+import io
+import json
+import os
+import re
+import tokenize
+
+from . import cache
+
+SYSTEM_WORD_LISTS = [
+    '/usr/share/dict/words',
+    '/usr/share/dict/american-english',
+    '/usr/share/dict/british-english',
+]
+
+# Change when the tokenizing rules change.
+SPELL_VERSION = '1'
+
+RE_WORD = re.compile(r"[\w']+")
+RE_RST_SKIP = re.compile(
+    r'``.*?``'                  # inline literal
+    r'|:[\w-]+:`[^`]*`'         # role
+    r'|`[^`<]*<[^>]*>`_{1,2}'   # link with a target
+    r'|\w+://\S+'               # bare url
+    r'|\S+@\S+\.\w+')           # email
+
+# Set by _init_worker() in each process of the pool.
+_WORDS = None
+
+class SpellBatchException(Exception):
+  pass
+
+
+def read_word_list(fname):
+  """Returns the words in fname, an aspell personal dictionary or a word list."""
+  words = set()
+  with open(fname, encoding='utf-8', errors='replace') as fin:
+    for line in fin:
+      line = line.strip()
+      if not line or line.startswith('personal_ws-'):
+        continue
+      words.add(line)
+  return words
+
+
+def load_words(fnames):
+  """Returns the set of all the words in fnames."""
+  words = set()
+  for fname in fnames:
+    words |= read_word_list(fname)
+  return frozenset(words)
+
+
+def find_word_lists(personal, system_lists=None):
+  """Returns the word lists to use, the personal one first.
+  Args:
+    personal: ex. '.aspell.en.pws', ignored if missing.
+    system_lists: the lists to look for, the first one found is used.
+  """
+  ret = []
+  if personal and os.path.exists(personal):
+    ret.append(personal)
+  for fname in system_lists or SYSTEM_WORD_LISTS:
+    fname = os.path.expanduser(fname)
+    if os.path.exists(fname):
+      ret.append(fname)
+      return ret
+  raise SpellBatchException('No word list found in %r\n'
+                            'Try sudo "apt-get install wamerican"' % (
+                                system_lists or SYSTEM_WORD_LISTS))
+
+
+def _is_known(word, words):
+  if word in words or word.lower() in words:
+    return True
+  if word.endswith("'s") and _is_known(word[:-2], words):
+    return True
+  return False
+
+
+def _words_in(text):
+  """Yields (col, word) for the words worth checking in text."""
+  for grps in RE_WORD.finditer(text):
+    word = grps.group(0).strip("'")
+    if len(word) < 2 or not word.replace("'", '').isalpha():
+      continue
+    if word.isupper():
+      continue  # acronym
+    if any(char.isupper() for char in word[1:]):
+      continue  # CamelCase identifier
+    yield grps.start() + grps.group(0).find(word), word
+
+
+def rst_chunks(text):
+  """Yields (lineno, col, text) for the prose of a reStructuredText document."""
+  literal_indent = None  # inside a literal block indented more than this
+  pending_indent = None  # the last paragraph ended with '::'
+  for lineno, line in enumerate(text.splitlines(), 1):
+    stripped = line.strip()
+    indent = len(line) - len(line.lstrip())
+    if literal_indent is not None:
+      if not stripped or indent > literal_indent:
+        continue
+      literal_indent = None
+    if pending_indent is not None:
+      if not stripped:
+        continue
+      if indent > pending_indent:
+        literal_indent = pending_indent
+        pending_indent = None
+        continue
+      pending_indent = None
+    if stripped.endswith('::'):
+      pending_indent = indent
+    if stripped.startswith('.. '):
+      continue  # directive, target or comment
+    if stripped and not stripped.strip(stripped[0]) and not stripped[0].isalnum():
+      continue  # section underline
+    line = RE_RST_SKIP.sub(lambda grps: ' ' * len(grps.group(0)), line)
+    yield lineno, 0, line
+
+
+def python_chunks(text):
+  """Yields (lineno, col, text) for the comments and strings of python code."""
+  tokens = tokenize.generate_tokens(io.StringIO(text).readline)
+  try:
+    for tok in tokens:
+      if tok.type == tokenize.COMMENT:
+        if tok.start[0] <= 2 and (tok.string.startswith('#!') or '-*-' in tok.string):
+          continue
+        yield tok.start[0], tok.start[1], tok.string
+      elif tok.type == tokenize.STRING:
+        if not any(char.isspace() for char in tok.string):
+          continue  # keys, identifiers and formats, not prose.
+        lineno, col = tok.start
+        for num, part in enumerate(tok.string.split('\n')):
+          yield lineno + num, col if num == 0 else 0, part
+  except (tokenize.TokenError, SyntaxError):
+    pass
+
+
+def po_chunks(text):
+  """Yields (lineno, col, text) for the translations in a .po file."""
+  in_msgstr = False
+  header = True
+  for lineno, line in enumerate(text.splitlines(), 1):
+    stripped = line.strip()
+    if stripped.startswith('msgid '):
+      header = header and stripped == 'msgid ""'
+      in_msgstr = False
+    elif stripped.startswith('msgstr'):
+      in_msgstr = not header
+    elif not stripped.startswith('"'):
+      in_msgstr = False
+      continue
+    if in_msgstr and '"' in line:
+      col = line.index('"')
+      yield lineno, col, line[col:].replace('\\n', '  ')
+
+
+def file_mode(fname):
+  if fname.endswith('.py'):
+    return 'python'
+  if fname.endswith('.po'):
+    return 'po'
+  return 'rst'
+
+
+def chunks_for(text, mode):
+  """Yields (lineno, col, text) of what should be spell checked."""
+  if mode == 'python':
+    return python_chunks(text)
+  if mode == 'po':
+    return po_chunks(text)
+  return rst_chunks(text)
+
+
+def check_text(text, words, mode='rst'):
+  """Returns the misspellings as a list of [lineno, col, word]."""
+  ret = []
+  for lineno, col, chunk in chunks_for(text, mode):
+    for offset, word in _words_in(chunk):
+      if not _is_known(word, words):
+        ret.append([lineno, col + offset, word])
+  return ret
+
+
+def _init_worker(word_lists):
+  global _WORDS
+  _WORDS = load_words(word_lists)
+
+
+def _check_file(fname):
+  with open(fname, encoding='utf-8', errors='replace') as fin:
+    return check_text(fin.read(), _WORDS, file_mode(fname))
+
+
+def check_files(fnames, word_lists, workers=None):
+  """Spell check every file, using the cache when possible.
+  Args:
+    fnames: files to check, .py files are checked as python.
+    word_lists: from find_word_lists().
+    workers: number of processes, None for one per cpu.
+  Returns:
+    {fname: list of [lineno, col, word]}
+  """
+  spell_cache = cache.HashCache('spell')
+  salt = SPELL_VERSION + ''.join(cache.file_hash(fname) for fname in word_lists)
+  ret = {}
+  todo = {}
+  for fname in fnames:
+    key = cache.file_hash(fname, salt + file_mode(fname))
+    found = spell_cache.get(key)
+    if found is None:
+      todo[fname] = key
+    else:
+      ret[fname] = found
+  if len(todo) > 1:
+    with concurrent.futures.ProcessPoolExecutor(
+        workers, initializer=_init_worker, initargs=(word_lists,)) as executor:
+      results = list(executor.map(_check_file, todo))
+  else:
+    if todo:
+      _init_worker(word_lists)
+    results = [_check_file(fname) for fname in todo]
+  for fname, found in zip(todo, results):
+    spell_cache.put(todo[fname], found)
+    ret[fname] = found
+  return dict((fname, ret[fname]) for fname in fnames)
+
+
+def report(results):
+  """Returns lines like 'RELEASE.rst:12:4: wrod'."""
+  lines = []
+  for fname in results:
+    for lineno, col, word in results[fname]:
+      lines.append('%s:%d:%d: %s' % (fname, lineno, col + 1, word))
+  return lines
+
+
+def write_report(results, fname):
+  """Write the results as JSON to fname."""
+  data = {
+      'misspelled': sum(len(found) for found in results.values()),
+      'files': dict((name, [dict(line=lineno, col=col + 1, word=word)
+                            for lineno, col, word in found])
+                    for name, found in results.items()),
+  }
+  tmp_name = fname + '.tmp'
+  with open(tmp_name, 'w') as fout:
+    json.dump(data, fout, indent=2, sort_keys=True)
+  os.rename(tmp_name, fname)
@@ -24,39 +24,25 @@ Creates or uses a spell check file given.
 __author__ = 'Scott Kirkwood (scott+pybdist@forusers.com)'
 
 import os
-import subprocess
 import tempfile
 
+from . import profiling
+
 class SpellCheckException(Exception):
   pass
 
 def _run_or_die(args, err_mess=None, output=True):
-  """Run the `args` (a list) or die.
-  Args:
-    args: list of arguments to pass to call
-    err_mess: Extra hint what went wrong.
-    output: output the command before running
-  """
-  if output:
-    print(' '.join(args))
-  try:
-    ret = subprocess.call(args)
-  except OSError as oserr:
-    mess = 'Error running: %r: %r' % (' '.join(args), oserr)
-    if err_mess:
-      mess += '\n' + err_mess
-    raise SpellCheckException(err_mess)
-  if ret:
-    raise SpellCheckException('Error running: code %r\n%r' % (ret, ' '.join(args)))
+  """Run the `args` (a list) or die, see profiling.run_or_die()."""
+  return profiling.run_or_die(args, err_mess, output, SpellCheckException)
 
 
-def check_file(fname, dictionary):
+def check_file(fname, dictionary, lang='en'):
   """Check the file given with and update the dictionary given."""
   if os.path.exists(fname):
     home_dir = os.path.dirname(os.path.abspath(dictionary))
   else:
     home_dir = dictionary
-  args = ['aspell', '--lang', 'en']
+  args = ['aspell', '--lang', lang]
   if home_dir:
     args += ['--home-dir', home_dir]
   args += ['-c', fname]
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2010 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Measure how long each pybdist command takes to import what it needs.
+
+pybdist.py imports the modules a command needs in the functions that use
+them.  The modules of each command are found by reading pybdist.py: the
+imports of the functions its branch of _dispatch() calls,
+following the calls within pybdist.py.  Each command is then timed in a
+fresh interpreter, a few times, keeping the median.
+
+  python3 -m pybdist.startup_bench [-n RUNS] [--output FILE]
+
+Every run is appended, as JSON lines, to ~/.cache/pybdist/startup/bench.jsonl
+so it can be compared with the previous ones.
+"""
+
+__author__ = 'Scott Kirkwood (scott+pybdist@forusers.com)'
+
+import ast
+import json
+import optparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from . import util
+
+PACKAGE = __package__ or 'pybdist'
+
+# Run in the fresh interpreter, imports pybdist.py then the arguments.
+_IMPORT_SCRIPT = '''
+import json, sys, time
+start = time.perf_counter()
+missing = []
+for name in ['%s.pybdist'] + sys.argv[1:]:
+  try:
+    __import__(name)
+  except ImportError as err:
+    missing.append(err.name or name)
+print(json.dumps(dict(seconds=time.perf_counter() - start, modules=len(sys.modules),
+                      missing=missing)))
+''' % PACKAGE
+
+def _source_fname():
+  return os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pybdist.py')
+
+
+def _imports_and_calls(node, funcs):
+  """Returns the modules imported and the functions of `funcs` called in node."""
+  imports = set()
+  calls = set()
+  for sub in ast.walk(node):
+    if isinstance(sub, ast.Import):
+      imports.update(alias.name for alias in sub.names)
+    elif isinstance(sub, ast.ImportFrom):
+      if sub.level:
+        imports.update('%s.%s' % (PACKAGE, alias.name) for alias in sub.names)
+      else:
+        imports.add(sub.module)
+    elif (isinstance(sub, ast.Call) and isinstance(sub.func, ast.Name)
+          and sub.func.id in funcs):
+      calls.add(sub.func.id)
+  return imports, calls
+
+
+def _closure(nodes, funcs):
+  """Returns the modules imported by nodes and the functions they call."""
+  modules = set()
+  todo = list(nodes)
+  seen = set()
+  while todo:
+    imports, calls = _imports_and_calls(todo.pop(), funcs)
+    modules |= imports
+    for name in calls - seen:
+      seen.add(name)
+      todo.append(funcs[name])
+  return modules
+
+
+def _options(funcs):
+  """Returns {dest: '--option'} from add_standard_options()."""
+  ret = {}
+  for sub in ast.walk(funcs['add_standard_options']):
+    if not (isinstance(sub, ast.Call) and isinstance(sub.func, ast.Attribute)
+            and sub.func.attr == 'add_option'):
+      continue
+    for keyword in sub.keywords:
+      if keyword.arg == 'dest':
+        ret[keyword.value.value] = sub.args[0].value
+  return ret
+
+
+def command_imports(fname=None):
+  """Returns a list of (option, sorted modules) for each command of pybdist.py."""
+  with open(fname or _source_fname(), encoding='utf-8') as fin:
+    tree = ast.parse(fin.read())
+  funcs = dict((node.name, node) for node in tree.body
+               if isinstance(node, ast.FunctionDef))
+  options = _options(funcs)
+  dispatch = funcs.pop('_dispatch')
+  branch = [node for node in dispatch.body if isinstance(node, ast.If)][0]
+  # Whatever runs around the dispatch is paid by every command.
+  common = _closure([funcs['handle_standard_options']] +
+                    [node for node in dispatch.body if node is not branch], funcs)
+  ret = []
+  while branch is not None:
+    if isinstance(branch.test, ast.Attribute):
+      dest = branch.test.attr
+      modules = common | _closure(branch.body, funcs)
+      ret.append((options.get(dest, dest), sorted(modules)))
+    if len(branch.orelse) == 1 and isinstance(branch.orelse[0], ast.If):
+      branch = branch.orelse[0]
+    else:
+      branch = None
+  return ret
+
+
+def time_imports(modules, runs=5):
+  """Time importing pybdist.py and modules in fresh interpreters.
+  Returns:
+    dict of import_ms, total_ms (with the interpreter start), modules and missing.
+  """
+  src_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+  env = dict(os.environ)
+  env['PYTHONPATH'] = os.pathsep.join(
+      [src_dir] + [path for path in [env.get('PYTHONPATH')] if path])
+  imports = []
+  totals = []
+  for _ in range(runs):
+    start = time.perf_counter()
+    out = subprocess.check_output(
+        [sys.executable, '-c', _IMPORT_SCRIPT] + list(modules), env=env)
+    totals.append(time.perf_counter() - start)
+    result = json.loads(out.decode('utf-8'))
+    imports.append(result['seconds'])
+  return dict(import_ms=round(statistics.median(imports) * 1000, 1),
+              total_ms=round(statistics.median(totals) * 1000, 1),
+              modules=result['modules'], missing=result['missing'])
+
+
+def run(runs=5):
+  """Returns a list of records, one per command."""
+  now = time.time()
+  records = []
+  for option, modules in command_imports():
+    record = dict(command=option, time=now, python=sys.version.split()[0])
+    record.update(time_imports(modules, runs))
+    records.append(record)
+  return records
+
+
+def save(records, fname=None):
+  """Append the records to fname, as JSON lines."""
+  fname = fname or os.path.join(util.get_cache_dir('startup'), 'bench.jsonl')
+  with open(fname, 'a') as fout:
+    for record in records:
+      fout.write(json.dumps(record, sort_keys=True) + '\n')
+  return fname
+
+
+def print_records(records):
+  print('%-18s %9s %9s %8s  %s' % ('command', 'import ms', 'total ms', 'modules', 'missing'))
+  for record in records:
+    print('%-18s %9.1f %9.1f %8d  %s' % (
+        record['command'], record['import_ms'], record['total_ms'],
+        record['modules'], ', '.join(record['missing'])))
+
+
+def main():
+  parser = optparse.OptionParser(usage='%prog [-n RUNS] [--output FILE]')
+  parser.add_option('-n', '--runs', dest='runs', type='int', default=5,
+                    help='Times each command is imported, the median is kept.')
+  parser.add_option('--output', dest='output', metavar='FILE',
+                    help='Append the results to FILE instead of the cache.')
+  options, _ = parser.parse_args()
+  records = run(options.runs)
+  print_records(records)
+  print('Saved in %s' % save(records, options.output))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2010 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Remember what the working copy looked like the last time it was clean.
+
+When the version control system (mercurial.py or git.py) says there's
+nothing to commit the size, mtime and inode of every tracked file, the
+mtime of every directory (it changes when a file is added or removed) and
+the stat of the dirstate/index are saved in ~/.cache/pybdist/snapshot/.
+The next check compares them, one directory per thread, and only asks the
+version control system when something differs.
+"""
+
+__author__ = 'Scott Kirkwood (scott+pybdist@forusers.com)'
+
+import collections
+import concurrent.futures
+import json
+import os
+import time
+
+from . import cache
+from . import metrics
+from . import util
+
+# Change when the snapshot format changes.
+SNAPSHOT_VERSION = '1'
+
+# Files changed this recently could change again within the same mtime tick.
+RACY_NS = 2 * 10**9
+
+def _fname(root):
+  return os.path.join(util.get_cache_dir('snapshot'),
+                      cache.text_hash(os.path.abspath(root)) + '.json')
+
+
+def _stat_key(stat):
+  return [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+
+
+def take(root, vcs_name, tracked, state_file):
+  """Returns the snapshot of root, None if files changed too recently or
+  state_file is missing."""
+  newest = time.time_ns() - RACY_NS
+  files = {}
+  for path in tracked:
+    try:
+      stat = os.lstat(os.path.join(root, path))
+    except OSError:
+      continue
+    if stat.st_mtime_ns > newest:
+      return None
+    files[path] = _stat_key(stat)
+  # The skipped dirs (build, venv, ...) are only watched if they have
+  # tracked files.
+  dirnames = set()
+  for dirpath, subdirs, _ in os.walk(root):
+    subdirs[:] = [d for d in subdirs if not util.skip_dir(d)]
+    dirnames.add(os.path.relpath(dirpath, root))
+  dirnames |= set(os.path.normpath(os.path.dirname(path) or '.') for path in files)
+  dirs = {}
+  for dirname in dirnames:
+    try:
+      mtime = os.lstat(os.path.join(root, dirname)).st_mtime_ns
+    except OSError:
+      return None
+    if mtime > newest:
+      return None
+    dirs[dirname] = mtime
+  try:
+    state = _stat_key(os.lstat(os.path.join(root, state_file)))
+  except OSError:
+    # Ex. a git worktree, its index isn't in .git, can't tell if it changes.
+    return None
+  return {
+      'version': SNAPSHOT_VERSION,
+      'vcs': vcs_name,
+      'files': files,
+      'dirs': dirs,
+      'state': state,
+  }
+
+
+def save(root, snapshot):
+  fname = _fname(root)
+  tmp_name = fname + '.tmp'
+  with open(tmp_name, 'w') as fout:
+    json.dump(snapshot, fout)
+  os.rename(tmp_name, fname)
+
+
+def load(root):
+  """Returns the last snapshot of root or None."""
+  try:
+    with open(_fname(root)) as fin:
+      snapshot = json.load(fin)
+  except (IOError, OSError, ValueError):
+    return None
+  if snapshot.get('version') != SNAPSHOT_VERSION:
+    return None
+  return snapshot
+
+
+def _same_dir(root, dirname, dir_mtime, files):
+  """True if dirname and its tracked `files` ({name: stat key}) are unchanged."""
+  path = os.path.normpath(os.path.join(root, dirname))
+  try:
+    if os.lstat(path).st_mtime_ns != dir_mtime:
+      return False
+    if not files:
+      return True
+    found = 0
+    with os.scandir(path) as entries:
+      for entry in entries:
+        key = files.get(entry.name)
+        if key is None:
+          continue
+        if _stat_key(entry.stat(follow_symlinks=False)) != key:
+          return False
+        found += 1
+  except OSError:
+    return False
+  return found == len(files)
+
+
+def unchanged(root, snapshot, state_file, workers=None):
+  """True if nothing changed in root since the snapshot."""
+  try:
+    state = _stat_key(os.lstat(os.path.join(root, state_file)))
+  except OSError:
+    state = None
+  if state != snapshot['state']:
+    return False
+  by_dir = collections.defaultdict(dict)
+  for path, key in snapshot['files'].items():
+    by_dir[os.path.normpath(os.path.dirname(path) or '.')][os.path.basename(path)] = key
+  if set(by_dir) - set(snapshot['dirs']):
+    return False
+  dirs = sorted(snapshot['dirs'])
+  with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+    same = executor.map(
+        lambda dirname: _same_dir(root, dirname, snapshot['dirs'][dirname],
+                                  by_dir.get(dirname)), dirs)
+    return all(same)
+
+
+def needs_commit(vcs, root='.', verbose=False):
+  """Like vcs.needs_commit() but skips asking when nothing changed.
+  Args:
+    vcs: the mercurial or git module.
+    root: the top of the working copy.
+  """
+  snapshot = load(root)
+  hit = bool(snapshot and snapshot['vcs'] == vcs.NAME
+             and unchanged(root, snapshot, vcs.STATE_FILE))
+  metrics.cache_lookup('snapshot', hit)
+  if hit:
+    if verbose:
+      print('%s does not need a commit (unchanged since last check)' % vcs.NAME)
+    return False
+  if vcs.needs_commit(verbose):
+    return True
+  tracked = vcs.tracked_files()
+  if tracked is not None:
+    snapshot = take(root, vcs.NAME, tracked, vcs.STATE_FILE)
+    if snapshot:
+      save(root, snapshot)
+  return False
@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2010 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Translation memory shared by all your projects.
+
+Every translated message of every .po file found under the locale
+directories you list (setup.TM_LOCALE_DIRS, defaults to the project's own
+locale dir) is stored in ~/.cache/pybdist/tm/memory.sqlite.  When a
+catalog is created or updated its untranslated messages are looked up in
+bulk, exact matches are filled in and close matches are filled in and
+marked fuzzy.
+
+Close matches come from a trigram full text index (sqlite FTS5 with the
+trigram tokenizer, or a plain trigram table on older sqlite versions) so
+lookups stay fast with hundreds of thousands of segments.
+
+When a .po file changes its old segments are replaced by the new ones, and
+if the same message has several translations the newest one is used.
+"""
+
+__author__ = 'Scott Kirkwood (scott+pybdist@forusers.com)'
+
+import difflib
+import os
+import sqlite3
+
+try:
+  import polib
+except ImportError:
+  raise ImportError('You need to install polib, try sudo "apt-get install python-polib"')
+
+from . import cache
+from . import util
+
+FUZZY_THRESHOLD = 0.7
+MAX_CANDIDATES = 10
+# Trigrams used in a fuzzy query, spread over the message.
+MAX_QUERY_TRIGRAMS = 32
+# Exact and fuzzy lookups are done this many at a time.
+BATCH_SIZE = 500
+# Change when the tables change, the memory is then rebuilt.
+SCHEMA_VERSION = 3
+
+def _trigrams(text):
+  text = ' '.join(text.lower().split())
+  return sorted(set(text[i:i + 3] for i in range(len(text) - 2)))
+
+
+def _sample(items, num):
+  if len(items) <= num:
+    return items
+  step = len(items) / float(num)
+  return [items[int(i * step)] for i in range(num)]
+
+
+class TranslationMemory(object):
+  """The sqlite backed store of (lang, msgctxt, msgid, msgstr) segments."""
+
+  def __init__(self, fname=None):
+    if not fname:
+      fname = os.path.join(util.get_cache_dir('tm'), 'memory.sqlite')
+    self.fname = fname
+    self.conn = sqlite3.connect(fname)
+    self.use_fts = self._has_fts_trigram()
+    self._create_tables()
+
+  def _has_fts_trigram(self):
+    try:
+      self.conn.execute(
+          "CREATE VIRTUAL TABLE IF NOT EXISTS temp.fts_probe "
+          "USING fts5(x, tokenize='trigram')")
+    except sqlite3.OperationalError:
+      return False
+    return True
+
+  def _create_tables(self):
+    if self.conn.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+      # It's only a cache of the .po files, start over.
+      self.conn.executescript('''
+          DROP TABLE IF EXISTS segments_fts;
+          DROP TABLE IF EXISTS trigrams;
+          DROP TABLE IF EXISTS source_segments;
+          DROP TABLE IF EXISTS sources;
+          DROP TABLE IF EXISTS segments;
+          PRAGMA user_version = %d;
+      ''' % SCHEMA_VERSION)
+    self.conn.executescript('''
+        CREATE TABLE IF NOT EXISTS segments (
+            id INTEGER PRIMARY KEY,
+            lang TEXT NOT NULL,
+            msgctxt TEXT NOT NULL DEFAULT '',
+            msgid TEXT NOT NULL,
+            msgstr TEXT NOT NULL,
+            seq INTEGER NOT NULL DEFAULT 0,
+            UNIQUE (lang, msgctxt, msgid, msgstr));
+        CREATE INDEX IF NOT EXISTS segments_lookup ON segments (lang, msgid);
+        CREATE TABLE IF NOT EXISTS sources (
+            path TEXT PRIMARY KEY,
+            hash TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS source_segments (
+            path TEXT NOT NULL,
+            id INTEGER NOT NULL,
+            PRIMARY KEY (path, id));
+        CREATE INDEX IF NOT EXISTS source_segments_id ON source_segments (id);
+    ''')
+    if self.use_fts:
+      self.conn.execute(
+          "CREATE VIRTUAL TABLE IF NOT EXISTS segments_fts USING fts5("
+          "msgid, content='segments', content_rowid='id', tokenize='trigram')")
+    else:
+      self.conn.executescript('''
+          CREATE TABLE IF NOT EXISTS trigrams (
+              tri TEXT NOT NULL,
+              id INTEGER NOT NULL);
+          CREATE INDEX IF NOT EXISTS trigrams_tri ON trigrams (tri);
+          CREATE INDEX IF NOT EXISTS trigrams_id ON trigrams (id);
+      ''')
+    self.conn.commit()
+
+  def close(self):
+    self.conn.close()
+
+  def __len__(self):
+    return self.conn.execute('SELECT COUNT(*) FROM segments').fetchone()[0]
+
+  def _insert(self, lang, msgctxt, msgid, msgstr, seq):
+    """Add (or renew) the segment, returns its id."""
+    cursor = self.conn.execute(
+        'INSERT OR IGNORE INTO segments (lang, msgctxt, msgid, msgstr, seq) '
+        'VALUES (?, ?, ?, ?, ?)', (lang, msgctxt, msgid, msgstr, seq))
+    if not cursor.rowcount:
+      rowid = self.conn.execute(
+          'SELECT id FROM segments WHERE lang = ? AND msgctxt = ? AND msgid = ? '
+          'AND msgstr = ?', (lang, msgctxt, msgid, msgstr)).fetchone()[0]
+      self.conn.execute('UPDATE segments SET seq = ? WHERE id = ?', (seq, rowid))
+      return rowid
+    rowid = cursor.lastrowid
+    if self.use_fts:
+      self.conn.execute('INSERT INTO segments_fts (rowid, msgid) VALUES (?, ?)',
+                        (rowid, msgid))
+    else:
+      self.conn.executemany('INSERT INTO trigrams (tri, id) VALUES (?, ?)',
+                            [(tri, rowid) for tri in _trigrams(msgid)])
+    return rowid
+
+  def _forget_source(self, path):
+    """Remove the segments only path had.
+
+    Only looks at path's segments, every query uses an index.
+    """
+    ids = [row[0] for row in self.conn.execute(
+        'SELECT id FROM source_segments WHERE path = ?', (path,))]
+    self.conn.execute('DELETE FROM source_segments WHERE path = ?', (path,))
+    for rowid in ids:
+      if self.conn.execute('SELECT 1 FROM source_segments WHERE id = ? LIMIT 1',
+                           (rowid,)).fetchone():
+        continue
+      msgid = self.conn.execute('SELECT msgid FROM segments WHERE id = ?',
+                                (rowid,)).fetchone()[0]
+      if self.use_fts:
+        self.conn.execute(
+            "INSERT INTO segments_fts (segments_fts, rowid, msgid) VALUES ('delete', ?, ?)",
+            (rowid, msgid))
+      else:
+        self.conn.execute('DELETE FROM trigrams WHERE id = ?', (rowid,))
+      self.conn.execute('DELETE FROM segments WHERE id = ?', (rowid,))
+
+  def add_po_file(self, fname, lang):
+    """Add the translated messages of fname, skipped if unchanged.
+    Returns:
+      True if the file was read.
+    """
+    path = os.path.abspath(fname)
+    digest = cache.file_hash(fname)
+    row = self.conn.execute('SELECT hash FROM sources WHERE path = ?',
+                            (path,)).fetchone()
+    if row and row[0] == digest:
+      return False
+    with self.conn:
+      self._forget_source(path)
+      seq = self.conn.execute('SELECT COALESCE(MAX(seq), 0) + 1 FROM segments').fetchone()[0]
+      for entry in polib.pofile(fname):
+        if (entry.obsolete or 'fuzzy' in entry.flags or not entry.msgstr
+            or entry.msgid_plural):
+          continue
+        rowid = self._insert(lang, entry.msgctxt or '', entry.msgid,
+                             entry.msgstr, seq)
+        self.conn.execute('INSERT OR IGNORE INTO source_segments (path, id) VALUES (?, ?)',
+                          (path, rowid))
+      self.conn.execute('INSERT OR REPLACE INTO sources (path, hash) VALUES (?, ?)',
+                        (path, digest))
+    return True
+
+  def import_locale_dirs(self, locale_dirs):
+    """Add every <dir>/<lang>/LC_MESSAGES/*.po file."""
+    num_read = 0
+    for locale_dir in locale_dirs:
+      locale_dir = os.path.expanduser(locale_dir)
+      if not os.path.isdir(locale_dir):
+        continue
+      for lang in sorted(os.listdir(locale_dir)):
+        curdir = os.path.join(locale_dir, lang, 'LC_MESSAGES')
+        if not os.path.isdir(curdir):
+          continue
+        for fname in sorted(os.listdir(curdir)):
+          if fname.endswith('.po'):
+            if self.add_po_file(os.path.join(curdir, fname), lang):
+              num_read += 1
+    return num_read
+
+  def _exact(self, lang, keys):
+    """Returns {(msgctxt, msgid): msgstr} for the keys found as is, the newest
+    translation."""
+    wanted = set(keys)
+    msgids = sorted(set(msgid for _, msgid in keys))
+    ret = {}
+    for start in range(0, len(msgids), BATCH_SIZE):
+      batch = msgids[start:start + BATCH_SIZE]
+      marks = ','.join('?' * len(batch))
+      rows = self.conn.execute(
+          'SELECT msgctxt, msgid, msgstr FROM segments '
+          'WHERE lang = ? AND msgid IN (%s) ORDER BY seq, id' % marks,
+          [lang] + batch)
+      for msgctxt, msgid, msgstr in rows:
+        if (msgctxt, msgid) in wanted:
+          ret[(msgctxt, msgid)] = msgstr
+    return ret
+
+  def _candidates(self, lang, msgids):
+    """Returns {msgid: [(cand_msgid, cand_msgstr), ...]} with one query for
+    all the msgids."""
+    self.conn.execute('CREATE TEMP TABLE IF NOT EXISTS fuzzy_queries ('
+                      'num INTEGER NOT NULL, query TEXT NOT NULL)')
+    self.conn.execute('CREATE INDEX IF NOT EXISTS temp.fuzzy_queries_num '
+                      'ON fuzzy_queries (num)')
+    self.conn.execute('DELETE FROM temp.fuzzy_queries')
+    queries = []
+    for num, msgid in enumerate(msgids):
+      trigrams = _sample(_trigrams(msgid), MAX_QUERY_TRIGRAMS)
+      if not trigrams:
+        continue
+      if self.use_fts:
+        queries.append(
+            (num, ' OR '.join('"%s"' % tri.replace('"', '""') for tri in trigrams)))
+      else:
+        queries += [(num, tri) for tri in trigrams]
+    self.conn.executemany('INSERT INTO temp.fuzzy_queries (num, query) VALUES (?, ?)',
+                          queries)
+    # The language is filtered before the LIMIT, other languages mustn't
+    # take the places.
+    if self.use_fts:
+      rows = self.conn.execute(
+          'SELECT q.num, s.msgid, s.msgstr FROM temp.fuzzy_queries q '
+          'JOIN segments s ON s.id IN '
+          '(SELECT f.rowid FROM segments_fts f JOIN segments l ON l.id = f.rowid '
+          ' WHERE segments_fts MATCH q.query AND l.lang = ? '
+          ' ORDER BY bm25(segments_fts) LIMIT ?)', (lang, MAX_CANDIDATES))
+    else:
+      rows = self.conn.execute(
+          'SELECT n.num, s.msgid, s.msgstr FROM '
+          '(SELECT DISTINCT num FROM temp.fuzzy_queries) n '
+          'JOIN segments s ON s.id IN '
+          '(SELECT t.id FROM temp.fuzzy_queries q '
+          ' JOIN trigrams t ON t.tri = q.query '
+          ' JOIN segments l ON l.id = t.id '
+          ' WHERE q.num = n.num AND l.lang = ? '
+          ' GROUP BY t.id ORDER BY COUNT(*) DESC LIMIT ?)',
+          (lang, MAX_CANDIDATES * 4))
+    ret = {}
+    for num, cand_msgid, cand_msgstr in rows:
+      ret.setdefault(msgids[num], []).append((cand_msgid, cand_msgstr))
+    return ret
+
+  def _fuzzy(self, lang, msgids, threshold):
+    """Returns {msgid: (cand_msgid, cand_msgstr)} of the best close matches."""
+    ret = {}
+    for start in range(0, len(msgids), BATCH_SIZE):
+      batch = msgids[start:start + BATCH_SIZE]
+      for msgid, candidates in self._candidates(lang, batch).items():
+        best = (0, None, None)
+        for cand_msgid, cand_msgstr in candidates:
+          score = difflib.SequenceMatcher(None, msgid, cand_msgid).ratio()
+          if score >= threshold and score > best[0]:
+            best = (score, cand_msgid, cand_msgstr)
+        if best[0]:
+          ret[msgid] = best[1:]
+    return ret
+
+  def lookup_many(self, lang, keys, threshold=FUZZY_THRESHOLD):
+    """Look up many messages at once.
+    Args:
+      lang: language of the translations.
+      keys: (msgctxt, msgid) pairs, msgctxt is '' when there's none.
+      threshold: minimum similarity of a close match.
+    Returns:
+      {(msgctxt, msgid): (msgstr, previous_msgid or None if exact)}
+    """
+    keys = list(keys)
+    ret = {}
+    for key, msgstr in list(self._exact(lang, keys).items()):
+      ret[key] = (msgstr, None)
+    todo = sorted(set(msgid for msgctxt, msgid in keys
+                      if (msgctxt, msgid) not in ret))
+    close = self._fuzzy(lang, todo, threshold)
+    for key in keys:
+      if key not in ret and key[1] in close:
+        cand_msgid, cand_msgstr = close[key[1]]
+        ret[key] = (cand_msgstr, cand_msgid)
+    return ret
+
+  def prefill_po_file(self, fname, lang):
+    """Fill untranslated messages of fname from the memory.
+    Returns:
+      (number exact, number fuzzy)
+    """
+    po = polib.pofile(fname)
+    todo = [entry for entry in po
+            if not entry.obsolete and not entry.msgid_plural
+            and not entry.msgstr and 'fuzzy' not in entry.flags]
+    if not todo:
+      return 0, 0
+    found = self.lookup_many(lang, [(entry.msgctxt or '', entry.msgid)
+                                    for entry in todo])
+    num_exact = num_fuzzy = 0
+    for entry in todo:
+      key = (entry.msgctxt or '', entry.msgid)
+      if key not in found:
+        continue
+      msgstr, previous = found[key]
+      entry.msgstr = msgstr
+      if previous is None:
+        num_exact += 1
+      else:
+        entry.flags.append('fuzzy')
+        entry.previous_msgid = previous
+        num_fuzzy += 1
+    if num_exact or num_fuzzy:
+      po.save(fname)
+    return num_exact, num_fuzzy
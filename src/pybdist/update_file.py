@@ -28,7 +28,11 @@ class UpdateFileException(Exception):
   pass
 
 class OverwriteFile(object):
-  """Class to use to overwrite a file."""
+  """Class to use to overwrite a file.
+
+  Writes are buffered in memory and go to disk in a single write when the
+  file is flushed.
+  """
 
   def __init__(self):
     self.prefix = None
@@ -38,17 +42,19 @@ class OverwriteFile(object):
     self.fname = None
     self.t_out = None
     self.fname_tmp = None
+    self.buffer = []
 
   def open(self, fname):
     basename = os.path.basename(fname)
-    name, ext = os.path.split(basename)
+    name, ext = os.path.splitext(basename)
     self.prefix = name
     self.postfix = ext + '_bak'
     self.fname = fname
     if not os.path.exists(fname):
       raise UpdateFileException('File not found %r' % self.fname)
     self.old_stat = os.stat(fname).st_mode
-    self.fin = open(self.fname, 'r')
+    # newline='' keeps the line endings (ex. \r\n) as they are.
+    self.fin = open(self.fname, 'r', encoding='utf-8', newline='')
     if not self.fin:
       raise UpdateFileException('Unable to open file %r' % self.fname)
     self.dirname = os.path.dirname(self.fname)
@@ -63,25 +69,242 @@ class OverwriteFile(object):
     return self.fin
 
   def write(self, text):
-    """Write to the temp file."""
-    os.write(self.t_out, text)
+    """Buffer text for the temp file."""
+    self.buffer.append(text)
 
-  def close(self):
-    """Closes the input and output and overwrite self.fname."""
+  def flush(self):
+    """Write the buffer to the temp file and close it, doesn't overwrite."""
     if not self.t_out:
       return
+    data = ''.join(self.buffer).encode('utf-8')
+    self.buffer = []
+    while data:
+      written = os.write(self.t_out, data)
+      data = data[written:]
+    os.fsync(self.t_out)
     os.close(self.t_out)
     self.fin.close()
     self.t_out = None
     self.fin = None
 
+  def replace(self):
+    """Overwrite self.fname with the flushed temp file."""
+    if not self.fname_tmp:
+      return
     # Note: This only works correctly on POSIX systems
     # i.e. it overwrites the destination
     os.rename(self.fname_tmp, self.fname)
     os.chmod(self.fname, self.old_stat)
+    self.fname_tmp = None
+
+  def discard(self):
+    """Throw away the temp file leaving self.fname untouched."""
+    if self.t_out:
+      os.close(self.t_out)
+      self.fin.close()
+      self.t_out = None
+      self.fin = None
+    if self.fname_tmp:
+      os.unlink(self.fname_tmp)
+      self.fname_tmp = None
+    self.buffer = []
+
+  def close(self):
+    """Closes the input and output and overwrite self.fname."""
+    if not self.t_out:
+      return
+    self.flush()
+    self.replace()
 
   def __del__(self):
-    self.close()
+    # Never overwrite from here, the buffer may be incomplete.
+    self.discard()
+
+
+class Transaction(object):
+  """Stage edits to several files, then commit them all or none.
+
+  Example:
+    with update_file.Transaction() as trans:
+      trans.update_lines('setup.py', regex, '1.2')
+      trans.insert_before('debian/changelog', text)
+
+  Edits to the same file see the result of earlier edits. Nothing on disk
+  changes until commit(), and if any file fails to be written the ones
+  already replaced are put back.
+
+  patch_bytes() edits are different, they are written in place, from the
+  first changed byte onward, instead of rewriting the whole file.
+  """
+
+  def __init__(self):
+    self.files = {}  # fname -> OverwriteFile
+    self.lines = {}  # fname -> list of staged lines
+    self.order = []
+    self.patches = {}  # fname -> list of (start, end, data)
+
+  def _get_lines(self, fname):
+    if fname in self.patches:
+      raise UpdateFileException('%r already has byte patches staged' % fname)
+    if fname not in self.files:
+      update = OverwriteFile()
+      update.open(fname)
+      self.files[fname] = update
+      # splitlines() like version_scan.scan_file(), so line numbers agree.
+      self.lines[fname] = ''.join(update.readlines()).splitlines(True)
+      self.order.append(fname)
+    return self.lines[fname]
+
+  def insert_before(self, fname, text, del_lines=0):
+    """Stage inserting `text` at the start of the file.
+    Args:
+      fname: filename
+      text: text to write
+      del_lines: number of lines to remove from original start of file."""
+    lines = self._get_lines(fname)
+    if lines and lines[0].endswith('\r\n'):
+      text = text.replace('\r\n', '\n').replace('\n', '\r\n')
+    lines[:del_lines] = [text]
+
+  def update_lines(self, fname, regex, replace, max_replaces=1, min_replaces=1):
+    """Stage replacing group(1) of `regex` with `replace`, see update_lines()."""
+    re_f = re.compile(regex)
+    if re_f.groups != 1:
+      raise UpdateFileException('Your regex must have exactly 1 group %r' % regex)
+    lines = self._get_lines(fname)
+    num_replaces = 0
+    for num, line in enumerate(lines):
+      if num_replaces >= max_replaces:
+        break
+      # Without the line ending so $ matches before \r\n too.
+      body = line.rstrip('\r\n')
+      match = re_f.search(body)
+      if match:
+        num_replaces += 1
+        lines[num] = line[:match.start(1)] + replace + line[match.end(1):]
+    if num_replaces < min_replaces:
+      raise UpdateFileException('Not enough replacements performed on %r' % fname)
+
+  def replace_span(self, fname, lineno, start, end, text):
+    """Stage replacing line[start:end] of line number `lineno` (1 based)."""
+    lines = self._get_lines(fname)
+    if lineno < 1 or lineno > len(lines):
+      raise UpdateFileException('%r has no line %d' % (fname, lineno))
+    line = lines[lineno - 1]
+    lines[lineno - 1] = line[:start] + text + line[end:]
+
+  def patch_bytes(self, fname, start, end, data):
+    """Stage replacing bytes [start, end) of the file with `data` (bytes).
+
+    Offsets are in the original file, patches must not overlap.
+    """
+    if fname in self.files:
+      raise UpdateFileException('%r already has line edits staged' % fname)
+    if not os.path.exists(fname):
+      raise UpdateFileException('File not found %r' % fname)
+    self.patches.setdefault(fname, []).append((start, end, data))
+
+  def commit(self):
+    """Write every staged file, then overwrite them all."""
+    try:
+      for fname in self.order:
+        update = self.files[fname]
+        update.write(''.join(self.lines[fname]))
+        update.flush()
+    except:
+      self.rollback()
+      raise
+
+    saved = []
+    undo = []
+    try:
+      for fname in sorted(self.patches):
+        undo.append(_apply_patches(fname, self.patches[fname]))
+      for fname in self.order:
+        saved_name = self.files[fname].fname_tmp + '_orig'
+        os.link(fname, saved_name)
+        saved.append((fname, saved_name))
+        self.files[fname].replace()
+    except:
+      for fname, saved_name in saved:
+        os.rename(saved_name, fname)
+      for fname, offset, tail in undo:
+        _write_tail(fname, offset, tail)
+      self.rollback()
+      raise
+    for _, saved_name in saved:
+      os.unlink(saved_name)
+    self._reset()
+
+  def rollback(self):
+    """Throw away all staged edits."""
+    for update in list(self.files.values()):
+      update.discard()
+    self._reset()
+
+  def _reset(self):
+    self.files = {}
+    self.lines = {}
+    self.order = []
+    self.patches = {}
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, unused_exc_value, unused_traceback):
+    if exc_type:
+      self.rollback()
+    else:
+      self.commit()
+    return False
+
+
+def _write_tail(fname, offset, tail):
+  """Overwrite fname from `offset` on with `tail` and truncate it there."""
+  with open(fname, 'r+b') as fout:
+    fout.seek(offset)
+    fout.write(tail)
+    fout.truncate()
+    fout.flush()
+    os.fsync(fout.fileno())
+
+
+def _apply_patches(fname, patches):
+  """Apply byte patches in place.
+
+  If every patch keeps its length only those bytes are written, otherwise
+  the file is rewritten from the first patch onward.
+  Returns:
+    (fname, offset, old_tail) to undo with _write_tail().
+  """
+  patches = sorted(patches)
+  for (_, end, _), (start, _, _) in zip(patches, patches[1:]):
+    if start < end:
+      raise UpdateFileException('Overlapping patches in %r' % fname)
+  first = patches[0][0]
+  with open(fname, 'rb') as fin:
+    fin.seek(first)
+    old_tail = fin.read()
+  if first + len(old_tail) < patches[-1][1]:
+    raise UpdateFileException('Patch past the end of %r' % fname)
+  if all(end - start == len(data) for start, end, data in patches):
+    with open(fname, 'r+b') as fout:
+      for start, _, data in patches:
+        fout.seek(start)
+        fout.write(data)
+      fout.flush()
+      os.fsync(fout.fileno())
+    return (fname, first, old_tail)
+  new_tail = []
+  pos = first
+  for start, end, data in patches:
+    new_tail.append(old_tail[pos - first:start - first])
+    new_tail.append(data)
+    pos = end
+  new_tail.append(old_tail[pos - first:])
+  _write_tail(fname, first, b''.join(new_tail))
+  return (fname, first, old_tail)
+
 
 def insert_before(fname, text, del_lines=0):
   """Inserts `text` at the start of the file.
@@ -89,15 +312,8 @@ def insert_before(fname, text, del_lines=0):
     fname: filanem
     text: text to write
     del_lines: number of lines to remove from original start of file."""
-  update = OverwriteFile()
-  update.open(fname)
-  update.write(text)
-  for line in update.readlines():
-    if del_lines:
-      del_lines -= 1
-      continue
-    update.write(line)
-  update.close()
+  with Transaction() as trans:
+    trans.insert_before(fname, text, del_lines)
 
 def update_lines(fname, regex, replace, max_replaces=1, min_replaces=1):
   """Looks for `regex` and replaces group(1) with `replace`.
@@ -109,25 +325,5 @@ def update_lines(fname, regex, replace, max_replaces=1, min_replaces=1):
     replace: The text to replace in group 1.
     max_replaces: Number of replaces expected, for speed and safety.
   """
-  re_f = re.compile(regex)
-  update = OverwriteFile()
-  update.open(fname)
-  num_replaces = 0
-  for line in update.readlines():
-    if max_replaces > 0:
-      match = re_f.search(line)
-      if max_replaces > 0 and match:
-        if len(match.groups()) != 1:
-          raise UpdateFileException('Your regex must have exactly 1 group %r' % regex)
-        max_replaces -= 1
-        num_replaces += 1
-        update.write(line[:match.start(1)])
-        update.write(re_f.sub(line, replace))
-        update.write(line[match.end(1):])
-      else:
-        update.write(line)
-    else:
-      update.write(line)
-  if num_replaces < min_replaces:
-    raise UpdateFileException('Not enough replacements performed on %r' % fname)
-  update.close()
+  with Transaction() as trans:
+    trans.update_lines(fname, regex, replace, max_replaces, min_replaces)
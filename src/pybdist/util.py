@@ -23,18 +23,56 @@ __author__ = 'Scott Kirkwood (scott+pybdist@forusers.com)'
 
 import codecs
 import filecmp
+import gettext
 import logging
 import os
 import tempfile
 
+from . import backup
+
 logging.basicConfig()
 LOG = logging.getLogger('pybdist')
 
-def _safe_overwrite(lines, fname):
+_TRANSLATIONS = None
+
+# Directories that never hold the project's own sources, hidden ones
+# (.git, .venv, .tox, ...) and *.egg-info are skipped too.
+SKIP_DIRS = frozenset(['__pycache__', 'build', 'dist', 'tmp', 'venv',
+                       'node_modules', 'site-packages'])
+
+def translate(message):
+  """Returns message translated in pybdist's catalog.
+
+  The catalog is only looked up the first time, replaces calling
+  gettext.install('pybdist') when a module is imported.
+  """
+  global _TRANSLATIONS
+  if _TRANSLATIONS is None:
+    _TRANSLATIONS = gettext.translation('pybdist', fallback=True)
+  return _TRANSLATIONS.gettext(message)
+
+def skip_dir(dirname):
+  """True if os.walk() shouldn't go into dirname (a basename)."""
+  return (dirname.startswith('.') or dirname in SKIP_DIRS
+          or dirname.endswith('.egg-info') or dirname.startswith('debian-'))
+
+def get_cache_dir(name):
+  """Returns (and creates) ~/.cache/pybdist/<name>.
+
+  Honors $XDG_CACHE_HOME.
+  """
+  cache_home = os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache'))
+  dirname = os.path.join(cache_home, 'pybdist', name)
+  if not os.path.isdir(dirname):
+    os.makedirs(dirname, exist_ok=True)
+  return dirname
+
+def _safe_overwrite(lines, fname, project=None):
   """Given the new text string overwrite fname.
 
-  Leaves the old version in /tmp/pybdist/ folder, this is ok since you should
-  be using a version control system anyway, right?
+  Leaves the old version in the backup store (see backup.py), use --backups
+  to list them, --restore-backup to get one back and --prune-backups to drop
+  the old ones.
 
   Asks if you want to overwrite.
   Doesn't ask if the files are identical.
@@ -43,6 +81,7 @@ def _safe_overwrite(lines, fname):
   Args:
     text: lines, list of lines
     fname: filename to overwrite
+    project: name of the project, used to file the backup.
   """
 
   can_overwrite = True
@@ -76,10 +115,9 @@ def _safe_overwrite(lines, fname):
       LOG.info('User requested not to overwrite')
       return  # nope
 
-  backup_name = os.path.join(tmpdir, os.path.basename(fname))
   if os.path.exists(fname):
-    LOG.info('backup stored at %r', backup_name)
-    os.rename(fname, backup_name)
+    digest = backup.store(fname, project)
+    LOG.info('backup stored as %s', digest)
   os.rename(out_tempname, fname)
   LOG.info('Wrote %r', fname)
   print('Updated %r' % fname)
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2010 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Finds every version string in a project and optionally bumps them.
+
+The project's source files are scanned in parallel with one combined
+regular expression, each alternative has a named group which says what
+kind of version it is.  The result is a list of
+Occurrence(fname, lineno, start, end, kind, version) where start and end
+is the span of the version inside the line.
+
+Only the files under version control are scanned (every file when the
+project isn't in git or mercurial), and of those only the kinds of files
+in SOURCE_EXTS and SOURCE_NAMES, never hidden, virtualenv or build
+directories.  Files that aren't UTF-8 are skipped.
+"""
+
+__author__ = 'Scott Kirkwood (scott+pybdist@forusers.com)'
+
+import collections
+import concurrent.futures
+import os
+import re
+
+from . import update_file
+from . import util
+
+Occurrence = collections.namedtuple(
+    'Occurrence', 'fname lineno start end kind version')
+
+_VER = r'\d+(?:\.\d+)+(?:[-.]?(?:a|b|c|rc|dev|post)\d*)?'
+
+# One alternative per kind of version, the group name is the kind.
+RE_VERSIONS = re.compile('|'.join([
+    r'''^VER\s*=\s*['"](?P<setup>[^'"]+)['"]''',
+    r'''__version__\s*=\s*['"](?P<source>[^'"]+)['"]''',
+    r'''\bversion\s*[=:]\s*['"](?P<keyword>%s)['"]''' % _VER,
+    r'''^Version:\s*(?P<header>%s)\s*$''' % _VER,
+    r'''^[\w.+-]+ \((?P<changelog>%s)(?:-[^)]*)?\) ''' % _VER,
+    r''' v (?P<release>%s)$''' % _VER,
+    ]))
+
+# These are histories, only the first (newest) entry is the current version.
+HISTORY_KINDS = set(['changelog', 'release'])
+
+SKIP_DIRS = set(['locale'])
+SOURCE_EXTS = set(['.py', '.rst', '.txt', '.cfg', '.toml', '.ini', '.in', '.spec'])
+SOURCE_NAMES = set(['changelog', 'VERSION'])
+MAX_FILE_SIZE = 1024 * 1024
+
+class VersionScanException(Exception):
+  pass
+
+
+def _wanted_dir(dirname):
+  return dirname not in SKIP_DIRS and not util.skip_dir(dirname)
+
+
+def _is_source(fname):
+  basename = os.path.basename(fname)
+  return basename in SOURCE_NAMES or os.path.splitext(basename)[1] in SOURCE_EXTS
+
+
+def _tracked_files():
+  """The files under version control (relative to the current directory) or None."""
+  from . import git
+  tracked = git.tracked_files()
+  if tracked is None:
+    from . import mercurial
+    tracked = mercurial.tracked_files()
+  return tracked
+
+
+def _walk(root):
+  ret = []
+  for dirpath, dirnames, fnames in os.walk(root):
+    dirnames[:] = sorted(d for d in dirnames if _wanted_dir(d))
+    ret += [os.path.join(dirpath, fname) for fname in sorted(fnames)]
+  return ret
+
+
+def _list_files(root):
+  tracked = None
+  if os.path.abspath(root) == os.getcwd():
+    tracked = _tracked_files()
+  if tracked is None:
+    fnames = _walk(root)
+  else:
+    fnames = [fname for fname in sorted(tracked)
+              if all(_wanted_dir(part) for part in fname.split('/')[:-1])]
+  ret = []
+  for fname in fnames:
+    if (_is_source(fname) and os.path.isfile(fname)
+        and os.path.getsize(fname) <= MAX_FILE_SIZE):
+      ret.append(os.path.normpath(fname))
+  return ret
+
+
+def scan_file(fname):
+  """Returns the list of Occurrences in fname."""
+  with open(fname, 'rb') as fin:
+    data = fin.read()
+  if b'\0' in data[:1024]:
+    return []
+  try:
+    text = data.decode('utf-8')
+  except UnicodeDecodeError:
+    # Rewriting it would mangle it.
+    return []
+  ret = []
+  seen_kinds = set()
+  # Same line numbering as update_file.Transaction, ex. a bare \r ends a line.
+  for lineno, line in enumerate(text.splitlines(), 1):
+    for match in RE_VERSIONS.finditer(line):
+      kind = match.lastgroup
+      if kind in HISTORY_KINDS:
+        if kind in seen_kinds:
+          continue
+        seen_kinds.add(kind)
+      ret.append(Occurrence(fname, lineno, match.start(kind), match.end(kind),
+                            kind, match.group(kind)))
+  return ret
+
+
+def _scan_files(fnames):
+  ret = []
+  for fname in fnames:
+    ret += scan_file(fname)
+  return ret
+
+
+def scan(root='.', workers=None, chunk_size=32):
+  """Scan every file below root in parallel.
+
+  Args:
+    root: top directory of the project.
+    workers: number of processes, None for one per cpu.
+    chunk_size: files handed to a worker at a time.
+  Returns:
+    list of Occurrence sorted by filename and line.
+  """
+  fnames = _list_files(root)
+  chunks = [fnames[i:i + chunk_size] for i in range(0, len(fnames), chunk_size)]
+  ret = []
+  if len(chunks) <= 1:
+    for chunk in chunks:
+      ret += _scan_files(chunk)
+  else:
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+      for found in executor.map(_scan_files, chunks):
+        ret += found
+  ret.sort()
+  return ret
+
+
+def find_mismatches(occurrences, expected):
+  """Returns the occurrences whose version isn't `expected`."""
+  return [occ for occ in occurrences if occ.version != expected]
+
+
+def report(occurrences, expected):
+  """Print the occurrences and return True if they all agree."""
+  mismatches = find_mismatches(occurrences, expected)
+  for occ in occurrences:
+    if occ in mismatches:
+      flag = '**'
+    else:
+      flag = '  '
+    print('%s %s:%d %s = %r' % (flag, occ.fname, occ.lineno, occ.kind, occ.version))
+  if mismatches:
+    print('** %d of %d version strings are not %r' % (
+        len(mismatches), len(occurrences), expected))
+    return False
+  print('   All %d version strings are %r' % (len(occurrences), expected))
+  return True
+
+
+def planned_edits(occurrences, new_version):
+  """Returns the occurrences rewrite() would change.
+
+  History files (RELEASE.rst, debian/changelog) are left alone, they need a
+  new entry not a renamed one.
+  """
+  return [occ for occ in occurrences
+          if occ.kind not in HISTORY_KINDS and occ.version != new_version]
+
+
+def print_plan(edits, new_version):
+  for occ in edits:
+    print('   %s:%d %s %r -> %r' % (occ.fname, occ.lineno, occ.kind, occ.version,
+                                    new_version))
+
+
+def rewrite(occurrences, new_version):
+  """Replace the planned_edits() with new_version, all files or none."""
+  with update_file.Transaction() as trans:
+    # Backwards so earlier spans on the same line stay valid.
+    for occ in sorted(planned_edits(occurrences, new_version), reverse=True):
+      trans.replace_span(occ.fname, occ.lineno, occ.start, occ.end, new_version)
+
+
+if __name__ == '__main__':
+  import sys
+  OCCURRENCES = scan('.')
+  if len(sys.argv) > 1:
+    report(OCCURRENCES, sys.argv[1])
+  else:
+    for OCC in OCCURRENCES:
+      print(OCC)